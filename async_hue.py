@@ -0,0 +1,203 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from pyhue import Hue, LightStateResult
+from rate_limit import bucket_for_request
+from transport import HueRequestError, request_failed
+
+
+class AsyncHue:
+    """
+    asyncio counterpart to Hue. Configuration and the cache.json file are shared with the given
+    (or a newly created) sync Hue client, all network traffic goes through one pooled httpx.AsyncClient.
+    """
+
+    def __init__(self, hue: Hue | None = None, max_concurrency: int = 8):
+        """
+        :param hue: Sync client to take the bridge configuration and cache from
+        :param max_concurrency: Maximum number of requests in flight at the same time
+        """
+        self.hue = hue if hue is not None else Hue()
+        self.max_concurrency = max_concurrency
+        self.client = self.create_client()
+
+    def create_client(self) -> httpx.AsyncClient:
+        headers = {}
+        if self.hue.api_username:
+            headers['hue-application-key'] = self.hue.api_username
+
+        return httpx.AsyncClient(
+            base_url=self.hue.bridge_clip_url or '',
+            headers=headers,
+            verify=self.hue.verify_ssl_cert,
+            timeout=httpx.Timeout(self.hue.transport.read_timeout, connect=self.hue.transport.connect_timeout),
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency),
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    # region CLIP API v2 request
+    async def clip_request(self, method: str,
+                           path: str,
+                           data: str | None = None,
+                           headers: dict | None = None,
+                           api_key_header: bool = True):
+        """
+        Send a CLIP request through the sync client's transport (timeouts, retries and the circuit breaker)
+        :return: (response, failed)
+        :raise HueConnectionError: If the bridge couldn't be reached (HueTimeoutError, HueCircuitOpenError)
+        """
+        if data is None and method != 'GET':
+            raise HueRequestError(f'Method \'{method}\' needs a \'data\' argument!')
+
+        if headers is None:
+            headers = {}
+
+        bucket = bucket_for_request(method, path)
+
+        async def send(timeout: tuple[float, float]):
+            (connect_timeout, read_timeout) = timeout
+            request = self.client.build_request(method, path, headers=headers, content=data,
+                                                timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+            if not api_key_header:
+                request.headers.pop('hue-application-key', None)
+
+            waited = await self.hue.rate_limiter.acquire_async(bucket)
+            start = time.perf_counter()
+            response = await self.client.send(request)
+            duration = time.perf_counter() - start
+            if self.hue.metrics is not None:
+                self.hue.observe_request(method, path, bucket, waited, response.status_code, duration,
+                                         data, response.content)
+            self.hue.trace_request(method, str(response.url), response.status_code, duration, data, response.content)
+            return response
+
+        response = await self.hue.transport.call_async(method, send, (httpx.TransportError,), (httpx.TimeoutException,),
+                                                       self.hue.count_retry)
+        return response, request_failed(response)
+
+    # endregion
+
+    # region GET: Light, rooms, scenes and Device info
+    async def _get_resource(self, cache_key: str, resource: str, cached: bool, policy: str | None,
+                            error_message: str):
+        """
+        Like Hue._get_resource, except that a collection missing from the cache is fetched here (without
+        storing it) instead of blocking the event loop on a cache refresh. Stale data is revalidated in a thread.
+        """
+        policy = self.hue.cache_policy(cache_key, cached, policy)
+        if policy != 'live':
+            cached_res = self.hue.get_from_cache(cache_key, policy)
+            if cached_res is not None:
+                return cached_res
+
+        (res, failed) = await self.clip_request('GET', f'/resource/{resource}')
+        if failed:
+            print(error_message)
+            return
+
+        return res.json()['data']
+
+    async def get_device_info(self, cached: bool = True, policy: str | None = None):
+        return await self._get_resource('device', 'device', cached, policy, 'unable to get device info!')
+
+    async def get_lights(self, cached: bool = True, policy: str | None = None):
+        return await self._get_resource('lights', 'light', cached, policy,
+                                        'Something went wrong trying to get the lights.')
+
+    async def get_scenes(self, cached: bool = True, policy: str | None = None):
+        return await self._get_resource('scenes', 'scene', cached, policy,
+                                        'Something went wrong trying to get the scenes.')
+
+    async def get_rooms(self, cached: bool = True, policy: str | None = None):
+        return await self._get_resource('rooms', 'room', cached, policy,
+                                        'Something went wrong trying to get the rooms.')
+
+    # endregion
+
+    # region SET: Light and room light states
+    async def put_light_state(self, light_id: str, data: str, resource: str = 'light') -> LightStateResult:
+        (res, failed) = await self.clip_request('PUT', f'/resource/{resource}/{light_id}', data)
+        try:
+            errors = res.json()['errors']
+        except (ValueError, KeyError):
+            errors = []
+        return LightStateResult(light_id, not failed, res.status_code, errors)
+
+    async def set_light_state(self, light_id: str, rgb: tuple[int, int, int], on_state: bool = True,
+                              brightness: int | None = None) -> LightStateResult:
+        req_data = self.hue.light_state(rgb, on_state, brightness, self.hue.light_gamut(light_id))
+
+        result = await self.put_light_state(light_id, json.dumps(req_data))
+        if not result.ok:
+            print(f'CLIP Req to set_light_state failed with status {result.status_code}. Is the given rid correct?')
+        return result
+
+    async def set_lights_state(self, light_ids: list[str], rgb: tuple[int, int, int], on_state: bool = True,
+                               brightness: int | None = None,
+                               max_concurrency: int | None = None) -> list[LightStateResult]:
+        """
+        Set many lights to the same state concurrently, converting and serialising the payload once per gamut
+        :param max_concurrency: Limit of concurrent PUTs (defaults to the client's max_concurrency)
+        """
+        payloads = self.hue.light_state_payloads(light_ids, rgb, on_state, brightness)
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def put_limited(light_id: str):
+            async with semaphore:
+                return await self.put_light_state(light_id, payloads[light_id])
+
+        return list(await asyncio.gather(*(put_limited(light_id) for light_id in light_ids)))
+
+    async def get_room(self, room_id: str, cached: bool = True, policy: str | None = None):
+        if self.hue.cache_policy('rooms', cached, policy) != 'live':
+            room = self.hue.cache_lookup('rooms', self.hue.cache.by_id('rooms', room_id), policy)
+            if room is not None:
+                return room
+
+        (res, failed) = await self.clip_request('GET', f'/resource/room/{room_id}')
+        if failed:
+            return None
+
+        return res.json()['data'][0]
+
+    async def set_grouped_light_state(self, grouped_light_id: str, rgb: tuple[int, int, int], on_state: bool = True,
+                                      brightness: int | None = None) -> LightStateResult:
+        req_data = self.hue.light_state(rgb, on_state, brightness)
+        return await self.put_light_state(grouped_light_id, json.dumps(req_data), resource='grouped_light')
+
+    async def set_room_light_states(self, room_id: str, rgb: tuple[int, int, int] | dict[str, tuple[int, int, int]],
+                                    brightness: int | None = None,
+                                    max_concurrency: int | None = None) -> list[LightStateResult] | None:
+        """
+        Set the lights of a room. One colour for the whole room is a single grouped_light command,
+        different colours per light are sent concurrently, one command per light.
+        :param rgb: One colour for all lights, or a dict of light id -> colour
+        :param max_concurrency: Limit of concurrent PUTs (defaults to the client's max_concurrency)
+        """
+        room = await self.get_room(room_id)
+        if room is None:
+            print(f'Something went wrong trying to get information for room {room_id} '
+                  f'while executing set_room_light_states!')
+            return
+
+        async def send(grouped_light_id: str | None, light_ids: list[str], colour: tuple[int, int, int]):
+            if grouped_light_id is not None:
+                return [await self.set_grouped_light_state(grouped_light_id, colour, True, brightness)]
+            return await self.set_lights_state(light_ids, colour, True, brightness, max_concurrency)
+
+        batches = await asyncio.gather(*(send(*command) for command in self.hue.room_commands(room, rgb)))
+        return [result for batch in batches for result in batch]
+
+    # endregion
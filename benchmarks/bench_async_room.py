@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Time setting the 20 lights of a room one by one, with the bulk APIs of Hue and AsyncHue,
+and with a single grouped_light command.
+Run from the repository root: python benchmarks/bench_async_room.py
+"""
+import asyncio
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+from async_hue import AsyncHue  # noqa: E402
+
+LIGHTS = 20
+LATENCY = 0.02
+
+
+def timed(label: str, fn):
+    start = time.perf_counter()
+    fn()
+    print(f'{label:<36} {time.perf_counter() - start:.3f} s')
+
+
+def main():
+    with FakeBridge(generate_home(lights=LIGHTS, lights_per_room=LIGHTS), latency=LATENCY) as bridge:
+        hue = client_for(bridge)
+        hue.refresh_cache(scheduled_refresh=True)
+        light_ids = [light['id'] for light in hue.get_lights()]
+        room_id = hue.get_rooms()[0]['id']
+
+        timed('set_light_state, one after another', lambda: [hue.set_light_state(i, (255, 0, 0)) for i in light_ids])
+        timed('Hue.set_lights_state', lambda: hue.set_lights_state(light_ids, (0, 255, 0)))
+
+        async def run_async():
+            async with AsyncHue(hue) as async_hue:
+                start = time.perf_counter()
+                await async_hue.set_lights_state(light_ids, (0, 0, 255))
+                print(f'{"AsyncHue.set_lights_state":<36} {time.perf_counter() - start:.3f} s')
+
+        asyncio.run(run_async())
+        timed('set_room_light_states (grouped)', lambda: hue.set_room_light_states(room_id, (255, 255, 255)))
+        hue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Compare name lookups that re-parse cache.json and scan the lights (the old get_light_by_name)
+against the resident ResourceCache index, and cold loads of one collection from cache.json
+against the sectioned cache.bin format.
+Run from the repository root: python benchmarks/bench_cache_lookup.py
+"""
+import json
+import random
+import sys
+import tempfile
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from cache_storage import CODEC_JSON, JsonCacheStorage, SectionedCacheStorage, default_codec  # noqa: E402
+from resource_cache import ResourceCache  # noqa: E402
+
+RESOURCES = 5000
+LOOKUPS = 200
+COLD_LOADS = 20
+
+
+def generate_cache(file_path: str):
+    def resources(prefix: str):
+        return [{'id': f'{prefix}-{i}', 'metadata': {'name': f'{prefix.title()} {i}'}} for i in range(RESOURCES)]
+
+    with open(file_path, 'w+') as file:
+        file.write(json.dumps({
+            'last_updated': int(time.time()),
+            'device': resources('device'),
+            'lights': resources('light'),
+            'rooms': resources('room'),
+            'scenes': resources('scene'),
+        }))
+
+
+def reparse_lookup(file_path: str, name: str):
+    with open(file_path, 'r') as file:
+        lights = json.loads(file.read())['lights']
+    for light in lights:
+        if light['metadata']['name'].lower() == name.lower():
+            return light
+    return None
+
+
+def bench(label: str, fn, names: list[str]):
+    start = time.perf_counter()
+    for name in names:
+        assert fn(name) is not None
+    elapsed = time.perf_counter() - start
+    print(f'{label:<22} {len(names) / elapsed:>12.1f} lookups/s  ({elapsed * 1e6 / len(names):.1f} us/lookup)')
+
+
+def bench_cold_load(label: str, storage, name: str):
+    start = time.perf_counter()
+    for _ in range(COLD_LOADS):
+        assert ResourceCache(storage).by_name('lights', name) is not None
+    elapsed = time.perf_counter() - start
+    print(f'{label:<32} {elapsed * 1000 / COLD_LOADS:>8.2f} ms/load')
+
+
+def main():
+    data_dir = tempfile.mkdtemp()
+    file_path = f'{data_dir}/cache.json'
+    generate_cache(file_path)
+    names = [f'LIGHT {random.randrange(RESOURCES)}' for _ in range(LOOKUPS)]
+
+    cache = ResourceCache(JsonCacheStorage(file_path))
+    bench('re-parse + scan', lambda name: reparse_lookup(file_path, name), names)
+    bench('ResourceCache.by_name', lambda name: cache.by_name('lights', name), names * 100)
+
+    print(f'\ncold load of the lights section ({RESOURCES} resources per collection)')
+    bench_cold_load('cache.json', JsonCacheStorage(file_path), names[0])
+    data = JsonCacheStorage(file_path).read_all()
+    for (label, codec, use_mmap) in [('cache.bin (json sections)', CODEC_JSON, False),
+                                     ('cache.bin (json sections, mmap)', CODEC_JSON, True),
+                                     ('cache.bin (default codec)', default_codec(), False)]:
+        storage = SectionedCacheStorage(f'{data_dir}/cache-{codec}.bin', codec=codec, use_mmap=use_mmap)
+        storage.write_all(data)
+        bench_cold_load(label, storage, names[0])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Colour conversions: colormath (what set_light_state used to call) against the in-house colors module,
+one colour at a time and in batches, plus the HSV, colour temperature, gamut clamping and xy -> RGB paths.
+Also checks that the results agree with colormath.
+Run from the repository root: python benchmarks/bench_colors.py
+"""
+import random
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+import colors  # noqa: E402
+
+COLOURS = 10000
+GAMUT_C = ((0.6915, 0.3083), (0.17, 0.7), (0.1532, 0.0475))
+
+
+def bench(label: str, fn, count: int = COLOURS):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<44} {count / elapsed:>14,.0f} colours/s')
+
+
+def main():
+    rng = random.Random(0)
+    same = [(255, 128, 10)] * COLOURS
+    mixed = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(COLOURS)]
+    hsv = [(rng.uniform(0, 360), rng.random(), rng.random()) for _ in range(COLOURS)]
+    mireks = [rng.uniform(153, 500) for _ in range(COLOURS)]
+    xy = colors.rgb_to_xy_batch(mixed)
+    uncached_rgb_to_xy = colors.rgb_to_xy.__wrapped__
+
+    try:
+        from colormath.color_conversions import convert_color
+        from colormath.color_objects import sRGBColor, xyYColor
+    except ImportError:
+        print('colormath is not installed, skipping the comparison')
+    else:
+        def colormath_xy(rgb):
+            converted = convert_color(sRGBColor(*rgb, is_upscaled=True), xyYColor)
+            return converted.xyy_x, converted.xyy_y
+
+        bench('colormath, one at a time', lambda: [colormath_xy(rgb) for rgb in mixed])
+        reference = np.array([colormath_xy(rgb) for rgb in mixed[:1000]])
+        difference = np.abs(colors.rgb_to_xy_batch(mixed[:1000]) - reference).max()
+        print(f'{"":<44} max difference to colors: {difference:.1e}')
+
+    bench('rgb_to_xy, one at a time (no memo)', lambda: [uncached_rgb_to_xy(rgb) for rgb in mixed])
+    bench('rgb_to_xy (memoised), same colour', lambda: [colors.rgb_to_xy(rgb) for rgb in same])
+    bench('rgb_to_xy_batch', lambda: colors.rgb_to_xy_batch(mixed))
+    bench('hsv_to_xy, one at a time', lambda: [colors.hsv_to_xy(value) for value in hsv])
+    bench('hsv_to_xy_batch', lambda: colors.hsv_to_xy_batch(hsv))
+    bench('mirek_to_xy, one at a time', lambda: [colors.mirek_to_xy(mirek) for mirek in mireks])
+    bench('mirek_to_xy_batch', lambda: colors.mirek_to_xy_batch(mireks))
+    bench('clamp_to_gamut, one at a time', lambda: [colors.clamp_to_gamut(tuple(p), GAMUT_C) for p in xy.tolist()])
+    bench('clamp_to_gamut_batch', lambda: colors.clamp_to_gamut_batch(xy, GAMUT_C))
+    bench('xy_to_rgb, one at a time (no memo)',
+          lambda: [colors.xy_to_rgb.__wrapped__(tuple(p)) for p in xy.tolist()])
+    bench('xy_to_rgb_batch', lambda: colors.xy_to_rgb_batch(xy))
+
+
+if __name__ == '__main__':
+    main()
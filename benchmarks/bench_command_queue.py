@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Bursty automation traffic: many threads fire set_light_state and set_room_light_states for the same few rooms
+within milliseconds. Compares the requests the bridge receives with and without the CommandQueue, with callers
+waiting for every result and with callers that fire and forget (the cache kept live by the eventstream, so writes
+of states the lights already have are skipped).
+Run from the repository root: python benchmarks/bench_command_queue.py
+"""
+import contextlib
+import io
+import random
+import threading
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+
+ROOMS = 4
+LIGHTS_PER_ROOM = 6
+THREADS = 16
+UPDATES_PER_THREAD = 20
+COLOURS = [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+
+
+def burst(hue, rooms: list[dict], light_ids: dict[str, list[str]], seed: int, fire_and_forget: bool):
+    """ :param fire_and_forget: Don't wait for the results (the queue's own calls and queue_light_state) """
+    rng = random.Random(seed)
+    (target, set_light_state) = (hue, hue.set_light_state)
+    if fire_and_forget:
+        (target, set_light_state) = (hue.command_queue, hue.queue_light_state)
+    for _ in range(UPDATES_PER_THREAD):
+        room = rng.choice(rooms)
+        if rng.random() < 0.3:
+            target.set_room_light_states(room['id'], rng.choice(COLOURS))
+        else:
+            light_id = rng.choice(light_ids[room['id']])
+            set_light_state(light_id, rng.choice(COLOURS), brightness=rng.choice([50, 100]))
+        time.sleep(rng.uniform(0, 0.005))
+
+
+def run(label: str, window: float | None, fire_and_forget: bool = False):
+    home = generate_home(lights=ROOMS * LIGHTS_PER_ROOM, lights_per_room=LIGHTS_PER_ROOM)
+    with FakeBridge(home) as bridge:
+        hue = client_for(bridge)
+        with contextlib.redirect_stdout(io.StringIO()):
+            hue.refresh_cache(scheduled_refresh=True)
+        if window is not None:
+            hue.enable_command_queue(window)
+            if fire_and_forget:
+                hue.start_event_stream()
+                time.sleep(0.2)
+
+        rooms = hue.get_rooms()
+        light_ids = {room['id']: hue.room_light_ids(room) for room in rooms}
+        before = bridge.requests
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=burst, args=(hue, rooms, light_ids, seed, fire_and_forget))
+                   for seed in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if hue.command_queue is not None:
+            hue.command_queue.close()
+        elapsed = time.perf_counter() - start
+
+        updates = THREADS * UPDATES_PER_THREAD
+        requests = bridge.requests - before
+        print(f'{label:<28} {updates} updates -> {requests:>4} bridge requests ({requests / updates:.2f} per update) '
+              f'in {elapsed:.2f} s')
+        if hue.command_queue is not None:
+            print(f'{"":<28} {hue.command_queue.counters}')
+        hue.close()
+
+
+def main():
+    run('direct', None)
+    for window in (0.02, 0.05):
+        run(f'CommandQueue ({window * 1000:.0f} ms)', window)
+        run(f'CommandQueue ({window * 1000:.0f} ms, f&f)', window, fire_and_forget=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Play a colour loop on the fake bridge: once within the real command budget (the bridge answers commands over
+budget with 429) and once with the budget lifted and a bridge too slow to keep up, so commands are coalesced.
+Reports achieved fps, jitter and how many commands the bridge rejected.
+Run from the repository root: python benchmarks/bench_effects.py
+"""
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+
+from effects import EffectsEngine, Keyframe, Timeline  # noqa: E402
+
+LIGHTS = 4
+DURATION = 3.0
+COLOUR_LOOP = [Keyframe(0.0, (255, 0, 0), 100.0), Keyframe(1.0, (0, 255, 0), 50.0),
+               Keyframe(2.0, (0, 0, 255), 100.0), Keyframe(DURATION, (255, 0, 0), 50.0)]
+
+
+def main():
+    home = generate_home(lights=LIGHTS)
+    light_ids = [light['id'] for light in home['light']]
+
+    with FakeBridge(home, rate_limits={'light': (10.0, 10.0), 'group': (1.0, 2.0)}) as bridge:
+        hue = client_for(bridge, rate_limited=True)
+        engine = EffectsEngine(hue, fps=30.0).add(Timeline(light_ids, COLOUR_LOOP))
+        print(f'within budget   (target 30 fps, capped to {engine.frame_rate():.2f} fps)')
+        print(f'  {engine.play().report()}')
+        print(f'  bridge rejected {bridge.rate_limited} commands')
+        hue.close()
+
+    with FakeBridge(home, latency=0.05) as bridge:
+        hue = client_for(bridge)
+        hue.pool_size = 2
+        engine = EffectsEngine(hue, fps=30.0).add(Timeline(light_ids, COLOUR_LOOP))
+        print(f'slow bridge     (target 30 fps, 50 ms per command, {hue.pool_size} connections)')
+        print(f'  {engine.play().report()}')
+        hue.close()
+
+
+if __name__ == '__main__':
+    main()
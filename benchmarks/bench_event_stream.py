@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Measure how long it takes until an eventstream update is visible through the cache,
+compared to a full refresh_cache.
+Run from the repository root: python benchmarks/bench_event_stream.py
+"""
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home
+
+LIGHTS = 500
+UPDATES = 200
+
+
+def main():
+    with FakeBridge(generate_home(lights=LIGHTS), latency=0.005) as bridge:
+        hue = client_for(bridge)
+
+        start = time.perf_counter()
+        hue.refresh_cache(scheduled_refresh=True)
+        print(f'full refresh_cache                 {(time.perf_counter() - start) * 1000:8.2f} ms')
+
+        stream = hue.start_event_stream(flush_interval=0.05)
+        stream.connected.wait(5)
+        light_ids = [light['id'] for light in hue.get_lights()]
+
+        latencies = []
+        for i in range(UPDATES):
+            light_id = light_ids[i % LIGHTS]
+            expected = i % 2 == 0
+            start = time.perf_counter()
+            bridge.publish([{'type': 'update', 'data': [{'id': light_id, 'type': 'light', 'on': {'on': expected}}]}])
+            while hue.cache.by_id('lights', light_id)['on']['on'] != expected:
+                time.sleep(0.0001)
+            latencies.append(time.perf_counter() - start)
+
+        latencies.sort()
+        print(f'eventstream update visible (p50)   {latencies[len(latencies) // 2] * 1000:8.2f} ms')
+        print(f'eventstream update visible (p99)   {latencies[int(len(latencies) * 0.99)] * 1000:8.2f} ms')
+
+        hue.close()
+        flushed = {light['id']: light for light in hue.cache.storage.read_section('lights')}
+        print(f'flushed to the cache file: {flushed[light_ids[(UPDATES - 1) % LIGHTS]]["on"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Discovery with unreachable candidates (probed one after another vs. concurrently) and fleet-wide
+commands on several fake bridges (one bridge after another vs. HueFleet in parallel).
+Run from the repository root: python benchmarks/bench_fleet.py
+"""
+import contextlib
+import io
+import socket
+import tempfile
+import time
+
+from fake_bridge import FakeBridge, generate_home  # Also puts the repository root on sys.path
+
+from discovery import discover_bridges, probe_bridge  # noqa: E402
+from hue_fleet import HueFleet  # noqa: E402
+from rate_limit import RateLimiter  # noqa: E402
+
+BRIDGES = 4
+LIGHTS = 50
+LATENCY = 0.01
+SILENT_CANDIDATES = 3
+PROBE_TIMEOUT = 0.5
+
+
+def timed(label: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f'{label:<36} {(time.perf_counter() - start) * 1000:8.1f} ms')
+    return result
+
+
+def generate_bridge_home(n: int) -> dict:
+    home = generate_home(lights=LIGHTS, seed=n)
+    # Names are unique per bridge only, keep them apart so every bridge gets commands routed to it
+    for light in home['light']:
+        light['metadata']['name'] = f'Bridge {n} {light["metadata"]["name"]}'
+    return home
+
+
+def quiet(fn):
+    def wrapper():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return wrapper
+
+
+def silent_candidate() -> socket.socket:
+    """ A port that accepts connections but never answers, like a stale discovery entry behind a firewall """
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen()
+    return sock
+
+
+def main():
+    bridges = [FakeBridge(generate_bridge_home(i), latency=LATENCY).start() for i in range(BRIDGES)]
+    silent = [silent_candidate() for _ in range(SILENT_CANDIDATES)]
+    candidates = ([f'127.0.0.1:{sock.getsockname()[1]}' for sock in silent] +
+                  [bridge.url.split('://', 1)[1] for bridge in bridges])
+
+    timed('discovery (sequential probes)', lambda: [probe_bridge(ipaddr, PROBE_TIMEOUT) for ipaddr in candidates])
+    found = timed('discovery (concurrent probes)', lambda: discover_bridges(candidates, PROBE_TIMEOUT))
+    assert len(found) == BRIDGES
+
+    fleet = HueFleet(fleet_dir=tempfile.mkdtemp())
+    fleet.discover(candidates, auto_connect=False)
+    for bridge in bridges:
+        hue = fleet.bridges[bridge.bridge_id.lower()]
+        hue.bridge_clip_url = bridge.clip_url
+        hue.api_username = 'fake-bridge'
+        hue.save_config()
+        hue.rate_limiter = RateLimiter({'light': (1e6, 1e6), 'group': (1e6, 1e6)})
+
+    everything = {'refresh_rooms': True, 'refresh_device': True, 'refresh_scenes': True, 'refresh_lights': True,
+                  'scheduled_refresh': False}
+    timed('refresh_cache (bridge by bridge)', quiet(lambda: [hue.refresh_cache(**everything)
+                                                             for hue in fleet.bridges.values()]))
+    timed('refresh_cache (HueFleet)', quiet(lambda: fleet.refresh_cache(**everything)))
+
+    names = [light['metadata']['name'] for bridge in bridges for light in bridge.resources['light'][:10]]
+    timed(f'{len(names)} lights by name (one by one)', lambda: [fleet.set_light_state(name, (255, 0, 0))
+                                                                 for name in names])
+    results = timed(f'{len(names)} lights by name (HueFleet)', lambda: fleet.set_lights_state(names, (0, 0, 255)))
+    assert all(result.ok for bridge_results in results.values() for result in bridge_results)
+
+    fleet.close()
+    for bridge in bridges:
+        bridge.stop()
+    for sock in silent:
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+pyhue ls on a large installation: listing everything and listing a subset (one room, one name, a name glob)
+with the streaming, filterable listing, against the old listing that could only print every light.
+Run from the repository root: python benchmarks/bench_ls.py
+"""
+import contextlib
+import io
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+
+import listing  # noqa: E402
+
+LIGHTS = 5000
+REPEATS = 20
+
+
+def old_ls(hue, echo):
+    """ The listing before it could filter: every light, every line built by concatenation """
+    for device in hue.get_lights():
+        message = ''
+        message += device['id']
+        message += f' {device["metadata"]["name"]}'
+        echo(message)
+
+
+def bench(label: str, fn):
+    lines = []
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        lines.clear()
+        fn(lines.append)
+    elapsed = (time.perf_counter() - start) / REPEATS
+    print(f'{label:<38} {len(lines):>5} lines  {elapsed * 1000:8.3f} ms/listing')
+
+
+def main():
+    with FakeBridge(generate_home(lights=LIGHTS, lights_per_room=50)) as bridge:
+        hue = client_for(bridge)
+        with contextlib.redirect_stdout(io.StringIO()):
+            hue.refresh_cache(scheduled_refresh=True)
+        # Warm the resident cache, both variants then read from memory
+        hue.get_lights()
+        hue.get_rooms()
+
+        fields = ['id', 'name']
+        bench('old: all lights', lambda echo: old_ls(hue, echo))
+        bench('all lights', lambda echo: listing.stream(hue, echo, fields, keys=['lights']))
+        bench('all lights as JSON Lines (+room, xy)',
+              lambda echo: listing.stream(hue, echo, fields + ['room', 'xy'], 'jsonl', keys=['lights']))
+        bench('lights in one room', lambda echo: listing.stream(hue, echo, fields, keys=['lights'], room='Room 7'))
+        bench('one light by name', lambda echo: listing.stream(hue, echo, fields, keys=['lights'], name='light 42'))
+        bench('name glob \'light 42*\'', lambda echo: listing.stream(hue, echo, fields, keys=['lights'],
+                                                                     name='light 42*'))
+        bench('lights that are on, as TSV', lambda echo: listing.stream(hue, echo, fields + ['on'], 'tsv',
+                                                                        keys=['lights'], on=True))
+        hue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Cost of the instrumentation: hot paths with metrics disabled (the default) and enabled,
+then the recorded metrics in the Prometheus text format.
+Run from the repository root: python benchmarks/bench_metrics.py
+"""
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+
+from metrics import Metrics  # noqa: E402
+
+REQUESTS = 500
+LOOKUPS = 200_000
+
+
+def bench(label: str, fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    per_call = (time.perf_counter() - start) / iterations
+    print(f'{label:<40} {per_call * 1e6:10.2f} us/call')
+    return per_call
+
+
+def main():
+    home = generate_home(lights=100)
+    names = [light['metadata']['name'] for light in home['light']]
+
+    with FakeBridge(home) as bridge:
+        hue = client_for(bridge)
+        hue.refresh_cache(scheduled_refresh=True)
+
+        for enabled in (False, True):
+            hue.metrics = Metrics() if enabled else None
+            label = 'enabled' if enabled else 'disabled'
+            bench(f'clip_request (metrics {label})', lambda i: hue.clip_request('GET', '/resource/light'), REQUESTS)
+            bench(f'get_light_by_name (metrics {label})',
+                  lambda i: hue.get_light_by_name(names[i % len(names)]), LOOKUPS)
+            bench(f'light_state (metrics {label})',
+                  lambda i: hue.light_state((i % 256, 0, 255)), LOOKUPS)
+
+        print()
+        print(hue.stats().to_prometheus())
+        hue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Compare requests/sec of one-off requests.request() calls against the pooled Hue session.
+Run from the repository root: python benchmarks/bench_session.py
+"""
+import time
+
+import requests
+
+from fake_bridge import FakeBridge, client_for, generate_home
+
+REQUESTS = 500
+
+
+def bench(label: str, fn):
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<24} {REQUESTS / elapsed:>10.1f} req/s  ({elapsed * 1000 / REQUESTS:.3f} ms/req)')
+
+
+def main():
+    with FakeBridge(generate_home(lights=0)) as bridge:
+        hue = client_for(bridge)
+
+        bench('requests.request', lambda: requests.request('GET', f'{bridge.clip_url}/resource/light',
+                                                           headers={'hue-application-key': 'bench'}))
+        bench('Hue.clip_request', lambda: hue.clip_request('GET', '/resource/light'))
+        hue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Save a room, flash a notification, restore it: bridge requests and time of restoring by writing every light's
+full state (one set_light_state per light) against the diff-based apply_snapshot, after the notification and
+when nothing changed, diffing against a live fetch and against the cache kept live by the eventstream.
+Run from the repository root: python benchmarks/bench_snapshot.py
+"""
+import contextlib
+import io
+import json
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+
+from snapshot import LightSnapshot  # noqa: E402
+
+LIGHTS_PER_ROOM = 8
+
+
+def blind_restore(hue, state):
+    """ One command per light with its full saved state, whether it changed or not """
+    for (light_id, light) in state.lights.items():
+        hue.put_light_state(light_id, json.dumps({
+            'on': {'on': light.on},
+            'dimming': {'brightness': light.brightness},
+            'color': {'xy': {'x': light.x, 'y': light.y}},
+        }))
+
+
+def measure(label: str, bridge, fn):
+    before = bridge.requests
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<48} {bridge.requests - before:>3} requests  {elapsed * 1000:8.2f} ms')
+
+
+def main():
+    home = generate_home(lights=4 * LIGHTS_PER_ROOM, lights_per_room=LIGHTS_PER_ROOM)
+    for light in home['light']:
+        # Everything on, so the notification changes every field
+        light['on']['on'] = True
+
+    with FakeBridge(home) as bridge:
+        hue = client_for(bridge)
+        with contextlib.redirect_stdout(io.StringIO()):
+            hue.refresh_cache(scheduled_refresh=True)
+        room = hue.get_room_by_name('Room 1')
+
+        for events in (False, True):
+            if events:
+                hue.start_event_stream()
+                time.sleep(0.2)
+            source = 'cache' if events else 'live fetch'
+
+            state = hue.snapshot(room_id=room['id'], cached=events)
+            print(f'snapshot of {len(state)} lights: {len(state.to_json())} bytes as JSON')
+
+            hue.set_room_light_states(room['id'], (255, 0, 0))
+            time.sleep(0.05)
+            measure('blind restore after notification', bridge, lambda: blind_restore(hue, state))
+            measure('blind restore, nothing changed', bridge, lambda: blind_restore(hue, state))
+
+            hue.set_room_light_states(room['id'], (255, 0, 0))
+            time.sleep(0.05)
+            measure(f'apply_snapshot after notification ({source})', bridge, lambda: hue.apply_snapshot(state))
+            time.sleep(0.05)
+            measure(f'apply_snapshot, nothing changed ({source})', bridge, lambda: hue.apply_snapshot(state))
+
+            # The whole room at one brightness, restored with a single grouped command
+            uniform = type(state)({light_id: LightSnapshot(True, 40.0, 0.3, 0.3, None) for light_id in state.lights})
+            measure(f'apply_snapshot, room-wide change ({source})', bridge, lambda: hue.apply_snapshot(uniform))
+            print()
+        hue.close()
+
+
+if __name__ == '__main__':
+    main()
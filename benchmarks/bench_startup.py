@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Measure the wall-clock startup latency of `cli.py --help` and `cli.py ls` against a warm cache,
+and fail if either exceeds its target. Use `python -X importtime cli.py ls` to see where import time goes.
+Run from the repository root: python benchmarks/bench_startup.py
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+RUNS = 10
+
+# Targets in seconds for the median run
+TARGETS = {
+    '--help': 0.15,
+    'ls': 0.15,
+}
+
+
+def prepare_data_dir() -> str:
+    base = tempfile.mkdtemp() + '/'
+    os.mkdir(base + 'data')
+
+    with open(base + 'data/api_config.json', 'w+') as file:
+        # An unroutable bridge: any network access would show up as a timeout
+        file.write(json.dumps({
+            'api_username': 'bench',
+            'api_key': 'bench',
+            'bridge_api_url': 'http://192.0.2.1/api',
+            'bridge_clip_url': 'https://192.0.2.1/clip/v2',
+        }))
+
+    with open(base + 'data/cache.json', 'w+') as file:
+        file.write(json.dumps({
+            'last_updated': int(time.time()),
+            'device': {},
+            'lights': [{'id': f'light-{i}', 'metadata': {'name': f'Light {i}'}} for i in range(200)],
+            'rooms': [{'id': f'room-{i}', 'metadata': {'name': f'Room {i}'}} for i in range(20)],
+            'scenes': [],
+        }))
+    return base
+
+
+def main():
+    env = dict(os.environ, PYHUE_PATH=prepare_data_dir())
+    failed = False
+
+    for (args, target) in TARGETS.items():
+        timings = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, path.join(ROOT, 'cli.py'), *args.split()],
+                           env=env, check=True, stdout=subprocess.DEVNULL, timeout=30)
+            timings.append(time.perf_counter() - start)
+
+        median = statistics.median(timings)
+        ok = median <= target
+        failed = failed or not ok
+        print(f'cli.py {args:<8} median {median * 1000:7.1f} ms  (target {target * 1000:.0f} ms)  '
+              f'{"OK" if ok else "TOO SLOW"}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
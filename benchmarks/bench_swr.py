@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Stale-while-revalidate reads against a bridge with 50 ms of latency: time and bridge requests of a live
+get_lights, a fresh and a stale cached one (the stale read returns right away, one refresh runs in the
+background), and many threads missing the cache at once, each fetching live (cache policy) or sharing one
+fetch into the cache (swr policy).
+Run from the repository root: python benchmarks/bench_swr.py
+"""
+import contextlib
+import io
+import threading
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+
+LATENCY = 0.05
+READERS = 20
+
+
+def join_revalidations():
+    for thread in threading.enumerate():
+        if thread.name == 'cache-revalidate':
+            thread.join()
+
+
+def measure(label: str, bridge, fn):
+    before = bridge.requests
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    join_revalidations()
+    print(f'{label:<44} {elapsed * 1000:8.2f} ms  {bridge.requests - before:>3} requests')
+
+
+def concurrently(fn):
+    def run():
+        threads = [threading.Thread(target=fn) for _ in range(READERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return run
+
+
+def main():
+    with FakeBridge(generate_home(lights=50), latency=LATENCY) as bridge:
+        hue = client_for(bridge)
+        with contextlib.redirect_stdout(io.StringIO()):
+            hue.refresh_cache(scheduled_refresh=True)
+
+        measure('get_lights, live', bridge, lambda: hue.get_lights(cached=False))
+        measure('get_lights, fresh', bridge, lambda: hue.get_lights())
+
+        hue.cache_ttls['lights'] = 0
+        hue._fresh_until.clear()
+        measure('get_lights, stale', bridge, lambda: hue.get_lights())
+        measure(f'get_lights, stale, {READERS} threads', bridge, concurrently(lambda: hue.get_lights()))
+        print(f'counters: {hue.cache_counters["lights"]}')
+        hue.close()
+
+        for policy in ('cache', 'swr'):
+            empty = client_for(bridge)
+            measure(f'get_lights, empty cache, {READERS} threads ({policy})', bridge,
+                    concurrently(lambda: empty.get_lights(policy=policy)))
+            empty.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+One Hue client shared by many threads: name lookups, light commands, bulk commands and cache refreshes
+all at once against the fake bridge, then several processes refreshing different collections of the same
+cache file. Reports throughput and checks that no call failed and no refresh lost another one's collection.
+Run from the repository root: python benchmarks/bench_threads.py
+"""
+import contextlib
+import io
+import multiprocessing
+import random
+import tempfile
+import threading
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+
+THREADS = 32
+SECONDS = 3.0
+PROCESSES = 4
+REFRESHES_PER_PROCESS = 10
+
+
+def worker(hue, names: list[str], light_ids: list[str], seed: int, deadline: float, results: list, errors: list):
+    rng = random.Random(seed)
+    done = {'lookup': 0, 'set': 0, 'bulk': 0, 'refresh': 0}
+    while time.perf_counter() < deadline:
+        try:
+            choice = rng.random()
+            if choice < 0.7:
+                assert hue.get_light_by_name(rng.choice(names)) is not None
+                done['lookup'] += 1
+            elif choice < 0.9:
+                assert hue.set_light_state(rng.choice(light_ids), (255, 0, 0)).ok
+                done['set'] += 1
+            elif choice < 0.98:
+                assert all(result.ok for result in hue.set_lights_state(rng.sample(light_ids, 8), (0, 0, 255)))
+                done['bulk'] += 1
+            else:
+                hue.refresh_cache(refresh_lights=True, refresh_rooms=True, scheduled_refresh=False)
+                done['refresh'] += 1
+        except Exception as e:
+            errors.append(f'{type(e).__name__}: {e}')
+
+    results.append(done)
+
+
+def refresh_process(clip_url: str, data_dir: str, key: str, barrier, refreshes: int = REFRESHES_PER_PROCESS):
+    from pyhue import Hue
+
+    hue = Hue(ipaddr='127.0.0.1', auto_connect=False, json_file_dir=data_dir)
+    hue.bridge_clip_url = clip_url
+    barrier.wait()
+    flags = {'refresh_device': key == 'device', 'refresh_lights': key == 'lights',
+             'refresh_rooms': key == 'rooms', 'refresh_scenes': key == 'scenes'}
+    for _ in range(refreshes):
+        hue.refresh_cache(scheduled_refresh=False, **flags)
+    hue.close()
+
+
+def main():
+    with FakeBridge(generate_home(lights=200)) as bridge:
+        hue = client_for(bridge)
+        with contextlib.redirect_stdout(io.StringIO()):
+            hue.refresh_cache(scheduled_refresh=True)
+        lights = hue.get_lights()
+        names = [light['metadata']['name'] for light in lights]
+        light_ids = [light['id'] for light in lights]
+
+        results = []
+        errors = []
+        deadline = time.perf_counter() + SECONDS
+        threads = [threading.Thread(target=worker, args=(hue, names, light_ids, seed, deadline, results, errors))
+                   for seed in range(THREADS)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        counts = {key: sum(done[key] for done in results) for key in results[0]}
+        total = sum(counts.values())
+        print(f'{THREADS} threads, {elapsed:.1f} s: {total / elapsed:,.0f} calls/s {counts}, {len(errors)} errors')
+        for error in sorted(set(errors))[:5]:
+            print(f'  {error}')
+        hue.close()
+
+        # Each process refreshes one collection of the same (initially empty) cache file
+        data_dir = tempfile.mkdtemp()
+        keys = ['device', 'lights', 'rooms', 'scenes'][:PROCESSES]
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(len(keys))
+        processes = [context.Process(target=refresh_process, args=(bridge.clip_url, data_dir, key, barrier))
+                     for key in keys]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        hue = client_for(bridge, data_dir=data_dir)
+        data = hue.cache.storage.read_all() or {}
+        missing = [key for key in keys if not data.get(key)]
+        print(f'{len(keys)} processes x {REFRESHES_PER_PROCESS} refreshes in {elapsed:.1f} s, '
+              f'collections missing from the file: {missing or "none"}')
+        hue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Transport resilience against the fake bridge: success rate and tail latency with injected 503s and 429s,
+with and without retries, and how quickly requests fail against a wedged bridge once the circuit is open.
+Run from the repository root: python benchmarks/bench_transport.py
+"""
+import socket
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+
+from transport import HueConnectionError, Transport  # noqa: E402
+
+REQUESTS = 200
+WEDGED_REQUESTS = 20
+
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def run(label: str, hue, path: str = '/resource/light'):
+    latencies = []
+    ok = 0
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        (_, failed) = hue.clip_request('GET', path)
+        latencies.append(time.perf_counter() - start)
+        ok += not failed
+    print(f'{label:<34} {ok / REQUESTS:7.1%} ok  p50 {percentile(latencies, 0.5) * 1000:8.2f} ms  '
+          f'p99 {percentile(latencies, 0.99) * 1000:8.2f} ms  max {max(latencies) * 1000:8.2f} ms')
+
+
+def main():
+    with FakeBridge(generate_home(lights=10), error_rate=0.2) as bridge:
+        hue = client_for(bridge)
+        for retries in (0, 3):
+            # The fake bridge answers with Retry-After: 1, which is honoured and shows up in the tail
+            hue.transport = Transport(retries=retries)
+            run(f'20% 503s, {retries} retries', hue)
+        hue.close()
+
+    with FakeBridge(generate_home(lights=10), rate_limits={'light': (50.0, 5.0), 'group': (1.0, 1.0)}) as bridge:
+        hue = client_for(bridge)
+        for retries in (0, 3):
+            hue.transport = Transport(retries=retries)
+            run(f'over budget (429s), {retries} retries', hue)
+        hue.close()
+
+    # Accepts connections but never answers
+    wedged = socket.socket()
+    wedged.bind(('127.0.0.1', 0))
+    wedged.listen(64)
+    with FakeBridge() as bridge:
+        hue = client_for(bridge)
+        hue.bridge_clip_url = f'http://127.0.0.1:{wedged.getsockname()[1]}/clip/v2'
+        hue.transport = Transport(read_timeout=0.2, retries=1, deadline=1.0)
+
+        for i in range(WEDGED_REQUESTS):
+            start = time.perf_counter()
+            try:
+                hue.clip_request('GET', '/resource/light')
+            except HueConnectionError as e:
+                if i in (0, hue.transport.circuit_breaker.failure_threshold, WEDGED_REQUESTS - 1):
+                    print(f'wedged bridge, request {i + 1:>2}: {type(e).__name__} after '
+                          f'{(time.perf_counter() - start) * 1000:.2f} ms')
+        hue.close()
+    wedged.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,416 @@
+"""
+Self-contained fake of the Hue bridge's CLIP v2 API for benchmarks and manual testing.
+Serves /resource/{light,room,grouped_light,scene,device} and the eventstream from a generated home,
+with configurable latency, error injection and rate limits.
+"""
+import hashlib
+import json
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from rate_limit import RateLimiter, bucket_for_request  # noqa: E402
+
+# Gamut C, used by most current colour bulbs
+GAMUT_C = {
+    'red': {'x': 0.6915, 'y': 0.3083},
+    'green': {'x': 0.17, 'y': 0.7},
+    'blue': {'x': 0.1532, 'y': 0.0475},
+}
+
+
+def _rid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generate_home(lights: int = 10, lights_per_room: int = 8, scenes_per_room: int = 3, seed: int = 0) -> dict:
+    """
+    Generate the resources of a home in the shape the CLIP v2 API returns them
+    :return: Maps a resource type to the list of its resources
+    """
+    rng = random.Random(seed)
+    home = {'device': [], 'light': [], 'room': [], 'grouped_light': [], 'scene': []}
+
+    home['device'].append({
+        'id': _rid(rng),
+        'type': 'device',
+        'metadata': {'name': 'Hue Bridge', 'archetype': 'bridge_v2'},
+        'services': [],
+    })
+
+    room_count = max(1, -(-lights // lights_per_room))
+    for r in range(room_count):
+        room_id = _rid(rng)
+        grouped_light_id = _rid(rng)
+        room = {
+            'id': room_id,
+            'type': 'room',
+            'metadata': {'name': f'Room {r}', 'archetype': 'living_room'},
+            'children': [],
+            'services': [{'rid': grouped_light_id, 'rtype': 'grouped_light'}],
+        }
+        home['room'].append(room)
+        home['grouped_light'].append({
+            'id': grouped_light_id,
+            'type': 'grouped_light',
+            'owner': {'rid': room_id, 'rtype': 'room'},
+            'on': {'on': False},
+            'dimming': {'brightness': 0.0},
+        })
+
+        room_light_ids = []
+        for i in range(r * lights_per_room, min(lights, (r + 1) * lights_per_room)):
+            device_id = _rid(rng)
+            light_id = _rid(rng)
+            room_light_ids.append(light_id)
+            room['children'].append({'rid': device_id, 'rtype': 'device'})
+
+            home['device'].append({
+                'id': device_id,
+                'type': 'device',
+                'metadata': {'name': f'Light {i}', 'archetype': 'sultan_bulb'},
+                'services': [{'rid': light_id, 'rtype': 'light'}],
+            })
+            home['light'].append({
+                'id': light_id,
+                'type': 'light',
+                'owner': {'rid': device_id, 'rtype': 'device'},
+                'metadata': {'name': f'Light {i}', 'archetype': 'sultan_bulb'},
+                'on': {'on': rng.random() < 0.5},
+                'dimming': {'brightness': round(rng.uniform(1, 100), 2)},
+                'color': {
+                    'xy': {'x': round(rng.uniform(0.2, 0.6), 4), 'y': round(rng.uniform(0.2, 0.5), 4)},
+                    'gamut': GAMUT_C,
+                    'gamut_type': 'C',
+                },
+            })
+
+        for s in range(scenes_per_room):
+            home['scene'].append({
+                'id': _rid(rng),
+                'type': 'scene',
+                'metadata': {'name': f'Scene {s}'},
+                'group': {'rid': room_id, 'rtype': 'room'},
+                'actions': [{
+                    'target': {'rid': light_id, 'rtype': 'light'},
+                    'action': {'on': {'on': True}, 'dimming': {'brightness': 100.0 / (s + 1)}},
+                } for light_id in room_light_ids],
+            })
+
+    return home
+
+
+def _merge(target: dict, changes: dict):
+    for (key, value) in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+class FakeBridgeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data: list | str, errors: list | None = None, extra_headers: dict | None = None):
+        """ :param data: The 'data' list, or that list already serialised """
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        body = f'{{"errors": {json.dumps(errors or [])}, "data": {data}}}'.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for (key, value) in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+
+    def _stream_events(self):
+        bridge = self.server.bridge
+        subscriber = bridge.subscribe()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            self._write_chunk(b': hi\n\n')
+            while not bridge.stopping.is_set():
+                try:
+                    (event_id, events) = subscriber.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                self._write_chunk(f'id: {event_id}\ndata: {json.dumps(events)}\n\n'.encode())
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            bridge.unsubscribe(subscriber)
+        self.close_connection = True
+
+    def _handle(self):
+        bridge = self.server.bridge
+        bridge.requests += 1
+
+        if self.command == 'GET' and self.path.startswith('/eventstream/'):
+            return self._stream_events()
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if bridge.latency or bridge.jitter:
+            time.sleep(bridge.latency + random.uniform(0, bridge.jitter))
+
+        if self.command == 'GET' and self.path == '/api/0/config':
+            # The unauthenticated v1 config, which discovery probes for
+            body = json.dumps({'name': 'Fake bridge', 'bridgeid': bridge.bridge_id, 'modelid': 'BSB002'}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            return self.wfile.write(body)
+
+        if not self.path.startswith('/clip/v2/resource/'):
+            return self._send_json(404, [], [{'description': f'unknown path {self.path}'}])
+        resource_path = self.path[len('/clip/v2'):]
+
+        if bridge.error_rate and random.random() < bridge.error_rate:
+            bridge.errors_injected += 1
+            return self._send_json(503, [], [{'description': 'injected error'}], {'Retry-After': '1'})
+
+        if bridge.rate_limiter is not None and not bridge.rate_limiter.try_acquire(
+                bucket_for_request(self.command, resource_path)):
+            bridge.rate_limited += 1
+            return self._send_json(429, [], [{'description': 'rate limit exceeded'}], {'Retry-After': '1'})
+
+        parts = resource_path.split('/')[2:]
+        rtype = parts[0]
+        rid = parts[1] if len(parts) > 1 else None
+        if rtype not in bridge.resources:
+            return self._send_json(404, [], [{'description': f'unknown resource type {rtype}'}])
+
+        if self.command == 'GET':
+            (status, data) = bridge.get(rtype, rid)
+            if status != 200:
+                return self._send_json(status, data, [{'description': 'not found'}])
+
+            if not bridge.etags:
+                return self._send_json(status, data)
+
+            etag = f'"{hashlib.sha1(data.encode()).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            return self._send_json(status, data, extra_headers={'ETag': etag})
+
+        if self.command == 'PUT' and rid is not None:
+            try:
+                changes = json.loads(body or b'{}')
+            except ValueError:
+                return self._send_json(400, [], [{'description': 'body contains invalid JSON'}])
+            (status, data) = bridge.put(rtype, rid, changes)
+            return self._send_json(status, data, [] if status == 200 else [{'description': 'not found'}])
+
+        return self._send_json(405, [], [{'description': 'method not allowed'}])
+
+    do_GET = _handle
+    do_PUT = _handle
+    do_POST = _handle
+    do_DELETE = _handle
+
+
+class FakeBridge:
+    """
+    A fake bridge on a background thread. Use as a context manager or call start()/stop().
+    Point a client at it with hue.bridge_clip_url = bridge.clip_url
+    """
+
+    def __init__(self, home: dict | None = None,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 error_rate: float = 0.0,
+                 rate_limits: dict[str, tuple[float, float]] | None = None,
+                 etags: bool = True,
+                 bridge_id: str | None = None):
+        """
+        :param home: Resources by type, e.g. from generate_home() (defaults to a 10 light home)
+        :param latency: Seconds added to every request
+        :param jitter: Up to this many seconds are added randomly on top of latency
+        :param error_rate: Fraction of requests answered with 503
+        :param rate_limits: Enforce these RateLimiter budgets and answer requests over budget with 429
+        :param etags: Send ETags and answer matching If-None-Match requests with 304
+        :param bridge_id: The id reported by /api/0/config (defaults to a random one)
+        """
+        self.resources = home if home is not None else generate_home()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limiter = RateLimiter(rate_limits) if rate_limits is not None else None
+        self.etags = etags
+        self.bridge_id = bridge_id or f'{random.getrandbits(64):016X}'
+
+        self.requests = 0
+        self.errors_injected = 0
+        self.rate_limited = 0
+        self.stopping = threading.Event()
+
+        self._lock = threading.Lock()
+        self._index = {rtype: {r['id']: r for r in items} for (rtype, items) in self.resources.items()}
+        self._subscribers = []
+        self._event_id = 0
+
+        self.server = ThreadingHTTPServer((host, port), FakeBridgeHandler)
+        self.server.daemon_threads = True
+        self.server.bridge = self
+
+    @property
+    def url(self) -> str:
+        (host, port) = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def clip_url(self) -> str:
+        return f'{self.url}/clip/v2'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-bridge', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # region Resource state
+    def get(self, rtype: str, rid: str | None) -> tuple[int, str]:
+        """ :return: Status code and the serialised 'data' list """
+        with self._lock:
+            if rid is None:
+                return 200, json.dumps(self.resources[rtype])
+            resource = self._index[rtype].get(rid)
+            if resource is None:
+                return 404, '[]'
+            return 200, json.dumps([resource])
+
+    def _update(self, rtype: str, rid: str, changes: dict) -> dict | None:
+        resource = self._index[rtype].get(rid)
+        if resource is None:
+            return None
+        _merge(resource, changes)
+        return {'id': rid, 'type': rtype, **changes}
+
+    def put(self, rtype: str, rid: str, changes: dict) -> tuple[int, list]:
+        with self._lock:
+            if rid not in self._index[rtype]:
+                return 404, []
+
+            updates = []
+            if rtype == 'scene' and 'recall' in changes:
+                for action in self._index['scene'][rid]['actions']:
+                    updates.append(self._update('light', action['target']['rid'], action['action']))
+            elif rtype == 'grouped_light':
+                updates.append(self._update(rtype, rid, changes))
+                for light_id in self._member_light_ids(self._index[rtype][rid]['owner']['rid']):
+                    updates.append(self._update('light', light_id, changes))
+            else:
+                updates.append(self._update(rtype, rid, changes))
+
+        self.publish([{'type': 'update', 'data': [u for u in updates if u is not None]}])
+        return 200, [{'rid': rid, 'rtype': rtype}]
+
+    def room_light_ids(self, room_id: str) -> list[str]:
+        """ Ids of the lights of all devices in the room """
+        with self._lock:
+            return self._member_light_ids(room_id)
+
+    def _member_light_ids(self, room_id: str) -> list[str]:
+        light_ids = []
+        for child in self._index['room'].get(room_id, {}).get('children', []):
+            for service in self._index['device'].get(child['rid'], {}).get('services', []):
+                if service['rtype'] == 'light':
+                    light_ids.append(service['rid'])
+        return light_ids
+
+    # endregion
+
+    # region Eventstream
+    def subscribe(self) -> queue.Queue:
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, events: list[dict]):
+        """ Send events to every connected eventstream client """
+        with self._lock:
+            self._event_id += 1
+            for subscriber in self._subscribers:
+                subscriber.put((self._event_id, events))
+
+    # endregion
+
+
+def client_for(bridge: FakeBridge, data_dir: str | None = None, rate_limited: bool = False):
+    """
+    Create a Hue client talking to the fake bridge, with its config and cache in a throwaway directory
+    :param rate_limited: Keep the client's real command budget (otherwise it is lifted to measure the transport)
+    """
+    import tempfile
+    from pyhue import Hue
+
+    hue = Hue(ipaddr=bridge.url.split('://', 1)[1], auto_connect=False, json_file_dir=data_dir or tempfile.mkdtemp())
+    hue.bridge_clip_url = bridge.clip_url
+    hue.api_username = 'fake-bridge'
+    hue.save_config()
+    if not rate_limited:
+        hue.rate_limiter = RateLimiter({'light': (1e6, 1e6), 'group': (1e6, 1e6)})
+    return hue
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a fake Hue bridge (CLIP v2)')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--lights', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', action='store_true', help='Enforce the real bridge\'s command budget')
+    args = parser.parse_args()
+
+    fake = FakeBridge(generate_home(args.lights), port=args.port, latency=args.latency, error_rate=args.error_rate,
+                      rate_limits={'light': (10.0, 10.0), 'group': (1.0, 2.0)} if args.rate_limit else None)
+    print(f'Fake bridge with {args.lights} lights listening on {fake.clip_url}')
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite: drives Hue and the CLI against the fake bridge for homes of different sizes
+and reports latency percentiles and throughput for refresh, lookup and room-set operations.
+Run from the repository root: python benchmarks/run_benchmarks.py [--sizes 10 100 1000 5000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_bridge import FakeBridge, client_for, generate_home  # Also puts the repository root on sys.path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def measure(fn, iterations: int) -> list[float]:
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(size: int, name: str, samples: list[float]):
+    total = sum(samples)
+    print(f'{size:>6} {name:<22} p50 {percentile(samples, 0.5) * 1000:9.3f} ms  '
+          f'p95 {percentile(samples, 0.95) * 1000:9.3f} ms  '
+          f'p99 {percentile(samples, 0.99) * 1000:9.3f} ms  '
+          f'{len(samples) / total if total else float("inf"):11.1f} ops/s')
+
+
+def run_size(size: int, args):
+    base = tempfile.mkdtemp() + '/'
+    os.mkdir(base + 'data')
+    home = generate_home(lights=size)
+
+    with FakeBridge(home, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate) as bridge:
+        hue = client_for(bridge, data_dir=base + 'data')
+
+        def refresh(_):
+            with contextlib.redirect_stdout(io.StringIO()):
+                hue.refresh_cache(wipe=True, scheduled_refresh=True)
+
+        report(size, 'refresh_cache', measure(refresh, args.iterations))
+
+        names = [light['metadata']['name'] for light in home['light']] or ['missing']
+        report(size, 'get_light_by_name', measure(
+            lambda _: hue.get_light_by_name(random.choice(names)), args.iterations * 50))
+
+        room_ids = [room['id'] for room in home['room']]
+        report(size, 'room set (grouped)', measure(
+            lambda i: hue.set_room_light_states(room_ids[i % len(room_ids)], (255, 0, i % 256)), args.iterations))
+
+        def room_fan_out(i):
+            room = hue.get_room(room_ids[i % len(room_ids)])
+            light_ids = bridge.room_light_ids(room['id'])
+            colours = {light_id: (n % 256, 0, 255) for (n, light_id) in enumerate(light_ids)}
+            with contextlib.redirect_stdout(io.StringIO()):
+                hue.set_room_light_states(room['id'], colours)
+
+        report(size, 'room set (per light)', measure(room_fan_out, args.iterations))
+
+        env = dict(os.environ, PYHUE_PATH=base, PYHUE_SOCKET=base + 'data/none.sock')
+        report(size, 'cli.py ls (cached)', measure(
+            lambda _: subprocess.run([sys.executable, os.path.join(ROOT, 'cli.py'), 'ls', '-n'],
+                                     env=env, check=True, stdout=subprocess.DEVNULL, timeout=60),
+            args.cli_iterations))
+
+        hue.close()
+        print(f'{size:>6} fake bridge: {bridge.requests} requests, {bridge.errors_injected} injected errors')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000], help='Lights per home')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--cli-iterations', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.002, help='Seconds the fake bridge adds per request')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    print(f'Python {sys.version.split()[0]}, bridge latency {args.latency * 1000:.1f} ms '
+          f'(+ up to {args.jitter * 1000:.1f} ms jitter), error rate {args.error_rate:.1%}')
+    for size in args.sizes:
+        run_size(size, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+import json
+import mmap
+import os
+import struct
+import threading
+
+from locks import FileLock
+
+# Sectioned cache file layout (all integers little endian):
+#   header:  magic (4s) | format version (H) | codec (B) | section count (H)
+#   table:   per section: name length (B) | name | offset (Q) | length (Q)
+#   data:    the encoded sections, back to back
+MAGIC = b'PYHC'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHBH')
+TABLE_ENTRY = struct.Struct('<QQ')
+
+# Collections whose last refresh is recorded in a stamp file next to the cache (see mark_refreshed)
+STAMPED_KEYS = ('device', 'lights', 'rooms', 'scenes')
+
+CODEC_JSON = 0
+CODEC_MSGPACK = 1
+
+
+def _encode(value, codec: int) -> bytes:
+    if codec == CODEC_MSGPACK:
+        import msgpack
+        return msgpack.packb(value)
+    return json.dumps(value).encode()
+
+
+def _decode(data, codec: int):
+    if codec == CODEC_MSGPACK:
+        import msgpack
+        return msgpack.unpackb(data)
+    return json.loads(bytes(data))
+
+
+def default_codec() -> int:
+    """ msgpack if it is installed, JSON otherwise """
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return CODEC_JSON
+    return CODEC_MSGPACK
+
+
+def atomic_write(file_path: str, data: bytes):
+    """
+    Write to a temp file and rename it over file_path, so readers never see a partial file.
+    The temp file is unique per thread and process, concurrent writers never write into each other's.
+    """
+    tmp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class JsonCacheStorage:
+    """ The original format: the whole cache as one JSON document """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        # Held by everything that reads, changes and writes back the file (refreshes, flushes, migrations)
+        self.lock = FileLock(f'{file_path}.lock')
+
+    def exists(self) -> bool:
+        return os.path.exists(self.file_path)
+
+    def signature(self):
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def remove(self):
+        for file_path in [self.file_path] + [self._stamp_path(key) for key in STAMPED_KEYS]:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    def _stamp_path(self, key: str) -> str:
+        return f'{self.file_path}.{key}.refreshed'
+
+    def mark_refreshed(self, key: str):
+        """ Record that a collection was just refreshed, in an empty stamp file's mtime (no rewrite of the cache) """
+        stamp_path = self._stamp_path(key)
+        try:
+            os.utime(stamp_path)
+        except FileNotFoundError:
+            open(stamp_path, 'wb').close()
+
+    def refreshed_at(self, key: str) -> float | None:
+        """ Unix time of the collection's last refresh, None if it never was (or the cache was wiped) """
+        try:
+            return os.stat(self._stamp_path(key)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def read_all(self) -> dict | None:
+        if not self.exists():
+            return None
+        with open(self.file_path, 'r') as file:
+            return json.loads(file.read())
+
+    def read_section(self, key: str):
+        data = self.read_all()
+        return None if data is None else data.get(key)
+
+    def write_all(self, data: dict):
+        atomic_write(self.file_path, json.dumps(data).encode())
+
+
+class SectionedCacheStorage(JsonCacheStorage):
+    """
+    Cache file with one independently encoded section per top-level key and an offset table,
+    so a single collection can be read without decoding (or even reading) the rest of the file.
+    """
+
+    def __init__(self, file_path: str, codec: int | None = None, use_mmap: bool = False,
+                 legacy_json_path: str | None = None):
+        """
+        :param codec: CODEC_JSON or CODEC_MSGPACK for new writes (defaults to msgpack if available)
+        :param use_mmap: Read sections through a memory map instead of seek + read
+        :param legacy_json_path: A cache.json to migrate from if this file doesn't exist yet
+        """
+        super().__init__(file_path)
+        self.codec = default_codec() if codec is None else codec
+        self.use_mmap = use_mmap
+        self.legacy_json_path = legacy_json_path
+
+    def _migrate(self):
+        if self.exists() or self.legacy_json_path is None or not os.path.exists(self.legacy_json_path):
+            return
+
+        with self.lock:
+            # Another process may have migrated while we waited for the lock
+            if self.exists() or not os.path.exists(self.legacy_json_path):
+                return
+
+            legacy = JsonCacheStorage(self.legacy_json_path)
+            try:
+                data = legacy.read_all()
+            except ValueError:
+                data = None
+            if data is not None:
+                self.write_all(data)
+            legacy.remove()
+
+    def signature(self):
+        self._migrate()
+        return super().signature()
+
+    def _read_table(self, file) -> tuple[int, dict] | None:
+        header = file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        (magic, version, codec, count) = HEADER.unpack(header)
+        # Unknown or older layouts are treated like a missing cache, which makes the next refresh rewrite it
+        if magic != MAGIC or version != FORMAT_VERSION:
+            return None
+
+        # A truncated or corrupt file is treated the same way
+        size = os.fstat(file.fileno()).st_size
+        table = {}
+        try:
+            for _ in range(count):
+                name = file.read(file.read(1)[0]).decode()
+                table[name] = TABLE_ENTRY.unpack(file.read(TABLE_ENTRY.size))
+        except (IndexError, struct.error, UnicodeDecodeError):
+            return None
+        if any(offset + length > size for (offset, length) in table.values()):
+            return None
+        return codec, table
+
+    def _read(self, keys: list[str] | None) -> dict | None:
+        self._migrate()
+        if not self.exists():
+            return None
+
+        with open(self.file_path, 'rb') as file:
+            header = self._read_table(file)
+            if header is None:
+                return None
+            (codec, table) = header
+            if keys is None:
+                keys = list(table)
+
+            if self.use_mmap:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return {key: _decode(mapped[offset:offset + length], codec)
+                            for (key, (offset, length)) in table.items() if key in keys}
+
+            result = {}
+            for key in keys:
+                if key not in table:
+                    continue
+                (offset, length) = table[key]
+                file.seek(offset)
+                result[key] = _decode(file.read(length), codec)
+            return result
+
+    def read_all(self) -> dict | None:
+        return self._read(None)
+
+    def read_section(self, key: str):
+        data = self._read([key])
+        return None if data is None else data.get(key)
+
+    def write_all(self, data: dict):
+        sections = [(key.encode(), _encode(value, self.codec)) for (key, value) in data.items()]
+
+        table_size = sum(1 + len(name) + TABLE_ENTRY.size for (name, _) in sections)
+        offset = HEADER.size + table_size
+        parts = [HEADER.pack(MAGIC, FORMAT_VERSION, self.codec, len(sections))]
+        for (name, encoded) in sections:
+            parts.append(bytes([len(name)]) + name + TABLE_ENTRY.pack(offset, len(encoded)))
+            offset += len(encoded)
+        parts += [encoded for (_, encoded) in sections]
+
+        atomic_write(self.file_path, b''.join(parts))
+
+
+def open_cache_storage(json_file_dir: str, cache_format: str = 'sectioned', **kwargs):
+    """
+    :param cache_format: 'sectioned' (cache.bin, migrated from cache.json on first use) or 'json' (cache.json)
+    """
+    if cache_format == 'json':
+        return JsonCacheStorage(f'{json_file_dir}/cache.json')
+    return SectionedCacheStorage(f'{json_file_dir}/cache.bin', legacy_json_path=f'{json_file_dir}/cache.json',
+                                 **kwargs)
@@ -1,46 +1,149 @@
 #!/usr/bin/env python3
-import json
-import math
-
 import click
 
-from pyhue import Hue, DebugMode
+import daemon
 
 # region setup
-hue = Hue()
-hue.refresh_cache(scheduled_refresh=True)
-hue.debug_mode = DebugMode.CREATE_DEBUG_FILES
+_hue = None
+# Seconds a background refresh may keep a command from exiting when the bridge doesn't answer
+BACKGROUND_REFRESH_DEADLINE = 2.0
+
+
+def get_hue(background_refresh: bool = True, metrics: bool = False):
+    """
+    Create the Hue client on first use, so that --help and the like never touch the bridge.
+    A stale cache is refreshed in the background while the command runs on the cached data.
+    """
+    global _hue
+    if _hue is not None:
+        return _hue
+
+    from pyhue import Hue, DebugMode
+
+    _hue = Hue(metrics=metrics)
+    _hue.debug_mode = DebugMode.CREATE_DEBUG_FILES
+    _hue.revalidate_deadline = BACKGROUND_REFRESH_DEADLINE
+    if background_refresh and _hue.cache_is_stale():
+        # Shares the fetch with get_* calls that find the same collections stale
+        _hue.revalidate(list(_hue.CACHED_RESOURCES))
+    return _hue
+
+
+def run_command(cmd: str, command, **params):
+    """
+    Run a command in the daemon if one is running, otherwise in this process.
+    A command returns False if it failed, which exits with status 1.
+    """
+    from transport import HueCommandError, HueError
+
+    try:
+        if daemon.forward(cmd, params, echo=click.echo):
+            return
+        if command(get_hue(), click.echo, **params) is False:
+            raise HueCommandError(f'\'{cmd}\' failed')
+    except HueCommandError:
+        # The command's output already says what went wrong
+        click.get_current_context().exit(1)
+    except HueError as e:
+        raise click.ClickException(str(e))
+
+
+def wait_for_background_refresh():
+    """
+    Let a background refresh finish before the interpreter shuts down: once it does, the refresh can't start its
+    fetches anymore and the cache would never be refreshed. The wait is bounded by the refresh's deadline.
+    """
+    if _hue is not None:
+        _hue.wait_for_revalidation()
 
 
 @click.group()
-def cli():
-    pass
+@click.pass_context
+def cli(ctx):
+    ctx.call_on_close(wait_for_background_refresh)
 
 
 # endregion
 
 # region set light state and set room state
-@cli.command('light')
-@click.argument('light_name')
-@click.option('--is-id', is_flag=True, default=False)
-@click.option('--rgb', required=True, help='RGB color values', nargs=3, type=int)  # --rgb 255 0 0
-@click.option('-b', '--brightness', help='Brightness of the light', default=None)
-def control_light(light_name, is_id, rgb, brightness=None):
-    """ Control a single Hue light """
-    click.echo('Working on it...')
+def describe_errors(errors: list) -> str:
+    """ The bridge's error descriptions of a failed command """
+    descriptions = [error.get('description', str(error)) if isinstance(error, dict) else str(error)
+                    for error in errors or []]
+    return '; '.join(descriptions) or 'no details'
+
 
+def light_command(hue, echo, light_name, is_id, rgb, brightness=None):
     light_id = light_name
     if not is_id:
         light = hue.get_light_by_name(name=light_name)
         if light is None:
-            click.echo(f'Unable to find light with name \'{light_name}\'! Have you refreshed the cache after renaming?')
-            exit()
+            echo(f'Unable to find light with name \'{light_name}\'! Have you refreshed the cache after renaming?')
+            return False
         light_id = light['id']
 
-    print(light_id)
+    echo(light_id)
 
-    hue.set_light_state(light_id=light_id, rgb=rgb, on_state=True, brightness=brightness)
-    click.echo('Done!')
+    result = hue.set_light_state(light_id=light_id, rgb=tuple(rgb), on_state=True, brightness=brightness)
+    if not result.ok:
+        echo(f'Setting the light failed with status {result.status_code}: {describe_errors(result.errors)}')
+        return False
+    echo('Done!')
+
+
+def room_command(hue, echo, room_name, is_id, rgb, brightness=None):
+    room_id = room_name
+    if not is_id:
+        room = hue.get_room_by_name(room_name)
+        if room is None:
+            echo(f'Unable to find room with name \'{room_name}\'! Have you refreshed the cache after renaming?')
+            return False
+        room_id = room['id']
+
+    results = hue.set_room_light_states(room_id=room_id, rgb=tuple(rgb), brightness=brightness)
+    if results is None:
+        echo(f'Unable to find room {room_id}!')
+        return False
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        echo(f'Setting {result.light_id} failed with status {result.status_code}: {describe_errors(result.errors)}')
+    if len(failed) > 0:
+        return False
+    echo('Done!')
+
+
+def scene_command(hue, echo, scene_name, is_id, room, brightness=None):
+    scene_id = scene_name
+    if not is_id:
+        room_id = None
+        if room is not None:
+            room_res = hue.get_room_by_name(room)
+            if room_res is None:
+                echo(f'Unable to find room with name \'{room}\'!')
+                return False
+            room_id = room_res['id']
+
+        scene = hue.get_scene_by_name(scene_name, room_id=room_id)
+        if scene is None:
+            echo(f'Unable to find scene with name \'{scene_name}\'! Have you refreshed the cache?')
+            return False
+        scene_id = scene['id']
+
+    if not hue.recall_scene(scene_id, brightness=brightness):
+        echo('Recalling the scene failed')
+        return False
+    echo('Done!')
+
+
+@cli.command('light')
+@click.argument('light_name')
+@click.option('--is-id', is_flag=True, default=False)
+@click.option('--rgb', required=True, help='RGB color values', nargs=3, type=int)  # --rgb 255 0 0
+@click.option('-b', '--brightness', help='Brightness of the light', default=None)
+def control_light(light_name, is_id, rgb, brightness=None):
+    """ Control a single Hue light """
+    click.echo('Working on it...')
+    run_command('light', light_command, light_name=light_name, is_id=is_id, rgb=rgb, brightness=brightness)
 
 
 @cli.command('room')
@@ -51,16 +154,17 @@ def control_light(light_name, is_id, rgb, brightness=None):
 def control_room(room_name, is_id, rgb, brightness=None):
     """ Control all the lights in a room """
     click.echo('Working on it...')
+    run_command('room', room_command, room_name=room_name, is_id=is_id, rgb=rgb, brightness=brightness)
 
-    room_id = room_name
-    if not is_id:
-        room_id = hue.get_light_setup_id_by_name(room_name)
-        if room_id is None:
-            click.echo(f'Unable to find light with name \'{room_name}\'!')
-            exit()
 
-    hue.set_room_light_states(room_id=room_id, rgb=rgb, brightness=brightness)
-    click.echo('Done!')
+@cli.command('scene')
+@click.argument('scene_name')
+@click.option('--is-id', is_flag=True, default=False)
+@click.option('-r', '--room', help='Name of the room the scene belongs to', default=None)
+@click.option('-b', '--brightness', help='Brightness of the scene', default=None, type=float)
+def recall_scene(scene_name, is_id, room, brightness=None):
+    """ Recall a scene """
+    run_command('scene', scene_command, scene_name=scene_name, is_id=is_id, room=room, brightness=brightness)
 
 
 # endregion
@@ -74,13 +178,19 @@ def control_room(room_name, is_id, rgb, brightness=None):
 @click.option('-w', '--wipe', is_flag=True, default=False)
 def refresh_cache(device, rooms, scenes, lights, wipe):
     """ Refresh the existing cache """
+    if not device and not rooms and not scenes and not lights:
+        click.echo('Nothing to refresh. Specify what you want to refresh with --rooms, --device, --scenes and/or '
+                   '--lights.\n\'pyhue refresh-cache --help\' for more help')
+        return
 
-    if not device and not rooms and not rooms:
-        click.echo('Nothing to refresh. Specify what you want to refresh with --rooms, --device and/or --scenes.'
-                   '\n\'pyhue refresh-cache --help\' for more help')
+    from transport import HueError
 
-    hue.refresh_cache(refresh_rooms=rooms, refresh_device=device, refresh_scenes=scenes, refresh_lights=lights,
-                      wipe=wipe, log=click.echo)
+    try:
+        get_hue(background_refresh=False).refresh_cache(refresh_rooms=rooms, refresh_device=device,
+                                                        refresh_scenes=scenes, refresh_lights=lights,
+                                                        wipe=wipe, log=click.echo, scheduled_refresh=False)
+    except HueError as e:
+        raise click.ClickException(str(e))
 
 
 # endregion
@@ -152,6 +262,25 @@ def remove_setup_entry(for_light, rid):
 # endregion
 
 # region ls and rn commands
+def list_command(hue, echo, long, type, names, ids, rooms, no_lights, no_cache, fields=None, output_format='text',
+                 room=None, name=None, on=None, archetype=None):
+    import listing
+
+    if fields is None:
+        if not long and not names and not ids:
+            ids = True
+        fields = ','.join(field for (field, show) in (('type', type), ('id', ids), ('name', names)) if show)
+    try:
+        fields = listing.parse_fields(fields)
+    except ValueError as e:
+        echo(str(e))
+        return
+
+    keys = (['rooms'] if rooms else []) + ([] if no_lights else ['lights'])
+    listing.stream(hue, echo, fields, output_format, keys=keys, room=room, name=name, on=on, archetype=archetype,
+                   cached=not no_cache)
+
+
 @cli.command('ls')
 @click.option('-l', '--long', help='A more human-readable way of displaying', is_flag=True, default=False)
 @click.option('-t', '--type', help='List with type of device (room/light)', is_flag=True, default=False)
@@ -160,32 +289,19 @@ def remove_setup_entry(for_light, rid):
 @click.option('-r', '--rooms', help='List rooms', is_flag=True, default=False)
 @click.option('-L', '--no-lights', help='Do not list the lights', is_flag=True, default=False)
 @click.option('-C', '--no-cache', help='Do not get the info out of the cache', is_flag=True, default=False)
-def list_lights(long, type, names, ids, rooms, no_lights, no_cache):
-    """ List all the lights and or rooms """
-    responses = {
-        'rooms': hue.get_rooms(cached=not no_cache) if rooms else None,
-        'lights': hue.get_lights(cached=not no_cache) if not no_lights else None,
-    }
-
-    if not long and not names and not ids:
-        ids = True
-
-    for key in responses:
-        device_data = responses[key]
-        if device_data is None:
-            continue
-
-        for device in device_data:
-            message = ''
-            if type:
-                message += f'{"room " if key == "rooms" else "light"} '
-
-            message += device['id'] if ids else ''
-
-            if names:
-                message += f'{" " if ids else ""}{device["metadata"]["name"]}'
-
-            click.echo(message)
+@click.option('-f', '--fields', help='Comma separated fields to show: id, type, name, room, on, brightness, xy, '
+                                     'rgb, archetype (overrides -t, -n and -i)', default=None)
+@click.option('-o', '--output', 'output_format', help='Output format', default='text',
+              type=click.Choice(['text', 'jsonl', 'tsv']))
+@click.option('--in-room', 'room', help='Only the lights in (or with -r: only) the room with this name', default=None)
+@click.option('--name', help='Only names matching this case-insensitive glob (e.g. \'desk*\')', default=None)
+@click.option('--on/--off', 'on', help='Only lights that are on/off', default=None)
+@click.option('-a', '--archetype', help='Only this archetype (e.g. sultan_bulb, living_room)', default=None)
+def list_lights(long, type, names, ids, rooms, no_lights, no_cache, fields, output_format, room, name, on, archetype):
+    """ List all the lights and or rooms, one record per line """
+    run_command('ls', list_command, long=long, type=type, names=names, ids=ids, rooms=rooms,
+                no_lights=no_lights, no_cache=no_cache, fields=fields, output_format=output_format,
+                room=room, name=name, on=on, archetype=archetype)
 
 
 @cli.command('rn', deprecated=True)
@@ -208,6 +324,62 @@ def rename_light(id, new_name, room):
     # hue.rename_light_or_room(id, new_name, room)
 
 
+# endregion
+
+# region stats
+def stats_command(hue, echo, as_json):
+    metrics = hue.stats()
+    if metrics is None:
+        echo('No metrics recorded. Metrics are collected by the daemon, start one with \'pyhue daemon\'.')
+        return
+
+    if as_json:
+        import json
+        echo(json.dumps(metrics.snapshot(), indent=2))
+    else:
+        echo(metrics.to_prometheus().rstrip('\n'))
+
+
+@cli.command('stats')
+@click.option('-j', '--json', 'as_json', help='Print a JSON snapshot instead of the Prometheus text format',
+              is_flag=True, default=False)
+def show_stats(as_json):
+    """ Show request latencies, rate limit waits, cache hits and more of the running daemon """
+    run_command('stats', stats_command, as_json=as_json)
+
+
+# endregion
+
+# region daemon
+DAEMON_COMMANDS = {
+    'light': light_command,
+    'room': room_command,
+    'scene': scene_command,
+    'ls': list_command,
+    'stats': stats_command,
+}
+
+
+@cli.command('daemon')
+@click.option('-e', '--events', help='Keep the cache live from the bridge\'s eventstream', is_flag=True, default=False)
+@click.option('-m', '--metrics/--no-metrics', help='Record metrics for \'pyhue stats\'', default=True)
+@click.option('-c', '--coalesce-window', help='Seconds light updates are collected and merged before they are '
+                                              'written, e.g. 0.05 to merge bursts from many clients '
+                                              '(0: write immediately)', default=0.0, type=float)
+def run_daemon(events, metrics, coalesce_window):
+    """ Keep a Hue client running and serve the light, room, scene, ls and stats commands over a local socket """
+    hue = get_hue(metrics=metrics)
+    if coalesce_window > 0:
+        hue.enable_command_queue(coalesce_window)
+    if events:
+        hue.start_event_stream()
+
+    try:
+        daemon.serve(hue, DAEMON_COMMANDS, log=click.echo)
+    finally:
+        hue.close()
+
+
 # endregion
 
 if __name__ == '__main__':
@@ -0,0 +1,245 @@
+import colorsys
+import math
+from functools import lru_cache
+
+# sRGB (D65) -> CIE XYZ and back
+SRGB_TO_XYZ = (
+    (0.412424, 0.357579, 0.180464),
+    (0.212656, 0.715158, 0.0721856),
+    (0.0193324, 0.119193, 0.950444),
+)
+XYZ_TO_SRGB = (
+    (3.24071, -1.53726, -0.498571),
+    (-0.969258, 1.87599, 0.0415557),
+    (0.0556352, -0.203996, 1.05707),
+)
+
+# Colour temperatures the Planckian locus approximation is valid for
+MIN_KELVIN = 1667
+MAX_KELVIN = 25000
+
+# How far the bridge's xy (it is rounded to 4 digits) may be off and still count as the same colour
+XY_TOLERANCE = 0.0005
+
+
+def same_xy(a: tuple[float, float], b: tuple[float, float]) -> bool:
+    """ True if two xy coordinates are the same colour, within XY_TOLERANCE """
+    return abs(a[0] - b[0]) <= XY_TOLERANCE and abs(a[1] - b[1]) <= XY_TOLERANCE
+
+
+# region Scalar conversions (pure python, so the CLI doesn't pay for importing numpy)
+def _linearize(channel: float) -> float:
+    return channel / 12.92 if channel <= 0.04045 else ((channel + 0.055) / 1.055) ** 2.4
+
+
+def _gamma(channel: float) -> float:
+    return 12.92 * channel if channel <= 0.0031308 else 1.055 * channel ** (1 / 2.4) - 0.055
+
+
+@lru_cache(maxsize=1024)
+def rgb_to_xy(rgb: tuple[int, int, int]) -> tuple[float, float]:
+    """
+    Memoised sRGB (0-255 per channel) -> CIE xy conversion. Lights are mostly set to a handful of colours,
+    so repeated conversions are served from a bounded LRU cache. Black has no chromaticity and is (0, 0).
+    """
+    linear = [_linearize(channel / 255) for channel in rgb]
+    (x, y, z) = (sum(m * c for (m, c) in zip(row, linear)) for row in SRGB_TO_XYZ)
+    total = x + y + z
+    if total == 0:
+        return 0.0, 0.0
+    return x / total, y / total
+
+
+def hsv_to_xy(hsv: tuple[float, float, float]) -> tuple[float, float]:
+    """ :param hsv: Hue in degrees (0-360), saturation and value (0-1) """
+    (h, s, v) = hsv
+    return rgb_to_xy(tuple(round(channel * 255) for channel in colorsys.hsv_to_rgb((h % 360) / 360, s, v)))
+
+
+def kelvin_to_xy(kelvin: float) -> tuple[float, float]:
+    """ Point on the Planckian locus (Kim et al. cubic approximation), kelvin is clamped to 1667-25000 """
+    t = min(MAX_KELVIN, max(MIN_KELVIN, kelvin))
+    if t <= 4000:
+        x = -0.2661239e9 / t ** 3 - 0.2343589e6 / t ** 2 + 0.8776956e3 / t + 0.179910
+    else:
+        x = -3.0258469e9 / t ** 3 + 2.1070379e6 / t ** 2 + 0.2226347e3 / t + 0.240390
+
+    if t <= 2222:
+        y = -1.1063814 * x ** 3 - 1.34811020 * x ** 2 + 2.18555832 * x - 0.20219683
+    elif t <= 4000:
+        y = -0.9549476 * x ** 3 - 1.37418593 * x ** 2 + 2.09137015 * x - 0.16748867
+    else:
+        y = 3.0817580 * x ** 3 - 5.87338670 * x ** 2 + 3.75112997 * x - 0.37001483
+    return x, y
+
+
+def mirek_to_xy(mirek: float) -> tuple[float, float]:
+    """ The bridge's colour temperature unit: mirek = 1,000,000 / kelvin """
+    return kelvin_to_xy(1_000_000 / mirek)
+
+
+@lru_cache(maxsize=1024)
+def xy_to_rgb(xy: tuple[float, float], brightness: float | None = None) -> tuple[int, int, int]:
+    """
+    CIE xy (and optionally a brightness of 0-100) -> sRGB 0-255, for display. Without a brightness the
+    colour is scaled to full brightness. Colours outside sRGB are clipped.
+    """
+    (x, y) = xy
+    if y <= 0:
+        return 0, 0, 0
+
+    big_y = 1.0 if brightness is None else max(0.0, brightness) / 100
+    xyz = (big_y / y * x, big_y, big_y / y * (1 - x - y))
+    linear = [max(0.0, sum(m * c for (m, c) in zip(row, xyz))) for row in XYZ_TO_SRGB]
+    peak = max(linear)
+    if peak > 1 or (brightness is None and peak > 0):
+        linear = [channel / peak for channel in linear]
+    return tuple(round(255 * min(1.0, _gamma(channel))) for channel in linear)
+
+
+def rgb_to_hex(rgb: tuple[int, int, int]) -> str:
+    return '#{:02x}{:02x}{:02x}'.format(*rgb)
+
+
+def gamut_of(light: dict | None) -> tuple[tuple[float, float], ...] | None:
+    """ The light's gamut triangle ((red), (green), (blue) xy) from its cached /resource/light data """
+    gamut = ((light or {}).get('color') or {}).get('gamut')
+    if not gamut:
+        return None
+    return tuple((gamut[corner]['x'], gamut[corner]['y']) for corner in ('red', 'green', 'blue'))
+
+
+def _closest_on_segment(p: tuple[float, float], a: tuple[float, float], b: tuple[float, float]):
+    (abx, aby) = (b[0] - a[0], b[1] - a[1])
+    length = abx * abx + aby * aby
+    t = 0.0 if length == 0 else min(1.0, max(0.0, ((p[0] - a[0]) * abx + (p[1] - a[1]) * aby) / length))
+    return a[0] + t * abx, a[1] + t * aby
+
+
+def clamp_to_gamut(xy: tuple[float, float], gamut) -> tuple[float, float]:
+    """ xy if the light can show it, otherwise the closest point on the edge of its gamut triangle """
+    if gamut is None:
+        return xy
+
+    (r, g, b) = gamut
+
+    def side(p, a, c):
+        return (p[0] - c[0]) * (a[1] - c[1]) - (a[0] - c[0]) * (p[1] - c[1])
+
+    (d1, d2, d3) = (side(xy, r, g), side(xy, g, b), side(xy, b, r))
+    if not ((d1 < 0 or d2 < 0 or d3 < 0) and (d1 > 0 or d2 > 0 or d3 > 0)):
+        return xy
+
+    candidates = [_closest_on_segment(xy, a, c) for (a, c) in ((r, g), (g, b), (b, r))]
+    return min(candidates, key=lambda p: math.dist(p, xy))
+
+
+# endregion
+
+# region Batch conversions (numpy)
+def _numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError('The batch colour conversions require numpy. Install it or use the scalar functions.')
+    return np
+
+
+def rgb_to_xy_batch(rgbs):
+    """
+    Vectorised rgb_to_xy for converting many colours at once
+    :param rgbs: Sequence or (n, 3) array of RGB values (0-255)
+    :return: (n, 2) array of xy coordinates
+    """
+    np = _numpy()
+    rgb = np.asarray(rgbs, dtype=np.float64).reshape(-1, 3) / 255
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.asarray(SRGB_TO_XYZ).T
+
+    total = xyz.sum(axis=1, keepdims=True)
+    safe_total = np.where(total == 0.0, 1.0, total)
+    return np.where(total == 0.0, 0.0, xyz[:, :2] / safe_total)
+
+
+def hsv_to_xy_batch(hsvs):
+    """ :param hsvs: Sequence or (n, 3) array of hue in degrees, saturation and value (0-1) """
+    np = _numpy()
+    hsv = np.asarray(hsvs, dtype=np.float64).reshape(-1, 3)
+    (h, s, v) = (hsv[:, 0] % 360 / 60, hsv[:, 1], hsv[:, 2])
+
+    # Distance of each channel's sector from the hue, the usual branch-free HSV -> RGB
+    k = (np.array([5.0, 3.0, 1.0]) + h[:, None]) % 6
+    rgb = v[:, None] - v[:, None] * s[:, None] * np.clip(np.minimum(k, 4 - k), 0, 1)
+    return rgb_to_xy_batch(np.round(rgb * 255))
+
+
+def kelvin_to_xy_batch(kelvins):
+    """ Vectorised kelvin_to_xy """
+    np = _numpy()
+    t = np.clip(np.asarray(kelvins, dtype=np.float64).reshape(-1), MIN_KELVIN, MAX_KELVIN)
+    x = np.where(t <= 4000,
+                 -0.2661239e9 / t ** 3 - 0.2343589e6 / t ** 2 + 0.8776956e3 / t + 0.179910,
+                 -3.0258469e9 / t ** 3 + 2.1070379e6 / t ** 2 + 0.2226347e3 / t + 0.240390)
+    y = np.select(
+        [t <= 2222, t <= 4000],
+        [-1.1063814 * x ** 3 - 1.34811020 * x ** 2 + 2.18555832 * x - 0.20219683,
+         -0.9549476 * x ** 3 - 1.37418593 * x ** 2 + 2.09137015 * x - 0.16748867],
+        3.0817580 * x ** 3 - 5.87338670 * x ** 2 + 3.75112997 * x - 0.37001483)
+    return np.stack([x, y], axis=1)
+
+
+def mirek_to_xy_batch(mireks):
+    np = _numpy()
+    return kelvin_to_xy_batch(1_000_000 / np.asarray(mireks, dtype=np.float64))
+
+
+def clamp_to_gamut_batch(xys, gamut):
+    """
+    Vectorised clamp_to_gamut
+    :param xys: (n, 2) xy coordinates
+    :param gamut: One triangle for all points, or an (n, 3, 2) array with one triangle per point
+    """
+    np = _numpy()
+    p = np.asarray(xys, dtype=np.float64).reshape(-1, 2)
+    if gamut is None:
+        return p
+    triangles = np.broadcast_to(np.asarray(gamut, dtype=np.float64), (len(p), 3, 2))
+    corners = [triangles[:, i] for i in range(3)]
+
+    def side(a, c):
+        return (p[:, 0] - c[:, 0]) * (a[:, 1] - c[:, 1]) - (a[:, 0] - c[:, 0]) * (p[:, 1] - c[:, 1])
+
+    sides = np.stack([side(corners[0], corners[1]), side(corners[1], corners[2]), side(corners[2], corners[0])])
+    inside = ~((sides < 0).any(axis=0) & (sides > 0).any(axis=0))
+
+    best = p.copy()
+    best_distance = np.full(len(p), np.inf)
+    for (a, c) in ((corners[0], corners[1]), (corners[1], corners[2]), (corners[2], corners[0])):
+        ab = c - a
+        length = (ab ** 2).sum(axis=1)
+        t = np.clip(((p - a) * ab).sum(axis=1) / np.where(length == 0, 1, length), 0, 1)
+        closest = a + t[:, None] * ab
+        distance = ((closest - p) ** 2).sum(axis=1)
+        closer = distance < best_distance
+        best[closer] = closest[closer]
+        best_distance[closer] = distance[closer]
+    return np.where(inside[:, None], p, best)
+
+
+def xy_to_rgb_batch(xys, brightness=None):
+    """ Vectorised xy_to_rgb, returns an (n, 3) array of 0-255 integers """
+    np = _numpy()
+    xy = np.asarray(xys, dtype=np.float64).reshape(-1, 2)
+    (x, y) = (xy[:, 0], np.where(xy[:, 1] <= 0, np.nan, xy[:, 1]))
+
+    big_y = np.ones(len(xy)) if brightness is None else np.clip(np.asarray(brightness, dtype=np.float64), 0, None) / 100
+    xyz = np.stack([big_y / y * x, big_y, big_y / y * (1 - x - y)], axis=1)
+    linear = np.clip(np.nan_to_num(xyz @ np.asarray(XYZ_TO_SRGB).T), 0, None)
+
+    peak = linear.max(axis=1, keepdims=True)
+    scale = (peak > 1) if brightness is not None else (peak > 0)
+    linear = np.where(scale, linear / np.where(peak == 0, 1, peak), linear)
+    srgb = np.where(linear <= 0.0031308, 12.92 * linear, 1.055 * linear ** (1 / 2.4) - 0.055)
+    return np.round(np.clip(srgb, 0, 1) * 255).astype(np.int64)
+
+# endregion
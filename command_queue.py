@@ -0,0 +1,212 @@
+import json
+import threading
+from concurrent.futures import Future
+
+from colors import same_xy
+from pyhue import Hue, LightStateResult
+from resource_cache import merge_resource
+
+
+def state_matches(state: dict, light: dict | None) -> bool:
+    """ True if the cached light already has every value the state would set """
+    if light is None:
+        return False
+
+    if 'on' in state and light.get('on', {}).get('on') != state['on']['on']:
+        return False
+
+    xy = state.get('color', {}).get('xy')
+    if xy is not None:
+        current = light.get('color', {}).get('xy')
+        if current is None:
+            return False
+        if not same_xy((current['x'], current['y']), (xy['x'], xy['y'])):
+            return False
+
+    brightness = state.get('dimming', {}).get('brightness')
+    if brightness is not None and light.get('dimming', {}).get('brightness') != brightness:
+        return False
+    return True
+
+
+class CommandQueue:
+    """
+    Write-behind queue for light states. Updates for the same light that arrive within the window are merged
+    (the latest colour wins, on-state and dimming are merged in), and the merged states are written in one go:
+    rooms whose lights all get the same state become a single grouped_light command, and states the cached
+    light already has are not written at all.
+    """
+
+    def __init__(self, hue: Hue, window: float = 0.05, skip_unchanged: bool | None = None, min_group_size: int = 2):
+        """
+        :param window: Seconds from the first pending update until the queue is written
+        :param skip_unchanged: Don't write states the cached light already has (None: only while the event stream
+                               keeps the cache live, otherwise the cache may not know about changes from elsewhere)
+        :param min_group_size: Only collapse rooms with at least this many lights into a grouped command
+        """
+        self.hue = hue
+        self.window = window
+        self.skip_unchanged = skip_unchanged
+        self.min_group_size = min_group_size
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        self._rooms = None
+        self._room_groups = []
+
+        self.counters = {'updates': 0, 'merged': 0, 'skipped': 0, 'grouped': 0, 'sent': 0}
+
+    # region Enqueue
+    def _enqueue(self, resource: str, rid: str, state: dict, members: list[str] | None = None) -> Future:
+        key = (resource, rid)
+        with self._lock:
+            self.counters['updates'] += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = ({}, Future(), members)
+            else:
+                self.counters['merged'] += 1
+            merge_resource(pending[0], state)
+
+            # A room update also overrides what is pending for its lights
+            for light_id in members or []:
+                light = self._pending.get(('light', light_id))
+                if light is not None:
+                    merge_resource(light[0], state)
+
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            return pending[1]
+
+    def set_light_state(self, light_id: str, rgb: tuple[int, int, int], on_state: bool = True,
+                        brightness: int | None = None) -> Future:
+        """ :return: Future of the LightStateResult of the (merged) write """
+        state = self.hue.light_state(rgb, on_state, brightness, self.hue.light_gamut(light_id))
+        return self._enqueue('light', light_id, state)
+
+    def set_room_light_states(self, room_id: str, rgb: tuple[int, int, int] | dict[str, tuple[int, int, int]],
+                              brightness: int | None = None) -> list[Future] | None:
+        """
+        Queue the states of a room's lights, see Hue.set_room_light_states
+        :return: One future per queued write, None if the room is unknown
+        """
+        room = self.hue.get_room(room_id)
+        if room is None:
+            return None
+
+        futures = []
+        for (grouped_light_id, light_ids, colour) in self.hue.room_commands(room, rgb):
+            if grouped_light_id is not None:
+                state = self.hue.light_state(colour, True, brightness)
+                futures.append(self._enqueue('grouped_light', grouped_light_id, state, self.hue.room_light_ids(room)))
+            else:
+                futures += [self.set_light_state(light_id, colour, True, brightness) for light_id in light_ids]
+        return futures
+
+    # endregion
+
+    # region Flush
+    def _groups(self) -> list[tuple[str, list[str]]]:
+        """ (grouped_light id, light ids) of every cached room, recomputed when the cached rooms change """
+        rooms = self.hue.cache.get('rooms')
+        if rooms is not self._rooms:
+            groups = []
+            for room in rooms or []:
+                grouped_light_id = self.hue.room_grouped_light_id(room)
+                light_ids = self.hue.room_light_ids(room)
+                if grouped_light_id is not None and len(light_ids) >= self.min_group_size:
+                    groups.append((grouped_light_id, light_ids))
+            (self._rooms, self._room_groups) = (rooms, groups)
+        return self._room_groups
+
+    def _write(self, entry: tuple, pending: dict):
+        ((resource, rid), payload, keys) = entry
+        try:
+            result = self.hue.put_light_state(rid, payload, resource=resource)
+        except Exception as e:
+            for key in keys:
+                pending[key][1].set_exception(e)
+            return
+
+        for key in keys:
+            pending[key][1].set_result(LightStateResult(key[1], result.ok, result.status_code, result.errors))
+
+    def flush(self):
+        """ Write everything that is pending now (called by the timer, or directly to not wait for the window) """
+        with self._lock:
+            (pending, self._pending) = (self._pending, {})
+            self._timer = None
+        if len(pending) == 0:
+            return
+
+        try:
+            self._flush(pending)
+        except Exception as e:
+            # On the timer's thread nobody would see the error, and the callers would wait for their results forever
+            for (_, future, _) in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def _flush(self, pending: dict):
+        skip_unchanged = self.skip_unchanged
+        if skip_unchanged is None:
+            skip_unchanged = self.hue.event_stream is not None
+        if skip_unchanged:
+            for key in [key for key in pending if key[0] == 'light']:
+                if state_matches(pending[key][0], self.hue.cache.by_id('lights', key[1])):
+                    future = pending.pop(key)[1]
+                    self.counters['skipped'] += 1
+                    future.set_result(LightStateResult(key[1], True, None, []))
+
+        payloads = {key: json.dumps(entry[0]) for (key, entry) in pending.items()}
+        grouped_writes = []
+        # Light id -> the grouped command that sets its room
+        covered = {}
+        for (key, payload) in payloads.items():
+            if key[0] == 'grouped_light':
+                grouped_writes.append((key, payload, [key]))
+                covered.update((light_id, grouped_writes[-1]) for light_id in pending[key][2] or [])
+
+        # Rooms whose lights all got the same state become a single grouped command
+        collapsed = set()
+        for (grouped_light_id, light_ids) in self._groups():
+            keys = [('light', light_id) for light_id in light_ids]
+            payload = payloads.get(keys[0])
+            if (payload is not None and ('grouped_light', grouped_light_id) not in payloads and
+                    all(light_id not in covered and payloads.get(key) == payload
+                        for (light_id, key) in zip(light_ids, keys))):
+                grouped_writes.append((('grouped_light', grouped_light_id), payload, keys))
+                collapsed.update(keys)
+                self.counters['grouped'] += len(keys)
+
+        light_writes = []
+        for (key, payload) in payloads.items():
+            if key[0] != 'light':
+                continue
+            if key in collapsed:
+                continue
+
+            grouped_write = covered.get(key[1])
+            if grouped_write is not None and grouped_write[1] == payload:
+                # The grouped command sets the light to this state anyway
+                grouped_write[2].append(key)
+                self.counters['grouped'] += 1
+                continue
+            light_writes.append((key, payload, [key]))
+
+        # Grouped commands go first, so updates of single lights end up on top of their room's state
+        for writes in (grouped_writes, light_writes):
+            self.counters['sent'] += len(writes)
+            self.hue.run_bulk(lambda entry: self._write(entry, pending), writes)
+
+    def close(self):
+        """ Write what is still pending and stop the timer """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        self.flush()
+
+    # endregion
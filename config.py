@@ -1 +1,3 @@
-full_path = '/home/ilja/Desktop/Projects/Development/Other/Console/Python/py-control-hue/'
+import os
+
+full_path = os.environ.get('PYHUE_PATH', '/home/ilja/Desktop/Projects/Development/Other/Console/Python/py-control-hue/')
@@ -0,0 +1,121 @@
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+from config import full_path
+from transport import HueCommandError, HueDaemonError
+
+# One request per connection, both directions are a single line of JSON:
+#   -> {"cmd": "light", "params": {...}}
+#   <- {"ok": true, "output": ["line", ...], "failed": false}
+# ok is False if the command raised (see "error"), failed is True if it ran but reported a failure
+SOCKET_PATH = os.environ.get('PYHUE_SOCKET', f'{full_path}data/pyhue.sock')
+MAX_LINE = 1024 * 1024
+
+
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline(MAX_LINE)
+        if not line:
+            return
+
+        output = []
+        try:
+            request = json.loads(line)
+            handler = self.server.handlers[request['cmd']]
+            failed = handler(self.server.hue, output.append, **request.get('params', {})) is False
+            response = {'ok': True, 'output': output, 'failed': failed}
+        except Exception as e:
+            response = {'ok': False, 'output': output, 'error': f'{type(e).__name__}: {e}'}
+
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def serve(hue, handlers: dict, socket_path: str = SOCKET_PATH, log=lambda x: x):
+    """
+    Serve CLI commands over a Unix domain socket until interrupted
+    :param hue: The Hue client shared by all requests (keeps its cache and connection pool warm)
+    :param handlers: Maps a command name to a function(hue, echo, **params)
+    :param log: Specify a log function (If empty: No log is shown)
+    """
+    if os.path.exists(socket_path):
+        if is_running(socket_path):
+            raise RuntimeError(f'A daemon is already listening on {socket_path}')
+        os.remove(socket_path)
+
+    server = _DaemonServer(socket_path, _DaemonHandler)
+    server.hue = hue
+    server.handlers = {'ping': lambda hue, echo: None, **handlers}
+    os.chmod(socket_path, 0o600)
+
+    if threading.current_thread() is threading.main_thread():
+        # Shut down cleanly (and remove the socket) when stopped by a service manager
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    log(f'Listening on {socket_path}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        log('Daemon stopped')
+
+
+def _send(request: dict, socket_path: str, timeout: float) -> dict | None:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b'\n')
+
+        with sock.makefile('rb') as file:
+            line = file.readline(MAX_LINE)
+    return json.loads(line) if line else None
+
+
+def is_running(socket_path: str = SOCKET_PATH) -> bool:
+    try:
+        return _send({'cmd': 'ping'}, socket_path, timeout=1.0) is not None
+    except (OSError, ValueError):
+        return False
+
+
+def forward(cmd: str, params: dict, echo=print, socket_path: str = SOCKET_PATH, timeout: float = 30.0) -> bool:
+    """
+    Run a command in the daemon if one is running
+    :return: False if there is no daemon (or none this user can reach), the caller should then run the command itself
+    :raise HueDaemonError: If the daemon didn't answer within timeout, or running the command raised
+    :raise HueCommandError: If the command reported a failure
+    """
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return False
+
+    try:
+        response = _send({'cmd': cmd, 'params': params}, socket_path, timeout)
+    except TimeoutError as e:
+        raise HueDaemonError(f'The daemon at {socket_path} didn\'t answer \'{cmd}\' within {timeout:g}s') from e
+    except OSError:
+        # A stale socket, or one owned by another user
+        return False
+    if response is None:
+        return False
+
+    for line in response['output']:
+        echo(line)
+    if not response['ok']:
+        raise HueDaemonError(f'Daemon failed to run \'{cmd}\': {response["error"]}')
+    if response.get('failed'):
+        raise HueCommandError(f'\'{cmd}\' failed')
+    return True
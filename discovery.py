@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+
+DISCOVERY_URL = 'https://discovery.meethue.com'
+
+
+def probe_bridge(ipaddr: str, timeout: float = 2.0) -> dict | None:
+    """
+    Ask a candidate address for its (unauthenticated) bridge config
+    :return: {'id', 'internalipaddress', 'name', 'modelid'}, or None if nothing answers like a Hue bridge
+    """
+    import requests
+
+    try:
+        res = requests.get(f'http://{ipaddr}/api/0/config', timeout=timeout)
+        config = res.json()
+    except (requests.RequestException, ValueError):
+        return None
+
+    if res.status_code != 200 or not isinstance(config, dict) or 'bridgeid' not in config:
+        return None
+
+    return {
+        'id': config['bridgeid'].lower(),
+        'internalipaddress': ipaddr,
+        'name': config.get('name'),
+        'modelid': config.get('modelid'),
+    }
+
+
+def discover_bridges(candidates: list[str] | None = None, timeout: float = 2.0) -> list[dict]:
+    """
+    Find the reachable bridges. The candidates are probed concurrently, so unreachable entries
+    (e.g. stale ones from the discovery portal) cost one timeout in total instead of one each.
+    :param candidates: Addresses to probe (If empty: Ask https://discovery.meethue.com)
+    :return: The bridges that answered, in the order of the candidates
+    """
+    if candidates is None:
+        import requests
+
+        try:
+            res = requests.get(DISCOVERY_URL, timeout=timeout * 2)
+        except requests.RequestException:
+            print(f'Something went wrong trying to connect to {DISCOVERY_URL}!')
+            return []
+        if res.status_code != 200:
+            print(f'Something went wrong trying to connect to {DISCOVERY_URL}!')
+            return []
+
+        candidates = [entry['internalipaddress'] for entry in res.json()]
+
+    # The portal can list the same bridge more than once
+    candidates = list(dict.fromkeys(candidates))
+    if len(candidates) == 0:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(16, len(candidates))) as executor:
+        results = executor.map(lambda ipaddr: probe_bridge(ipaddr, timeout), candidates)
+
+    bridges = {}
+    for bridge in results:
+        if bridge is not None:
+            bridges.setdefault(bridge['id'], bridge)
+    return list(bridges.values())
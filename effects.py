@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, TYPE_CHECKING
+
+from colors import rgb_to_xy, rgb_to_xy_batch
+from rate_limit import bucket_for_request
+
+if TYPE_CHECKING:
+    from pyhue import Hue
+
+
+class Keyframe(NamedTuple):
+    time: float
+    rgb: tuple[int, int, int]
+    brightness: float | None = None
+
+
+class EffectStats(NamedTuple):
+    frames: int
+    frames_sent: int
+    frames_dropped: int
+    commands_sent: int
+    commands_coalesced: int
+    duration: float
+    achieved_fps: float
+    jitter_ms: float
+    max_lateness_ms: float
+
+    def report(self) -> str:
+        return (f'{self.frames_sent}/{self.frames} frames at {self.achieved_fps:.1f} fps '
+                f'({self.frames_dropped} dropped, jitter {self.jitter_ms:.2f} ms, '
+                f'max lateness {self.max_lateness_ms:.2f} ms), '
+                f'{self.commands_sent} commands sent, {self.commands_coalesced} coalesced')
+
+
+class Timeline:
+    """ Keyframed colour (and optionally brightness) of one or more lights, interpolated linearly """
+
+    def __init__(self, light_ids: list[str], keyframes: list[Keyframe], resource: str = 'light'):
+        """
+        :param light_ids: Lights (or grouped_lights) that all follow this timeline
+        :param keyframes: At least one keyframe. Brightness is only animated if every keyframe has one
+        :param resource: 'light' or 'grouped_light'
+        """
+        if len(keyframes) == 0:
+            raise ValueError('A timeline needs at least one keyframe')
+
+        self.light_ids = list(light_ids)
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe.time)
+        self.resource = resource
+
+    @property
+    def duration(self) -> float:
+        return self.keyframes[-1].time
+
+    @property
+    def animates_brightness(self) -> bool:
+        return all(keyframe.brightness is not None for keyframe in self.keyframes)
+
+    def sample(self, times: list[float]) -> tuple[list, list | None]:
+        """
+        Interpolate the timeline at the given times
+        :return: (xy per time, brightness per time or None)
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            return self._sample_python(times)
+
+        times = np.asarray(times, dtype=np.float64)
+        key_times = [keyframe.time for keyframe in self.keyframes]
+        rgb = np.stack([np.interp(times, key_times, [keyframe.rgb[channel] for keyframe in self.keyframes])
+                        for channel in range(3)], axis=1)
+        xy = rgb_to_xy_batch(rgb).tolist()
+
+        brightness = None
+        if self.animates_brightness:
+            brightness = np.interp(times, key_times, [keyframe.brightness for keyframe in self.keyframes]).tolist()
+        return xy, brightness
+
+    def _sample_python(self, times: list[float]) -> tuple[list, list | None]:
+        xy = []
+        brightness = [] if self.animates_brightness else None
+
+        segment = 0
+        for t in times:
+            while segment < len(self.keyframes) - 2 and t > self.keyframes[segment + 1].time:
+                segment += 1
+            start = self.keyframes[segment]
+            end = self.keyframes[min(segment + 1, len(self.keyframes) - 1)]
+
+            span = end.time - start.time
+            f = 0.0 if span <= 0 else min(1.0, max(0.0, (t - start.time) / span))
+            xy.append(rgb_to_xy(tuple(round(a + (b - a) * f) for (a, b) in zip(start.rgb, end.rgb))))
+            if brightness is not None:
+                brightness.append(start.brightness + (end.brightness - start.brightness) * f)
+        return xy, brightness
+
+
+class EffectsEngine:
+    """
+    Plays timelines on the bridge. All frames are interpolated and serialised up front, then sent on a
+    fixed schedule at a frame rate the bridge's command budget can sustain. Lights that didn't change
+    since their last command are skipped, a light whose previous command is still in flight only gets
+    its newest state, and frames the scheduler is too late for are dropped instead of sent in a burst.
+    """
+
+    def __init__(self, hue: Hue, fps: float = 10.0, budget_share: float = 0.9, transition: bool = True):
+        """
+        :param fps: Target frame rate, lowered to what the rate budget allows for the animated lights
+        :param budget_share: Fraction of the command budget the effect may use (leaves room for other commands)
+        :param transition: Let the bridge fade between frames (smooths out low frame rates)
+        """
+        self.hue = hue
+        self.target_fps = fps
+        self.budget_share = budget_share
+        self.transition = transition
+        self.timelines: list[Timeline] = []
+
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = None
+
+    def add(self, timeline: Timeline) -> EffectsEngine:
+        self.timelines.append(timeline)
+        return self
+
+    def fade(self, light_ids: list[str], start: tuple[int, int, int], end: tuple[int, int, int], duration: float,
+             resource: str = 'light') -> EffectsEngine:
+        return self.add(Timeline(light_ids, [Keyframe(0.0, start), Keyframe(duration, end)], resource))
+
+    @property
+    def duration(self) -> float:
+        return max((timeline.duration for timeline in self.timelines), default=0.0)
+
+    def frame_rate(self) -> float:
+        """ The target frame rate, capped so every animated light can get a command per frame """
+        targets = {}
+        for timeline in self.timelines:
+            bucket = bucket_for_request('PUT', f'/resource/{timeline.resource}/')
+            targets[bucket] = targets.get(bucket, 0) + len(timeline.light_ids)
+
+        fps = self.target_fps
+        for (bucket, count) in targets.items():
+            (rate, _) = self.hue.rate_limiter.budgets.get(bucket, self.hue.rate_limiter.budgets['light'])
+            fps = min(fps, rate * self.budget_share / count)
+        return fps
+
+    def precompute(self, fps: float) -> list[dict[tuple[str, str], str]]:
+        """
+        Interpolate and serialise every frame
+        :return: Per frame: (resource, light id) -> JSON payload
+        """
+        frame_count = int(self.duration * fps) + 1
+        times = [i / fps for i in range(frame_count)]
+        dynamics = {'duration': int(1000 / fps)} if self.transition else None
+
+        frames = [{} for _ in range(frame_count)]
+        for timeline in self.timelines:
+            (xy, brightness) = timeline.sample(times)
+            for i in range(frame_count):
+                state = {
+                    'on': {'on': True},
+                    # The bridge doesn't resolve more than 4 decimals, rounding lets unchanged frames be skipped
+                    'color': {'xy': {'x': round(xy[i][0], 4), 'y': round(xy[i][1], 4)}},
+                }
+                if brightness is not None:
+                    state['dimming'] = {'brightness': round(brightness[i], 1)}
+                if dynamics is not None:
+                    state['dynamics'] = dynamics
+
+                payload = json.dumps(state)
+                for light_id in timeline.light_ids:
+                    frames[i][(timeline.resource, light_id)] = payload
+        return frames
+
+    def play(self, loops: int = 1) -> EffectStats:
+        """
+        Play the timelines and block until they are done (or stop() is called)
+        :param loops: How often to play the timelines (0: until stopped)
+        """
+        fps = self.frame_rate()
+        frames = self.precompute(fps)
+        self._stop.clear()
+
+        lock = threading.Lock()
+        idle = threading.Condition(lock)
+        last_sent = {}
+        in_flight = set()
+        pending = {}
+        counters = {'sent': 0, 'coalesced': 0}
+
+        executor = ThreadPoolExecutor(max_workers=self.hue.pool_size, thread_name_prefix='hue-effect')
+
+        def send(key: tuple[str, str], payload: str):
+            (resource, light_id) = key
+            try:
+                self.hue.put_light_state(light_id, payload, resource=resource)
+            finally:
+                with lock:
+                    in_flight.discard(key)
+                    # Only the newest state of a light that was busy is sent
+                    payload = pending.pop(key, None)
+                    if payload is not None:
+                        in_flight.add(key)
+                        counters['sent'] += 1
+                        executor.submit(send, key, payload)
+                    elif len(in_flight) == 0:
+                        idle.notify_all()
+
+        def send_frame(frame: dict[tuple[str, str], str]):
+            with lock:
+                for (key, payload) in frame.items():
+                    if last_sent.get(key) == payload:
+                        continue
+                    last_sent[key] = payload
+
+                    if key in in_flight:
+                        if key in pending:
+                            counters['coalesced'] += 1
+                        pending[key] = payload
+                    else:
+                        in_flight.add(key)
+                        counters['sent'] += 1
+                        executor.submit(send, key, payload)
+
+        lateness = []
+        frames_sent = 0
+        frames_dropped = 0
+        loop = 0
+        start = time.monotonic()
+        try:
+            while not self._stop.is_set() and (loops == 0 or loop < loops):
+                loop_start = start + loop * len(frames) / fps
+                i = 0
+                while i < len(frames) and not self._stop.is_set():
+                    due = loop_start + i / fps
+                    wait = due - time.monotonic()
+                    if wait > 0 and self._stop.wait(wait):
+                        break
+
+                    # Behind schedule: skip straight to the frame that is due now
+                    current = min(len(frames) - 1, int((time.monotonic() - loop_start) * fps))
+                    if current > i:
+                        frames_dropped += current - i
+                        i = current
+
+                    lateness.append(time.monotonic() - (loop_start + i / fps))
+                    send_frame(frames[i])
+                    frames_sent += 1
+                    i += 1
+                loop += 1
+        finally:
+            with idle:
+                if self._stop.is_set():
+                    pending.clear()
+                idle.wait_for(lambda: len(in_flight) == 0)
+            executor.shutdown(wait=True)
+
+        duration = time.monotonic() - start
+        self.stats = EffectStats(
+            frames=frames_sent + frames_dropped,
+            frames_sent=frames_sent,
+            frames_dropped=frames_dropped,
+            commands_sent=counters['sent'],
+            commands_coalesced=counters['coalesced'],
+            duration=duration,
+            achieved_fps=frames_sent / duration if duration > 0 else 0.0,
+            jitter_ms=statistics.pstdev(lateness) * 1000 if len(lateness) > 1 else 0.0,
+            max_lateness_ms=max(lateness, default=0.0) * 1000,
+        )
+        return self.stats
+
+    def start(self, loops: int = 0):
+        """ Play in a background thread, see play() """
+        self._thread = threading.Thread(target=self.play, args=(loops,), name='hue-effects', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0) -> EffectStats | None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        return self.stats
@@ -0,0 +1,177 @@
+import json
+import random
+import socket
+import threading
+
+import requests
+
+from resource_cache import ResourceCache
+
+
+def parse_sse_lines(lines):
+    """
+    Turn the lines of a text/event-stream response into (event id, data) tuples
+    :param lines: Iterable of decoded lines without line endings
+    """
+    event_id = None
+    data = []
+    for line in lines:
+        if line == '':
+            if data:
+                yield event_id, '\n'.join(data)
+            data = []
+            continue
+
+        if line.startswith(':'):
+            continue  # Comment / keep-alive
+
+        (field, _, value) = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+
+        if field == 'data':
+            data.append(value)
+        elif field == 'id':
+            event_id = value
+
+
+def _shutdown_socket(response: requests.Response):
+    """
+    Wake up the thread reading a streamed response. Closing the response from another thread would block on the
+    reader's buffer lock until the bridge sends something (or the read timeout expires), a socket shutdown makes
+    the blocked read return right away.
+    """
+    connection = getattr(response.raw, '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass  # Already closed
+
+
+class EventStream:
+    """
+    Background subscriber to the CLIP v2 eventstream. Events are applied to the ResourceCache as they arrive,
+    writes to the cache file are coalesced and flushed at most once per flush_interval.
+    """
+
+    def __init__(self, url: str, session: requests.Session, cache: ResourceCache,
+                 flush_interval: float = 1.0,
+                 min_backoff: float = 0.5,
+                 max_backoff: float = 30.0,
+                 read_timeout: float = 90.0,
+                 on_connect=None):
+        """
+        :param url: The eventstream url, e.g. https://<bridge>/eventstream/clip/v2
+        :param session: Session holding the hue-application-key header and verify policy
+        :param flush_interval: Seconds changes are collected before they are written to the cache file
+        :param min_backoff: Delay before the first reconnect attempt
+        :param max_backoff: Upper bound of the exponentially growing reconnect delay
+        :param read_timeout: Reconnect if the bridge sent nothing (not even a keep-alive) for this long
+        :param on_connect: Called on the stream's thread after every (re)connect, to resync what the cache missed
+        """
+        self.url = url
+        self.session = session
+        self.cache = cache
+        self.flush_interval = flush_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.read_timeout = read_timeout
+        self.on_connect = on_connect
+
+        self.last_event_id = None
+        self.connected = threading.Event()
+        self.events_received = 0
+        self.reconnects = 0
+
+        self._stopped = threading.Event()
+        self._thread = None
+        self._response = None
+        self._flush_lock = threading.Lock()
+        self._flush_timer = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='hue-eventstream', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0):
+        """ Stop listening and write pending changes to the cache file """
+        self._stopped.set()
+        response = self._response
+        if response is not None:
+            _shutdown_socket(response)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        self.cache.flush()
+
+    def _run(self):
+        backoff = self.min_backoff
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+                backoff = self.min_backoff
+            except requests.exceptions.ReadTimeout:
+                backoff = self.min_backoff
+            except (requests.exceptions.RequestException, ValueError):
+                pass
+            finally:
+                self.connected.clear()
+                # Closed by this thread, stop() only shuts the socket down
+                if self._response is not None:
+                    self._response.close()
+                self._response = None
+
+            if self._stopped.is_set():
+                break
+
+            self.reconnects += 1
+            # Full jitter keeps several clients from reconnecting in lockstep
+            self._stopped.wait(random.uniform(0, backoff))
+            backoff = min(self.max_backoff, backoff * 2)
+
+    def _listen(self):
+        headers = {'Accept': 'text/event-stream'}
+        if self.last_event_id is not None:
+            headers['Last-Event-ID'] = self.last_event_id
+
+        self._response = self.session.get(self.url, headers=headers, stream=True, timeout=(5, self.read_timeout))
+        self._response.raise_for_status()
+        # Before connected is set, so that whoever waits for it also sees the resync on_connect started
+        if self.on_connect is not None:
+            self.on_connect()
+        self.connected.set()
+
+        for (event_id, data) in parse_sse_lines(self._response.iter_lines(chunk_size=None, decode_unicode=True)):
+            if self._stopped.is_set():
+                return
+            if event_id is not None:
+                self.last_event_id = event_id
+
+            self.events_received += 1
+            if self.cache.apply_events(json.loads(data)):
+                self._schedule_flush()
+
+    def _schedule_flush(self):
+        with self._flush_lock:
+            if self._flush_timer is not None:
+                return
+
+            self._flush_timer = threading.Timer(self.flush_interval, self._flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush(self):
+        with self._flush_lock:
+            self._flush_timer = None
+        self.cache.flush()
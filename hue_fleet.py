@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import full_path
+from discovery import discover_bridges, probe_bridge
+from pyhue import Hue, LightStateResult
+
+
+class HueFleet:
+    """
+    Registry of several bridges. Every bridge is a Hue client with its own credentials, cache and
+    connection pool in fleet_dir/<bridge id>/. Lights, rooms and scenes are routed to the bridge that owns
+    them through a name index merged from the bridges' caches, and fleet-wide commands run on all
+    bridges in parallel.
+    """
+
+    def __init__(self, fleet_dir: str = full_path + 'data/bridges', max_workers: int = 8, **hue_kwargs):
+        """
+        :param fleet_dir: One sub directory per bridge is kept here
+        :param max_workers: How many bridges are talked to at the same time
+        :param hue_kwargs: Passed on to every Hue client (e.g. verify_ssl_cert, share_rate_limit)
+        """
+        self.fleet_dir = fleet_dir
+        self.max_workers = max_workers
+        self.hue_kwargs = hue_kwargs
+        self.bridges: dict[str, Hue] = {}
+
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.run(lambda hue: hue.close())
+
+    # region Registry
+    def load(self):
+        """ Create a client for every bridge that was linked before """
+        if not os.path.isdir(self.fleet_dir):
+            return
+
+        for bridge_id in sorted(os.listdir(self.fleet_dir)):
+            bridge_dir = f'{self.fleet_dir}/{bridge_id}'
+            if bridge_id not in self.bridges and os.path.exists(f'{bridge_dir}/api_config.json'):
+                self.bridges[bridge_id] = Hue(auto_connect=False, json_file_dir=bridge_dir, **self.hue_kwargs)
+
+    def add_bridge(self, ipaddr: str, bridge_id: str | None = None, auto_connect: bool = True) -> Hue:
+        """
+        Register (and link) the bridge at ipaddr
+        :param bridge_id: Name of the bridge's directory (If empty: The id the bridge reports, or its address)
+        """
+        if bridge_id is None:
+            bridge = probe_bridge(ipaddr)
+            bridge_id = bridge['id'] if bridge is not None else ipaddr.replace(':', '_')
+
+        if bridge_id in self.bridges:
+            return self.bridges[bridge_id]
+
+        bridge_dir = f'{self.fleet_dir}/{bridge_id}'
+        os.makedirs(bridge_dir, exist_ok=True)
+        hue = Hue(ipaddr, auto_connect=auto_connect, json_file_dir=bridge_dir, **self.hue_kwargs)
+        self.bridges[bridge_id] = hue
+        return hue
+
+    def discover(self, candidates: list[str] | None = None, auto_connect: bool = True) -> list[str]:
+        """
+        Probe for bridges concurrently and register the ones that aren't known yet
+        :param candidates: Addresses to probe (If empty: Ask the discovery portal)
+        :return: The ids of the newly added bridges
+        """
+        added = []
+        for bridge in discover_bridges(candidates):
+            if bridge['id'] not in self.bridges:
+                self.add_bridge(bridge['internalipaddress'], bridge['id'], auto_connect)
+                added.append(bridge['id'])
+        return added
+
+    def run(self, fn, bridge_ids: list[str] | None = None) -> dict:
+        """
+        Call fn(hue) for every (or every given) bridge in parallel
+        :return: The results by bridge id
+        """
+        bridge_ids = list(self.bridges) if bridge_ids is None else bridge_ids
+        if len(bridge_ids) == 0:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(bridge_ids))) as executor:
+            return dict(zip(bridge_ids, executor.map(lambda bridge_id: fn(self.bridges[bridge_id]), bridge_ids)))
+
+    def refresh_cache(self, **kwargs):
+        """ Refresh the caches of all bridges in parallel, see Hue.refresh_cache """
+        self.run(lambda hue: hue.refresh_cache(**kwargs))
+
+    # endregion
+
+    # region Routing
+    def _merged_index(self, key: str) -> dict[str, str]:
+        """ case-folded name -> id of the owning bridge, rebuilt when a bridge's cache file changed """
+        signatures = tuple((bridge_id, hue.cache.storage.signature()) for (bridge_id, hue) in self.bridges.items())
+        cached = self._indexes.get(key)
+        if cached is not None and cached[0] == signatures:
+            return cached[1]
+
+        with self._lock:
+            index = {}
+            for (bridge_id, hue) in self.bridges.items():
+                for resource in hue.cache.get(key) or []:
+                    name = resource.get('metadata', {}).get('name')
+                    # On a name clash the bridge registered first wins
+                    if name is not None:
+                        index.setdefault(name.casefold(), bridge_id)
+
+            self._indexes[key] = (signatures, index)
+            return index
+
+    def locate(self, key: str, name: str) -> tuple[str, dict] | None:
+        """
+        Find the bridge owning a resource
+        :param key: 'lights', 'rooms' or 'scenes'
+        :return: (id of the owning bridge, the cached resource), or None if no bridge knows the name
+        """
+        bridge_id = self._merged_index(key).get(name.casefold())
+        if bridge_id is not None:
+            resource = self.bridges[bridge_id].cache.by_name(key, name)
+            if resource is not None:
+                return bridge_id, resource
+
+        # Resources that were added or renamed through an eventstream aren't in the merged index yet
+        for (bridge_id, hue) in self.bridges.items():
+            resource = hue.cache.by_name(key, name)
+            if resource is not None:
+                return bridge_id, resource
+        return None
+
+    def get_light_by_name(self, name: str):
+        located = self.locate('lights', name)
+        return None if located is None else located[1]
+
+    def get_room_by_name(self, name: str):
+        located = self.locate('rooms', name)
+        return None if located is None else located[1]
+
+    # endregion
+
+    # region Commands
+    def set_light_state(self, name: str, rgb: tuple[int, int, int], on_state: bool = True,
+                        brightness: int | None = None) -> LightStateResult | None:
+        located = self.locate('lights', name)
+        if located is None:
+            print(f'No bridge knows a light named \'{name}\'.')
+            return None
+
+        (bridge_id, light) = located
+        return self.bridges[bridge_id].set_light_state(light['id'], rgb, on_state, brightness)
+
+    def set_lights_state(self, names: list[str], rgb: tuple[int, int, int], on_state: bool = True,
+                         brightness: int | None = None) -> dict[str, list[LightStateResult]]:
+        """
+        Set lights on any number of bridges to the same state. Each bridge gets one bulk command,
+        the bridges are driven in parallel.
+        :return: The results by bridge id
+        """
+        light_ids = {}
+        for name in names:
+            located = self.locate('lights', name)
+            if located is None:
+                print(f'No bridge knows a light named \'{name}\'.')
+                continue
+
+            (bridge_id, light) = located
+            light_ids.setdefault(bridge_id, []).append(light['id'])
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(light_ids)))) as executor:
+            futures = {
+                bridge_id: executor.submit(self.bridges[bridge_id].set_lights_state, ids, rgb, on_state, brightness)
+                for (bridge_id, ids) in light_ids.items()
+            }
+            return {bridge_id: future.result() for (bridge_id, future) in futures.items()}
+
+    def set_room_light_states(self, name: str, rgb: tuple[int, int, int] | dict[str, tuple[int, int, int]],
+                              brightness: int | None = None) -> list[LightStateResult] | None:
+        located = self.locate('rooms', name)
+        if located is None:
+            print(f'No bridge knows a room named \'{name}\'.')
+            return None
+
+        (bridge_id, room) = located
+        return self.bridges[bridge_id].set_room_light_states(room['id'], rgb, brightness)
+
+    def recall_scene(self, name: str, action: str = 'active', brightness: int | None = None) -> bool:
+        located = self.locate('scenes', name)
+        if located is None:
+            print(f'No bridge knows a scene named \'{name}\'.')
+            return False
+
+        (bridge_id, scene) = located
+        return self.bridges[bridge_id].recall_scene(scene['id'], action, brightness)
+
+    # endregion
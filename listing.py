@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import fnmatch
+import json
+from typing import TYPE_CHECKING, Iterator
+
+from colors import rgb_to_hex, xy_to_rgb
+
+if TYPE_CHECKING:
+    from pyhue import Hue
+
+# Collection -> what 'type' shows for its records
+KINDS = {
+    'rooms': 'room',
+    'lights': 'light',
+}
+FORMATS = ('text', 'jsonl', 'tsv')
+
+
+# region Fields
+def _name(resource: dict):
+    return resource.get('metadata', {}).get('name')
+
+
+def _on(resource: dict):
+    return resource.get('on', {}).get('on')
+
+
+def _brightness(resource: dict):
+    return resource.get('dimming', {}).get('brightness')
+
+
+def _xy(resource: dict):
+    xy = resource.get('color', {}).get('xy')
+    return None if xy is None else [xy['x'], xy['y']]
+
+
+def _rgb(resource: dict):
+    """ The light's colour for display (at full brightness) as #rrggbb """
+    xy = resource.get('color', {}).get('xy')
+    if xy is None:
+        return None
+    return rgb_to_hex(xy_to_rgb((xy['x'], xy['y'])))
+
+
+def _archetype(resource: dict):
+    return resource.get('metadata', {}).get('archetype')
+
+
+# Field -> function(key, resource, rooms) returning its value, rooms is a RoomNames
+FIELDS = {
+    'id': lambda key, resource, rooms: resource.get('id'),
+    'type': lambda key, resource, rooms: KINDS[key],
+    'name': lambda key, resource, rooms: _name(resource),
+    'room': lambda key, resource, rooms: _name(resource) if key == 'rooms' else rooms.of_light(resource),
+    'on': lambda key, resource, rooms: _on(resource),
+    'brightness': lambda key, resource, rooms: _brightness(resource),
+    'xy': lambda key, resource, rooms: _xy(resource),
+    'rgb': lambda key, resource, rooms: _rgb(resource),
+    'archetype': lambda key, resource, rooms: _archetype(resource),
+}
+
+
+def parse_fields(fields: str | None) -> list[str] | None:
+    """
+    :param fields: Comma separated field names (e.g. 'id,name,room')
+    :raise ValueError: If a field is unknown
+    """
+    if fields is None:
+        return None
+
+    names = [name.strip() for name in fields.split(',') if name.strip() != '']
+    unknown = [name for name in names if name not in FIELDS]
+    if len(unknown) > 0:
+        raise ValueError(f'Unknown field(s) {", ".join(unknown)}. Available: {", ".join(FIELDS)}')
+    return names
+
+
+class RoomNames:
+    """
+    Name of the room each light is in, worked out on first use only (most listings never need it).
+    Cached lights are looked up in the cache's room index, live ones are resolved from the live rooms.
+    """
+
+    def __init__(self, hue: Hue, cached: bool = True):
+        self.hue = hue
+        self.cached = cached
+        self._names = None
+        self._index = None
+        self._by_light = None
+        self._by_device = None
+
+    def _load(self):
+        rooms = self.hue.get_rooms(cached=self.cached) or []
+        self._names = {room['id']: _name(room) for room in rooms}
+        if self.cached:
+            self._index = self.hue.cache.room_index()
+            return
+
+        (self._by_light, self._by_device) = ({}, {})
+        for room in rooms:
+            for service in room.get('services', []):
+                if service['rtype'] == 'light':
+                    self._by_light.setdefault(service['rid'], room['id'])
+            for child in room.get('children', []):
+                if child['rtype'] == 'device':
+                    self._by_device.setdefault(child['rid'], room['id'])
+
+    def of_light(self, light: dict) -> str | None:
+        if self._names is None:
+            self._load()
+        if self._index is not None:
+            return self._names.get(self._index.light_room_id(light.get('id')))
+
+        room_id = self._by_light.get(light.get('id'))
+        if room_id is None:
+            room_id = self._by_device.get(light.get('owner', {}).get('rid'))
+        return self._names.get(room_id)
+
+
+# endregion
+
+# region Filters
+def has_wildcards(pattern: str) -> bool:
+    return any(char in pattern for char in '*?[')
+
+
+def _candidates(hue: Hue, key: str, room: dict | None, name: str | None, cached: bool) -> Iterator[dict]:
+    """
+    The resources of a collection that can match the room and name filters. From the cache only the matching
+    records are looked up: a room's lights by id and a name without wildcards by name.
+    """
+    if room is not None:
+        if key == 'rooms':
+            yield room
+            return
+
+        light_ids = hue.room_light_ids(room)
+        if cached:
+            for light_id in light_ids:
+                light = hue.cache_lookup('lights', hue.cache.by_id('lights', light_id))
+                if light is not None:
+                    yield light
+            return
+
+        light_ids = set(light_ids)
+        yield from (light for light in hue.get_lights(cached=False) or [] if light['id'] in light_ids)
+        return
+
+    if cached and name is not None and not has_wildcards(name):
+        resource = hue.cache_lookup(key, hue.cache.by_name(key, name))
+        if resource is not None:
+            yield resource
+        # Unless the collection isn't cached (yet): get_lights/get_rooms below fetch it
+        if resource is not None or hue.cache.get(key) is not None:
+            return
+
+    collection = hue.get_rooms(cached=cached) if key == 'rooms' else hue.get_lights(cached=cached)
+    yield from collection or []
+
+
+def iter_records(hue: Hue,
+                 keys: list[str],
+                 room: str | None = None,
+                 name: str | None = None,
+                 on: bool | None = None,
+                 archetype: str | None = None,
+                 cached: bool = True) -> Iterator[tuple[str, dict]]:
+    """
+    Lazily yield the (collection key, resource) pairs that pass all filters
+    :param keys: Collections to list, 'rooms' and/or 'lights'
+    :param room: Only the room with this name (for 'rooms') or the lights in it (for 'lights')
+    :param name: Case-insensitive name or glob pattern (e.g. 'desk*')
+    :param on: Only resources that are on (True) or off (False). Rooms have no on-state and never match
+    :param archetype: Only resources with this metadata archetype (e.g. 'sultan_bulb', 'living_room')
+    :param cached: Read from the cache instead of fetching live from the bridge
+    """
+    room_resource = None
+    if room is not None:
+        room_resource = hue.get_room_by_name(room, cached=cached)
+        if room_resource is None:
+            return
+
+    pattern = name.casefold() if name is not None else None
+    for key in keys:
+        for resource in _candidates(hue, key, room_resource, name, cached):
+            if pattern is not None and not fnmatch.fnmatchcase((_name(resource) or '').casefold(), pattern):
+                continue
+            if on is not None and _on(resource) != on:
+                continue
+            if archetype is not None and _archetype(resource) != archetype:
+                continue
+            yield key, resource
+
+
+# endregion
+
+# region Output
+def project(key: str, resource: dict, fields: list[str], rooms: RoomNames) -> dict:
+    return {field: FIELDS[field](key, resource, rooms) for field in fields}
+
+
+def _tsv_value(value) -> str:
+    if value is None:
+        return ''
+    if value.__class__ is str:
+        # Tabs and newlines would break the columns
+        return value.replace('\t', ' ').replace('\n', ' ')
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, list):
+        return ','.join(str(v) for v in value)
+    return str(value)
+
+
+def format_record(record: dict, output_format: str) -> str:
+    if output_format == 'jsonl':
+        return json.dumps(record, separators=(',', ':'))
+    if output_format == 'tsv':
+        return '\t'.join([_tsv_value(value) for value in record.values()])
+    return ' '.join([_tsv_value(value) for value in record.values() if value is not None])
+
+
+def stream(hue: Hue, echo, fields: list[str], output_format: str = 'text', **filters) -> int:
+    """
+    Echo one line per matching record as soon as it is found (TSV starts with a header line)
+    :param filters: See iter_records
+    :return: The number of records
+    """
+    if output_format not in FORMATS:
+        raise ValueError(f'Unknown format \'{output_format}\'. Available: {", ".join(FORMATS)}')
+
+    rooms = RoomNames(hue, cached=filters.get('cached', True))
+    if output_format == 'tsv':
+        echo('\t'.join(fields))
+
+    getters = [(field, FIELDS[field]) for field in fields]
+    count = 0
+    for (key, resource) in iter_records(hue, **filters):
+        echo(format_record({field: get(key, resource, rooms) for (field, get) in getters}, output_format))
+        count += 1
+    return count
+
+# endregion
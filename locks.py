@@ -0,0 +1,128 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of this process are kept out
+    fcntl = None
+
+
+class RWLock:
+    """
+    Readers-writer lock: any number of readers or a single writer. Waiting writers block new readers,
+    so a steady stream of lookups can't starve a reload. The writer may take the lock again (and read)
+    while holding it, a reader must not try to upgrade to writing.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._cond = threading.Condition(self._mutex)
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writer = None
+        self._depth = 0
+
+    def acquire_read(self):
+        with self._mutex:
+            if self._writer is None and self._writers_waiting == 0:
+                self._readers += 1
+                return
+            if self._writer == threading.get_ident():
+                self._depth += 1
+                return
+            while self._writer is not None or self._writers_waiting > 0:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._mutex:
+            if self._writer is not None and self._writer == threading.get_ident():
+                self._depth -= 1
+                return
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._depth += 1
+                return
+            self._writers_waiting += 1
+            while self._writer is not None or self._readers > 0:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            (self._writer, self._depth) = (me, 1)
+
+    def release_write(self):
+        with self._cond:
+            self._depth -= 1
+            if self._depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    def read(self):
+        return _Held(self.acquire_read, self.release_read)
+
+    def write(self):
+        return _Held(self.acquire_write, self.release_write)
+
+
+class _Held:
+    __slots__ = ('_release',)
+
+    def __init__(self, acquire, release):
+        acquire()
+        self._release = release
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._release()
+
+
+class FileLock:
+    """
+    Exclusive lock shared by threads and processes through flock on a lock file next to the protected one.
+    Reentrant within a thread, so a refresh can hold it across the reads and writes it is made of.
+    """
+
+    def __init__(self, file_path: str):
+        """ :param file_path: The lock file (created if it doesn't exist, never removed) """
+        self.file_path = file_path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1 and fcntl is not None:
+            try:
+                self._fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._release_fd()
+                self._depth -= 1
+                self._lock.release()
+                raise
+
+    def _release_fd(self):
+        if self._fd is not None:
+            os.close(self._fd)  # Also releases the flock
+            self._fd = None
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._release_fd()
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
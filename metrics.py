@@ -0,0 +1,156 @@
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONVERSION_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3)
+
+# name -> (type, help)
+METRICS = {
+    'requests_total': ('counter', 'CLIP requests by method, endpoint and status code'),
+    'request_duration_seconds': ('histogram', 'CLIP request latency by method and endpoint'),
+    'request_bytes_total': ('counter', 'Request and response body bytes'),
+    'retries_total': ('counter', 'Requests that were retried, by reason'),
+    'rate_limit_wait_seconds': ('histogram', 'Time requests waited for the rate limiter, by bucket'),
+    'rate_limit_queue_depth': ('gauge', 'Requests currently waiting for the rate limiter'),
+    'cache_lookups_total': ('counter', 'Cached get_* lookups by collection and result (hit/stale/miss)'),
+    'color_conversion_seconds': ('histogram', 'Time spent converting RGB to xy per light state'),
+}
+
+
+def endpoint_for_path(path: str) -> str:
+    """ /resource/light/<id> -> /resource/light/{id}, so label values don't grow with the number of lights """
+    parts = path.split('?', 1)[0].split('/')
+    if len(parts) > 3:
+        return '/'.join(parts[:3]) + '/{id}'
+    return '/'.join(parts)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        """ Upper bound of the bucket the q-quantile falls into (None if nothing was observed) """
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for (bound, count) in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms keyed by name and label values. Hue only records into it when
+    hue.metrics is set, so a client without metrics pays a single attribute check per hot path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._values[(name, tuple(labels.items()))] = value
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def observe_request(self, method: str, path: str, status_code: int, duration: float,
+                        request_bytes: int, response_bytes: int):
+        endpoint = endpoint_for_path(path)
+        self.inc('requests_total', method=method, endpoint=endpoint, status=str(status_code))
+        self.observe('request_duration_seconds', duration, method=method, endpoint=endpoint)
+        self.inc('request_bytes_total', request_bytes, direction='sent')
+        self.inc('request_bytes_total', response_bytes, direction='received')
+
+    def get(self, name: str, **labels):
+        """ A counter or gauge value, or a histogram snapshot (None if nothing was recorded) """
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            if key in self._histograms:
+                return self._histograms[key].snapshot()
+            return self._values.get(key)
+
+    def snapshot(self) -> dict:
+        """ Everything recorded so far: name -> list of {'labels': {...}, 'value': ...} """
+        result = {}
+        with self._lock:
+            for ((name, labels), value) in self._values.items():
+                result.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            for ((name, labels), histogram) in self._histograms.items():
+                result.setdefault(name, []).append({'labels': dict(labels), 'value': histogram.snapshot()})
+        return result
+
+    def to_prometheus(self, prefix: str = 'pyhue_') -> str:
+        """ The Prometheus text exposition format (version 0.0.4) """
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        by_name = {}
+        for ((name, labels), value) in values:
+            by_name.setdefault(name, []).append(f'{prefix}{name}{_labels(labels)} {_number(value)}')
+
+        for ((name, labels), histogram) in histograms:
+            lines = by_name.setdefault(name, [])
+            cumulative = 0
+            for (bound, count) in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+            lines.append(f'{prefix}{name}_bucket{_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+            lines.append(f'{prefix}{name}_sum{_labels(labels)} {_number(histogram.sum)}')
+            lines.append(f'{prefix}{name}_count{_labels(labels)} {histogram.count}')
+
+        output = []
+        for (name, lines) in by_name.items():
+            (metric_type, description) = METRICS.get(name, ('untyped', name))
+            output.append(f'# HELP {prefix}{name} {description}')
+            output.append(f'# TYPE {prefix}{name} {metric_type}')
+            output += lines
+        return '\n'.join(output) + '\n'
+
+
+def _labels(labels: tuple) -> str:
+    if len(labels) == 0:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for (_, value) in labels)
+    return '{' + ','.join(f'{key}="{value}"' for ((key, _), value) in zip(labels, escaped)) + '}'
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
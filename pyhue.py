@@ -1,20 +1,30 @@
-import datetime
+from __future__ import annotations
+
 import json
-import os
+import sys
+import threading
+import time
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from typing import NamedTuple, TYPE_CHECKING
 
-import requests as requests
-import urllib3
-
-from time import sleep
 from os import path
-from colormath.color_conversions import convert_color
-from colormath.color_objects import sRGBColor, xyYColor
-from requests import Response
-from urllib3.exceptions import InsecureRequestWarning
+from cache_storage import atomic_write, open_cache_storage
+from colors import clamp_to_gamut, gamut_of, rgb_to_xy
 from config import full_path
+from metrics import CONVERSION_BUCKETS, Metrics
+from rate_limit import RateLimiter, bucket_for_request
+from request_trace import RequestTrace
+from resource_cache import ResourceCache
+from transport import HueConnectionError, HueLinkError, HueRequestError, Transport, request_failed
 
-urllib3.disable_warnings(category=InsecureRequestWarning)
+# requests (and the event stream built on it) are imported on first use, so that
+# commands answered from the cache don't pay for importing the HTTP stack
+if TYPE_CHECKING:
+    from requests import Session
+    from command_queue import CommandQueue
+    from event_stream import EventStream
 
 
 class DebugMode(Enum):
@@ -22,124 +32,279 @@ class DebugMode(Enum):
     CREATE_DEBUG_FILES = 1
 
 
+class LightStateResult(NamedTuple):
+    light_id: str
+    ok: bool
+    status_code: int
+    errors: list
+
+
+# Set in the threads of a client's bulk executor, so nested bulk calls run inline instead of waiting for the pool
+_bulk_worker = threading.local()
+
+
+def _mark_bulk_worker():
+    _bulk_worker.active = True
+
+
 class Hue:
-    bridge_api_url = None
-    bridge_clip_url = None
-    user = None
-    api_key = None
-    api_username = None
-    debug_mode = DebugMode.OFF
+    """
+    Client of one bridge. All state lives on the instance, and one client can be shared by many threads:
+    the cache is guarded by a readers-writer lock, the cache and config files by cross-process file locks.
+    """
+    # Defaults, override them per instance through __init__
     json_file_dir = full_path + 'data'
-
-    def __init__(self, ipaddr: str | None = None, auto_connect: bool = True):
+    pool_size = 10
+    cache_format = 'sectioned'
+    # Seconds a cached collection is served as is, after that it is revalidated (see CACHE_POLICIES)
+    cache_ttls = {'device': 86400, 'lights': 7200, 'rooms': 7200, 'scenes': 7200}
+    cache_policies = {'device': 'swr', 'lights': 'swr', 'rooms': 'swr', 'scenes': 'swr'}
+
+    def __init__(self, ipaddr: str | None = None, auto_connect: bool = True, verify_ssl_cert: bool = False,
+                 share_rate_limit: bool = False, json_file_dir: str | None = None, metrics: bool = False,
+                 cache_ttls: dict[str, int] | None = None, cache_policies: dict[str, str] | None = None):
+        """
+        :param share_rate_limit: Share the bridge's command budget with other processes through a lock file
+        :param metrics: Record latencies, bytes, rate limit waits, cache hits and conversion times (see stats())
+        :param json_file_dir: Keep this bridge's config and cache here instead of the shared data directory
+        :param cache_ttls: Per collection TTLs in seconds, e.g. {'lights': 60}
+        :param cache_policies: Per collection default policy of the cached get_* methods, e.g. {'scenes': 'cache'}
+        """
+        if json_file_dir is not None:
+            self.json_file_dir = json_file_dir
+        self.cache_ttls = {**self.cache_ttls, **(cache_ttls or {})}
+        self.cache_policies = {**self.cache_policies, **(cache_policies or {})}
+        for policy in self.cache_policies.values():
+            self.check_cache_policy(policy)
+        self.bridge_api_url = None
+        self.bridge_clip_url = None
+        self.api_key = None
+        self.api_username = None
+        self.debug_mode = DebugMode.OFF
+        self.verify_ssl_cert = verify_ssl_cert
+        # Guards the lazily created session, trace, executor, event stream, command queue and in-flight refreshes
+        self._lock = threading.RLock()
+        self._session = None
+        self._executor = None
+        self.cache = ResourceCache(open_cache_storage(self.json_file_dir, self.cache_format))
+        # cache key -> Future of the refresh currently fetching it, so concurrent callers share one fetch
+        self._inflight = {}
+        # cache key -> time.monotonic() until which the collection counts as fresh
+        self._fresh_until = {}
+        self.cache_counters = {key: {'hit': 0, 'stale': 0, 'miss': 0} for key in self.CACHED_RESOURCES}
+        self._counter_lock = threading.Lock()
+        self.event_stream = None
+        self.trace = None
+        self.metrics = Metrics() if metrics else None
+        self.transport = Transport()
+        # Seconds the fetches of a background revalidation may take, including retries (None: the transport's)
+        self.revalidate_deadline = None
+        self.command_queue = None
+        self.rate_limiter = RateLimiter(lock_file=f'{self.json_file_dir}/rate_limit.lock' if share_rate_limit else None)
         self.try_load_config()
         if self.bridge_api_url and self.bridge_clip_url:
             return
 
-        if ipaddr is not None:
-            self.bridge_api_url = f'http://{ipaddr}/api'
-            self.bridge_clip_url = f'https://{ipaddr}/clip/v2'
+        if ipaddr is None:
+            from discovery import discover_bridges
 
-            if auto_connect:
-                self.link()
-            self.save_config()
-            return
+            bridges = discover_bridges()
+            if len(bridges) == 0:
+                print('No reachable Hue bridge was found!')
+                return
+            ipaddr = bridges[0]['internalipaddress']
 
-        res = requests.get('https://discovery.meethue.com')
-        if res.status_code == 200:
-            self.bridge_api_url = f'http://{res.json()[0]["internalipaddress"]}/api'
-            self.bridge_clip_url = f'https://{res.json()[0]["internalipaddress"]}/clip/v2'
+        self.bridge_api_url = f'http://{ipaddr}/api'
+        self.bridge_clip_url = f'https://{ipaddr}/clip/v2'
 
-            if auto_connect:
-                self.link()
-            self.save_config()
-        else:
-            print('Something went wrong trying to connect to https://discovery.meethue.com!')
+        if auto_connect:
+            self.link()
+        self.save_config()
 
     def link(self, force=False):
         if not force and self.api_key and self.api_username:
             return
 
         if self.bridge_api_url is None or self.bridge_clip_url is None:
-            print('Bridge api client connection failed to initialize properly.')
-            return
+            raise HueLinkError('Bridge api client connection failed to initialize properly.')
+
+        import requests
 
         req_body = {
             'devicetype': 'PyHueController#justmedev',
             'generateclientkey': True,
         }
-        res = requests.post(self.bridge_api_url, json=req_body).json()[0]
+        try:
+            res = self.session.post(self.bridge_api_url, json=req_body,
+                                    timeout=(self.transport.connect_timeout, self.transport.read_timeout)).json()[0]
+        except requests.RequestException as e:
+            raise HueConnectionError(f'Unable to reach the bridge at {self.bridge_api_url}: {e}') from e
+        except (ValueError, KeyError, IndexError) as e:
+            raise HueLinkError(f'Unexpected response from the bridge at {self.bridge_api_url}') from e
+
         if 'error' in res:
             if res['error']['type'] == 101:
-                print('Press the link button on your Hue bridge and try again.')
-                exit()
+                raise HueLinkError('Press the link button on your Hue bridge and try again.')
+            raise HueLinkError(f'Linking failed: {res["error"].get("description")}')
 
         self.api_username = res['success']['username']
         self.api_key = res['success']['clientkey']
+        if self._session is not None:
+            self._session.headers['hue-application-key'] = self.api_username
 
         self.save_config()
         print('Successfully connected to the Hue bridge.')
 
     # region CLIP API v2 request and writing responses to a file
-    def write_response_to_file(self, response: Response):
+    @property
+    def session(self) -> Session:
+        """ The pooled session, created on the first request """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self.create_session()
+        return self._session
+
+    def create_session(self) -> Session:
+        """
+        Create the connection-pooled session every CLIP request goes through.
+        Keeping the connections alive saves a TCP and TLS handshake per request.
+        """
+        import requests
+        import urllib3
+        from requests.adapters import HTTPAdapter
+        from urllib3.exceptions import InsecureRequestWarning
+
+        urllib3.disable_warnings(category=InsecureRequestWarning)
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, pool_block=True)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        session.verify = self.verify_ssl_cert
+        session.headers['Connection'] = 'keep-alive'
+        if self.api_username:
+            session.headers['hue-application-key'] = self.api_username
+
+        return session
+
+    def close(self):
+        if self.command_queue is not None:
+            self.command_queue.close()
+        self.stop_event_stream()
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            if self.trace is not None:
+                self.trace.close()
+                self.trace = None
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """ The thread pool bulk operations run on, sized like the connection pool and created on first use """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='hue-bulk',
+                                                        initializer=_mark_bulk_worker)
+        return self._executor
+
+    def run_bulk(self, fn, items: list) -> list:
+        """
+        Call fn for every item on the client's thread pool
+        :return: The results in the order of items (the first exception is raised once all calls are done)
+        """
+        items = list(items)
+        if len(items) <= 1 or getattr(_bulk_worker, 'active', False):
+            # Waiting for the pool from one of its own threads could deadlock
+            return [fn(item) for item in items]
+
+        futures = [self.executor.submit(fn, item) for item in items]
+        concurrent.futures.wait(futures)
+        return [future.result() for future in futures]
+
+    def trace_request(self, method: str, url: str, status_code: int, duration: float,
+                      request_body: bytes | str | None = None, response_body: bytes | None = None):
+        """ Append the request to data/request_trace.ndjson when debug files are enabled """
         if self.debug_mode != DebugMode.CREATE_DEBUG_FILES:
             return
 
-        json_str = json.dumps({
-            'req': {
-                'method': response.request.method,
-                'url': response.request.url,
-                'headers': str(response.request.headers),
-                'body': response.request.body,
-            },
-            'res': {
-                'status_code': response.status_code,
-                'url': response.url,
-                'headers': str(response.headers),
-                'body': str(response.content),
-                'cookies': str(response.cookies),
-                'elapsed': str(response.elapsed),
-                'history': str(response.history),
-            }
-        }, indent=2)
+        if self.trace is None:
+            with self._lock:
+                if self.trace is None:
+                    self.trace = RequestTrace(f'{self.json_file_dir}/request_trace.ndjson')
+        self.trace.record(method, url, status_code, duration, request_body, response_body)
 
-        with open(f'{self.json_file_dir}/response_log.json', 'w+') as file:
-            file.write(json_str)
+    def observe_request(self, method: str, path: str, bucket: str, waited: float, status_code: int, duration: float,
+                        request_body: bytes | str | None, response_body: bytes | None):
+        self.metrics.observe('rate_limit_wait_seconds', waited, bucket=bucket)
+        self.metrics.observe_request(method, path, status_code, duration,
+                                     len(request_body or b''), len(response_body or b''))
 
-        with open(f'{self.json_file_dir}/raw_response.json', 'w+') as file:
-            try:
-                file.write(json.dumps(response.json()))
-            except TypeError:
-                pass
+    def stats(self) -> Metrics | None:
+        """ The recorded metrics (None if the client was created without metrics) """
+        if self.metrics is not None:
+            self.metrics.set('rate_limit_queue_depth', self.rate_limiter.stats()['queue_depth'])
+        return self.metrics
 
     def clip_request(self, method: str,
                      path: str,
                      data: str | None = None,
                      headers: dict | None = None,
-                     verify_ssl_cert: bool = False,
+                     verify_ssl_cert: bool | None = None,
                      api_key_header: bool = True,
-                     log_response_to_file: bool = True):
+                     log_response_to_file: bool = True,
+                     deadline: float | None = None):
+        """
+        Send a CLIP request through the transport (timeouts, retries and the circuit breaker)
+        :param deadline: Seconds the request may take including retries (None: the transport's deadline)
+        :return: (response, failed). failed is True unless the bridge answered 200 without errors
+        :raise HueConnectionError: If the bridge couldn't be reached (HueTimeoutError, HueCircuitOpenError)
+        """
         if data is None and method != 'GET':
-            print(f'Method \'{method}\' needs a \'data\' argument!')
-            exit(1)
+            raise HueRequestError(f'Method \'{method}\' needs a \'data\' argument!')
+
+        import requests
 
         if headers is None:
             headers = {}
-        if api_key_header:
-            headers['hue-application-key'] = self.api_username
-
-        response = requests.request(method,
-                                    url=f'{self.bridge_clip_url}{path}',
-                                    headers=headers,
-                                    data=data,
-                                    verify=verify_ssl_cert)
-        if log_response_to_file:
-            self.write_response_to_file(response)
-
-        return (
-            response,
-            len(response.json()['errors']) > 0 or response.status_code != 200,
-        )
+        if not api_key_header:
+            # Setting a session header to None drops it for this request only
+            headers['hue-application-key'] = None
+
+        bucket = bucket_for_request(method, path)
+
+        def send(timeout: tuple[float, float]):
+            # Every attempt is a command of its own for the bridge's budget
+            waited = self.rate_limiter.acquire(bucket)
+            start = time.perf_counter()
+            response = self.session.request(method,
+                                            url=f'{self.bridge_clip_url}{path}',
+                                            headers=headers,
+                                            data=data,
+                                            verify=verify_ssl_cert,
+                                            timeout=timeout)
+            duration = time.perf_counter() - start
+            if self.metrics is not None:
+                self.observe_request(method, path, bucket, waited, response.status_code, duration,
+                                     data, response.content)
+            if log_response_to_file:
+                self.trace_request(method, response.url, response.status_code, duration, data, response.content)
+            return response
+
+        transport = self.transport if deadline is None else self.transport.with_deadline(deadline)
+        response = transport.call(method, send, (requests.ConnectionError, requests.Timeout), (requests.Timeout,),
+                                       self.count_retry)
+        return response, request_failed(response)
+
+    def count_retry(self, reason: str):
+        if self.metrics is not None:
+            self.metrics.inc('retries_total', reason=reason)
 
     # endregion
 
@@ -157,15 +322,14 @@ class Hue:
             self.bridge_clip_url = data['bridge_clip_url']
 
     def save_config(self):
-        with open(f'{self.json_file_dir}/api_config.json', 'w+') as f:
-            data = {
-                'api_username': self.api_username,
-                'api_key': self.api_key,
-                'bridge_api_url': self.bridge_api_url,
-                'bridge_clip_url': self.bridge_clip_url,
-            }
-
-            f.write(json.dumps(data))
+        data = {
+            'api_username': self.api_username,
+            'api_key': self.api_key,
+            'bridge_api_url': self.bridge_api_url,
+            'bridge_clip_url': self.bridge_clip_url,
+        }
+        # Replaced atomically, readers in other processes never see a half-written file
+        atomic_write(f'{self.json_file_dir}/api_config.json', json.dumps(data).encode())
 
     def save_light_setup(self, json_str: str):
         raise DeprecationWarning()
@@ -192,192 +356,618 @@ class Hue:
     # endregion
 
     # region Caching
+    # cache key -> CLIP v2 resource type
+    CACHED_RESOURCES = {
+        'device': 'device',
+        'lights': 'light',
+        'rooms': 'room',
+        'scenes': 'scene',
+    }
+
+    def fetch_collection(self, resource: str, etag: str | None = None, deadline: float | None = None):
+        """
+        GET all resources of a type, conditionally if an ETag from an earlier fetch is given
+        :return: (data, etag, not_modified). data is None if the request failed or nothing changed
+        """
+        headers = {'If-None-Match': etag} if etag else None
+        (res, failed) = self.clip_request('GET', f'/resource/{resource}', headers=headers, deadline=deadline)
+        if res.status_code == 304:
+            return None, etag, True
+        if failed:
+            # stderr: this runs in background refreshes, whose output must not end up in a command's (e.g. ls -o jsonl)
+            print(f'Something went wrong trying to get the {resource} resources.', file=sys.stderr)
+            return None, None, False
+
+        return res.json()['data'], res.headers.get('ETag'), False
+
     def refresh_cache(self,
                       refresh_rooms: bool = False,
                       refresh_device: bool = False,
                       refresh_scenes: bool = False,
                       refresh_lights: bool = False,
-                      wipe: bool = False, log=lambda x: x, scheduled_refresh: bool = True):
+                      wipe: bool = False, log=lambda x: x, scheduled_refresh: bool = True,
+                      deadline: float | None = None):
         """
-        Refresh the cache.json file to reflect changes
+        Refresh the cache file to reflect changes. The selected collections are fetched in parallel,
+        conditionally where the bridge sends ETags, and the file is only rewritten if something changed.
         :param refresh_lights: Collect light data
         :param refresh_rooms: Collect data of all the rooms
         :param refresh_device: Collect the device specific data
         :param refresh_scenes: Collect data of all the scenes
         :param wipe: Delete the existing file and completely rewrite it
         :param log: Specify a log function (If empty: No log is shown)
-        :param scheduled_refresh: if True, will check last_updated and only update if necessary
-        """
-        file_path = f'{self.json_file_dir}/cache.json'
-        existing_cache = {
-            'last_updated': -1,
-            'device': {},
-            'lights': [],
-            'rooms': [],
-            'scenes': [],
-        }
+        :param scheduled_refresh: if True, will check last_updated and refresh everything if necessary
+        :param deadline: Seconds each fetch may take including retries (None: the transport's deadline)
+        :return: False if fetching one of the collections failed
+        """
+        storage = self.cache.storage
+        # Only collections that were fetched are written, a collection missing from the file is a cache miss
+        existing_cache = {'last_updated': -1}
 
-        if path.exists(file_path):
+        if storage.signature() is not None:
             if wipe:
                 log('Deleting/Wiping existing cache...')
-                os.remove(file_path)
+                with storage.lock:
+                    storage.remove()
             else:
                 log('Reading existing cache...')
-                with open(file_path, 'r') as file:
-                    existing_cache = json.loads(file.read())
+                existing_cache = storage.read_all() or existing_cache
 
-        # 7200 = 3600 * 2 (two hours)
-        if scheduled_refresh and int(datetime.datetime.utcnow().timestamp()) - 7200 >= existing_cache['last_updated']:
+        if scheduled_refresh and self.cache_is_stale():
             print('The cache hasn\'t been refreshed in a while. Refreshing it now...\n')
 
             refresh_device = True
             refresh_rooms = True
             refresh_scenes = True
             refresh_lights = True
-        else:
-            return
 
-        existing_cache['last_updated'] = int(datetime.datetime.utcnow().timestamp())
+        selected = {
+            'device': refresh_device,
+            'lights': refresh_lights,
+            'rooms': refresh_rooms,
+            'scenes': refresh_scenes,
+        }
+        keys = [key for (key, refresh) in selected.items() if refresh]
+        if len(keys) == 0:
+            return True
+
+        etags = dict(existing_cache.get('etags') or {})
+        log(f'Collecting {", ".join(keys)}...')
+        with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+            results = dict(zip(keys, executor.map(
+                lambda key: self.fetch_collection(self.CACHED_RESOURCES[key], etags.get(key), deadline), keys)))
+
+        # Other processes (or threads) may have written the file while we were fetching. Merge into what is on
+        # disk now, under the file lock, so their collections aren't overwritten with what we read before.
+        with storage.lock:
+            if storage.signature() is not None:
+                existing_cache = storage.read_all() or existing_cache
+            etags = existing_cache.setdefault('etags', {})
+
+            changed = not storage.exists()
+            failed = False
+            fetched = []
+            for (key, (data, etag, not_modified)) in results.items():
+                if data is None and not not_modified:
+                    failed = True
+                    continue
+                fetched.append(key)
+                if not_modified:
+                    continue
+
+                # Only the bridge's own device (the first one) is cached
+                if key == 'device':
+                    data = data[0] if data else {}
+                if etag:
+                    etags[key] = etag
+                if existing_cache.get(key) != data:
+                    existing_cache[key] = data
+                    changed = True
+
+            if changed:
+                existing_cache['last_updated'] = int(time.time())
+                log('Writing results to file...')
+                storage.write_all(existing_cache)
+            # Per collection, so that each one's TTL runs from its own last refresh (see is_fresh)
+            for key in fetched:
+                storage.mark_refreshed(key)
+
+        # The resident cache is only updated after releasing the file lock (the event stream's flush takes the
+        # cache's lock first and the file lock second)
+        if not changed:
+            log('Nothing changed, keeping the existing file')
+            log('Done')
+            return not failed
+
+        self.cache.invalidate()
+        log('Done')
+        return not failed
+
+    def cache_is_stale(self, max_age: int = 7200) -> bool:
+        """ True if the cache is missing or older than max_age seconds (defaults to two hours) """
+        last_refreshed = self.cache.last_refreshed()
+        return last_refreshed is None or time.time() - max_age >= last_refreshed
+
+    # How the cached get_* methods use the cache:
+    # swr: fresh data is returned as is, stale data is returned right away while a background refresh revalidates
+    #      it, and a missing collection is fetched into the cache (once, however many callers are waiting)
+    # cache: whatever is cached, no matter how old (a missing collection is fetched live)
+    # live: always fetched from the bridge, like cached=False
+    CACHE_POLICIES = ('swr', 'cache', 'live')
+
+    @classmethod
+    def check_cache_policy(cls, policy: str):
+        if policy not in cls.CACHE_POLICIES:
+            raise ValueError(f'Unknown cache policy {policy!r}, expected one of {", ".join(cls.CACHE_POLICIES)}')
+
+    def cache_policy(self, key: str, cached: bool = True, policy: str | None = None) -> str:
+        """ The policy of one call: live if not cached, otherwise the given one or the collection's default """
+        if not cached:
+            return 'live'
+        if policy is None:
+            return self.cache_policies.get(key, 'swr')
+        self.check_cache_policy(policy)
+        return policy
+
+    def is_fresh(self, key: str) -> bool:
+        """ True if the cached collection is younger than its TTL, or the connected event stream keeps it live """
+        if self.event_stream is not None and self.event_stream.connected.is_set():
+            return True
+        now = time.monotonic()
+        if now < self._fresh_until.get(key, 0.0):
+            return True
+
+        # Another process (or the CLI's refresh command) may have refreshed the collection since
+        last_refreshed = self.cache.last_refreshed(key)
+        if last_refreshed is None:
+            return False
+        age = time.time() - last_refreshed
+        self._fresh_until[key] = now + self.cache_ttls.get(key, 7200) - age
+        return now < self._fresh_until[key]
+
+    def revalidate(self, keys: list[str], wait: bool = False) -> list[concurrent.futures.Future]:
+        """
+        Refresh cached collections, joining the refresh of any collection that is already being fetched
+        :param keys: Cache keys (see CACHED_RESOURCES)
+        :param wait: Run the refresh in this thread instead of in the background
+        :return: One future per key, resolving to False if fetching failed
+        """
+        futures = []
+        mine = []
+        with self._lock:
+            for key in keys:
+                if key not in self._inflight:
+                    self._inflight[key] = concurrent.futures.Future()
+                    mine.append(key)
+                futures.append(self._inflight[key])
+        if len(mine) == 0:
+            return futures
+
+        if wait:
+            self._revalidate(mine, background=False)
+        else:
+            threading.Thread(target=self._revalidate, args=(mine,), name='cache-revalidate').start()
+        return futures
+
+    def wait_for_revalidation(self, timeout: float | None = None):
+        """ Wait for the refreshes running in the background """
+        with self._lock:
+            futures = list(self._inflight.values())
+        concurrent.futures.wait(futures, timeout)
+
+    def _revalidate(self, keys: list[str], background: bool = True):
+        futures = [self._inflight[key] for key in keys]
+        try:
+            deadline = self.revalidate_deadline if background else None
+            ok = self.refresh_cache(scheduled_refresh=False, deadline=deadline,
+                                    **{f'refresh_{key}': True for key in keys})
+            if ok:
+                fresh_until = time.monotonic()
+                for key in keys:
+                    self._fresh_until[key] = fresh_until + self.cache_ttls.get(key, 7200)
+            for future in futures:
+                future.set_result(ok)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            if not background:
+                raise
+            print(f'Refreshing the cache failed: {e}', file=sys.stderr)
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._inflight.pop(key, None)
+
+    def count_cache_lookup(self, key: str, result: str):
+        with self._counter_lock:
+            counters = self.cache_counters.setdefault(key, {'hit': 0, 'stale': 0, 'miss': 0})
+            counters[result] += 1
+        if self.metrics is not None:
+            self.metrics.inc('cache_lookups_total', collection=key, result=result)
+
+    def get_from_cache(self, key: str, policy: str | None = None):
+        """ A cached collection (see cache_lookup), None if it isn't cached """
+        return self.cache_lookup(key, self.cache.get(key), policy)
+
+    def cache_lookup(self, key: str, resource, policy: str | None = None):
+        """
+        Count a cache hit, stale hit or miss and pass the resource through. Under the swr policy a stale
+        resource starts revalidating its collection in the background.
+        :param resource: What was looked up in the cached collection key (None: not cached)
+        """
+        if resource is None:
+            self.count_cache_lookup(key, 'miss')
+            return None
 
-        if refresh_device:
-            log('Collecting device infos...')
-            device_info = self.get_device_info(cached=False)
-            existing_cache['device'] = device_info[0]
-            sleep(0.2)
+        if self.cache_policy(key, policy=policy) != 'swr' or self.is_fresh(key):
+            self.count_cache_lookup(key, 'hit')
+            return resource
 
-        if refresh_lights:
-            log('Collecting light infos')
-            lights = self.get_lights(cached=False)
-            existing_cache['lights'] = lights
-            sleep(0.2)
+        self.count_cache_lookup(key, 'stale')
+        self.revalidate([key])
+        return resource
 
-        if refresh_rooms:
-            log('Collecting room infos')
-            existing_cache['rooms'] = self.get_rooms(cached=False)
-            sleep(0.2)
+    def fetch_into_cache(self, key: str):
+        """ Fetch a collection that isn't cached yet into the cache and return it (None if that failed) """
+        for future in self.revalidate([key], wait=True):
+            future.result()
+        return self.cache.get(key)
 
-        if refresh_scenes:
-            log('Collecting scene infos')
-            existing_cache['scenes'] = self.get_scenes(cached=False)
-            sleep(0.2)
+    def start_event_stream(self, flush_interval: float = 1.0) -> EventStream:
+        """
+        Keep the cache up to date by applying the bridge's eventstream in the background
+        :param flush_interval: Seconds changes are collected before the cache file is rewritten
+        """
+        with self._lock:
+            if self.event_stream is None:
+                from event_stream import EventStream
 
-        log('Writing results to file...')
-        with open(file_path, 'w+') as file:
-            file.write(json.dumps(existing_cache))
+                url = self.bridge_clip_url.replace('/clip/v2', '/eventstream/clip/v2')
+                self.event_stream = EventStream(url, self.create_session(), self.cache, flush_interval=flush_interval,
+                                                on_connect=self.resync_cache)
 
-        log('Done')
+            self.event_stream.start()
+            return self.event_stream
 
-    def get_from_cache(self, key: str):
-        file_path = f'{self.json_file_dir}/cache.json'
+    def resync_cache(self):
+        """
+        Revalidate the cached collections in the background. The event stream does this after every (re)connect:
+        events sent while it was disconnected are lost, and a connected stream makes the cache count as fresh.
+        """
+        keys = [key for key in self.CACHED_RESOURCES if self.cache.get(key) is not None]
+        if len(keys) > 0:
+            self.revalidate(keys)
 
-        if path.exists(file_path):
-            with open(file_path, 'r') as file:
-                return json.loads(file.read())[key]
-        return None
+    def stop_event_stream(self):
+        with self._lock:
+            if self.event_stream is not None:
+                self.event_stream.stop()
+                self.event_stream = None
 
     # endregion
 
     # region GET: Light, rooms, scenes and Device info
-    def get_device_info(self, cached: bool = True):
-        if cached:
-            cached_res = self.get_from_cache('device')
+    def _get_resource(self, cache_key: str, cached: bool, policy: str | None, error_message: str):
+        """
+        A cached collection according to the call's (or the collection's) cache policy, see CACHE_POLICIES
+        :param cached: False fetches it live, like the live policy
+        """
+        policy = self.cache_policy(cache_key, cached, policy)
+        if policy != 'live':
+            cached_res = self.get_from_cache(cache_key, policy)
+            if cached_res is None and policy == 'swr':
+                cached_res = self.fetch_into_cache(cache_key)
             if cached_res is not None:
                 return cached_res
 
-        (res, failed) = self.clip_request('GET', '/resource/device')
+        (res, failed) = self.clip_request('GET', f'/resource/{self.CACHED_RESOURCES[cache_key]}')
         if failed:
-            print('unable to get device info!')
+            print(error_message)
             return
 
         return res.json()['data']
 
-    def get_lights(self, cached: bool = True):
-        if cached:
-            cached_res = self.get_from_cache('lights')
-            if cached_res is not None:
-                return cached_res
+    def get_device_info(self, cached: bool = True, policy: str | None = None):
+        return self._get_resource('device', cached, policy, 'unable to get device info!')
 
-        (res, failed) = self.clip_request('GET', '/resource/light')
-        if failed:
-            print('Something went wrong trying to get the lights.')
-            return
+    def get_lights(self, cached: bool = True, policy: str | None = None):
+        return self._get_resource('lights', cached, policy, 'Something went wrong trying to get the lights.')
 
-        return res.json()['data']
+    def get_light_by_name(self, name: str, cached: bool = True, policy: str | None = None):
+        policy = self.cache_policy('lights', cached, policy)
+        if policy != 'live':
+            light = self.cache_lookup('lights', self.cache.by_name('lights', name), policy)
+            # The name index of a cached collection is complete, only scan a collection that isn't cached (yet)
+            if light is not None or self.cache.get('lights') is not None:
+                return light
 
-    def get_light_by_name(self, name: str, cached: bool = True):
-        lights_res = self.get_lights(cached=cached)
+        lights_res = self.get_lights(cached=cached, policy=policy)
         for l in lights_res:
             if l['metadata']['name'].lower() == name.lower():
                 return l
         return None
 
-    def get_scenes(self, cached: bool = True):
-        if cached:
-            cached_res = self.get_from_cache('scenes')
-            if cached_res is not None:
-                return cached_res
+    def get_scenes(self, cached: bool = True, policy: str | None = None):
+        return self._get_resource('scenes', cached, policy, 'Something went wrong trying to get the scenes.')
 
-        (res, failed) = self.clip_request('GET', '/resource/scene')
-        if failed:
-            print('Something went wrong trying to get the scenes.')
-            return
+    def get_scene_by_name(self, name: str, room_id: str | None = None, cached: bool = True,
+                          policy: str | None = None):
+        """
+        :param room_id: Only consider scenes of this room (scene names are only unique per room)
+        """
+        policy = self.cache_policy('scenes', cached, policy)
+        if policy != 'live' and room_id is None:
+            scene = self.cache_lookup('scenes', self.cache.by_name('scenes', name), policy)
+            if scene is not None or self.cache.get('scenes') is not None:
+                return scene
+
+        for scene in self.get_scenes(cached=cached, policy=policy) or []:
+            if room_id is not None and scene.get('group', {}).get('rid') != room_id:
+                continue
+            if scene['metadata']['name'].lower() == name.lower():
+                return scene
+        return None
 
-        return res.json()['data']
+    def get_rooms(self, cached: bool = True, policy: str | None = None):
+        return self._get_resource('rooms', cached, policy, 'Something went wrong trying to get the rooms.')
 
-    def get_rooms(self, cached: bool = True):
-        if cached:
-            cached_res = self.get_from_cache('rooms')
-            if cached_res is not None:
-                return cached_res
+    def get_room(self, room_id: str, cached: bool = True, policy: str | None = None):
+        if self.cache_policy('rooms', cached, policy) != 'live':
+            room = self.cache_lookup('rooms', self.cache.by_id('rooms', room_id), policy)
+            if room is not None:
+                return room
 
-        (res, failed) = self.clip_request('GET', '/resource/room')
+        (res, failed) = self.clip_request('GET', f'/resource/room/{room_id}')
         if failed:
-            print('Something went wrong trying to get the rooms.')
-            return
+            return None
 
-        return res.json()['data']
+        return res.json()['data'][0]
+
+    def room_light_ids(self, room: dict) -> list[str]:
+        """ Ids of the lights in a room: its own light services and the lights of its child devices """
+        light_ids = self.cache.room_index().room_light_ids(room['id'])
+        if light_ids is not None:
+            return light_ids
+
+        # Not a cached room, resolve its devices' lights by scanning the lights
+        light_ids = [service['rid'] for service in room.get('services', []) if service['rtype'] == 'light']
+        device_ids = {child['rid'] for child in room.get('children', []) if child['rtype'] == 'device'}
+        if len(device_ids) > 0:
+            light_ids += [light['id'] for light in self.get_lights() or []
+                          if light.get('owner', {}).get('rid') in device_ids and light['id'] not in light_ids]
+        return light_ids
+
+    def room_grouped_light_id(self, room: dict) -> str | None:
+        """ Id of the grouped_light that controls all the lights of a room """
+        grouped_light_id = self.cache.room_index().grouped_light_id(room['id'])
+        if grouped_light_id is not None:
+            return grouped_light_id
+        return next((s['rid'] for s in room.get('services', []) if s['rtype'] == 'grouped_light'), None)
+
+    def room_commands(self, room: dict, rgb: tuple[int, int, int] | dict[str, tuple[int, int, int]]) -> list[tuple]:
+        """
+        Split setting the lights of a room into one command per colour
+        :param rgb: One colour for all lights, or a dict of light id -> colour
+        :return: (grouped_light id, light ids, colour) per command. The grouped_light id is only set if the command
+                 covers exactly the lights of the room (its light ids may then be None), otherwise the lights have
+                 to be set one by one.
+        """
+        grouped_light_id = self.room_grouped_light_id(room)
+        if not isinstance(rgb, dict):
+            if grouped_light_id is not None:
+                # No need to resolve the room's lights, which may take the lights from the bridge
+                return [(grouped_light_id, None, tuple(rgb))]
+            return [(None, self.room_light_ids(room), tuple(rgb))]
+
+        by_colour = {}
+        for (light_id, colour) in rgb.items():
+            by_colour.setdefault(tuple(colour), []).append(light_id)
+        if len(by_colour) == 1 and grouped_light_id is not None:
+            ((colour, light_ids),) = by_colour.items()
+            if set(light_ids) == set(self.room_light_ids(room)):
+                return [(grouped_light_id, light_ids, colour)]
+        return [(None, light_ids, colour) for (colour, light_ids) in by_colour.items()]
+
+    def get_room_by_name(self, name: str, cached: bool = True, policy: str | None = None):
+        policy = self.cache_policy('rooms', cached, policy)
+        if policy != 'live':
+            room = self.cache_lookup('rooms', self.cache.by_name('rooms', name), policy)
+            if room is not None or self.cache.get('rooms') is not None:
+                return room
+
+        for room in self.get_rooms(cached=cached, policy=policy) or []:
+            if room['metadata']['name'].lower() == name.lower():
+                return room
+        return None
 
     # endregion
 
     # region SET: Light, Room light states and rename lights/rooms
-    def set_light_state(self, light_id: str, rgb: tuple[int, int, int], on_state: bool = True,
-                        brightness: int | None = None):
-        (r, g, b) = rgb
-        xyy_color = convert_color(sRGBColor(rgb_r=r, rgb_g=g, rgb_b=b), xyYColor)
+    @staticmethod
+    def build_light_state(rgb: tuple[int, int, int], on_state: bool = True, brightness: int | None = None,
+                          gamut=None):
+        """ :param gamut: The light's gamut triangle (see colors.gamut_of), colours outside it are clamped to it """
+        (x, y) = clamp_to_gamut(rgb_to_xy(tuple(rgb)), gamut)
         req_data = {
             'on': {
                 'on': on_state,
             },
             'color': {
                 'xy': {
-                    'x': xyy_color.xyy_x,
-                    'y': xyy_color.xyy_y,
+                    'x': x,
+                    'y': y,
                 },
             },
             'dimming': {},
         }
 
-        print(req_data)
-
         if brightness is not None:
             req_data['dimming']['brightness'] = brightness
 
-        (res, failed) = self.clip_request('PUT', f'/resource/light/{light_id}', json.dumps(req_data))
-        if failed:
-            print(f'CLIP Req to set_light_state failed with status {res.status_code}. Is the given rid correct?')
-            return
+        return req_data
+
+    def light_state(self, rgb: tuple[int, int, int], on_state: bool = True, brightness: int | None = None,
+                    gamut=None):
+        """ build_light_state, timed for the metrics """
+        if self.metrics is None:
+            return self.build_light_state(rgb, on_state, brightness, gamut)
+
+        start = time.perf_counter()
+        state = self.build_light_state(rgb, on_state, brightness, gamut)
+        self.metrics.observe('color_conversion_seconds', time.perf_counter() - start, CONVERSION_BUCKETS)
+        return state
+
+    def light_gamut(self, light_id: str):
+        """ The cached gamut triangle of a light, None if the light (or its gamut) isn't cached """
+        return gamut_of(self.cache.by_id('lights', light_id))
+
+    def light_state_payloads(self, light_ids: list[str], rgb: tuple[int, int, int], on_state: bool = True,
+                             brightness: int | None = None) -> dict[str, str]:
+        """ Serialised states of many lights set to the same colour, built once per distinct gamut """
+        by_gamut = {}
+        payloads = {}
+        for light_id in light_ids:
+            gamut = self.light_gamut(light_id)
+            if gamut not in by_gamut:
+                by_gamut[gamut] = json.dumps(self.light_state(rgb, on_state, brightness, gamut))
+            payloads[light_id] = by_gamut[gamut]
+        return payloads
+
+    def put_light_state(self, light_id: str, data: str, resource: str = 'light') -> LightStateResult:
+        """
+        PUT an already serialised light state
+        :param resource: 'light' or 'grouped_light'
+        """
+        (res, failed) = self.clip_request('PUT', f'/resource/{resource}/{light_id}', data)
+        try:
+            errors = res.json()['errors']
+        except (ValueError, KeyError):
+            errors = []
+        return LightStateResult(light_id, not failed, res.status_code, errors)
+
+    def enable_command_queue(self, window: float = 0.05, **kwargs) -> CommandQueue:
+        """
+        Route set_light_state and set_room_light_states through a write-behind CommandQueue, which merges updates
+        that arrive within the window (e.g. from concurrent daemon clients). The calls still wait for and return their
+        results, queue_light_state doesn't.
+        """
+        from command_queue import CommandQueue
 
-    def set_room_light_states(self, room_id: str, rgb: tuple[int, int, int], brightness: int | None = None):
-        (res, failed) = self.clip_request('GET', f'/resource/room/{room_id}')
-        if failed:
-            print(f'Something went wrong trying to get information for room {room_id}'
+        with self._lock:
+            if self.command_queue is None:
+                self.command_queue = CommandQueue(self, window, **kwargs)
+            return self.command_queue
+
+    def set_light_state(self, light_id: str, rgb: tuple[int, int, int], on_state: bool = True,
+                        brightness: int | None = None) -> LightStateResult:
+        if self.command_queue is not None:
+            result = self.command_queue.set_light_state(light_id, rgb, on_state, brightness).result()
+        else:
+            state = self.light_state(rgb, on_state, brightness, self.light_gamut(light_id))
+            result = self.put_light_state(light_id, json.dumps(state))
+        if not result.ok:
+            print(f'CLIP Req to set_light_state failed with status {result.status_code}. Is the given rid correct?')
+        return result
+
+    def queue_light_state(self, light_id: str, rgb: tuple[int, int, int], on_state: bool = True,
+                          brightness: int | None = None) -> concurrent.futures.Future:
+        """
+        set_light_state without waiting for the bridge: through the command queue if it is enabled (merged with the
+        pending updates and written behind), otherwise on the client's thread pool
+        :return: Future of the LightStateResult
+        """
+        if self.command_queue is not None:
+            return self.command_queue.set_light_state(light_id, rgb, on_state, brightness)
+        return self.executor.submit(self.set_light_state, light_id, rgb, on_state, brightness)
+
+    def set_lights_state(self, light_ids: list[str], rgb: tuple[int, int, int], on_state: bool = True,
+                         brightness: int | None = None) -> list[LightStateResult]:
+        """
+        Set many lights to the same state. The colour is converted and the payload serialised once per gamut,
+        the PUTs share the connection pool (and the rate limiter's budget).
+        :return: One result per light, in the order of light_ids
+        """
+        if len(light_ids) == 0:
+            return []
+
+        payloads = self.light_state_payloads(light_ids, rgb, on_state, brightness)
+        return self.run_bulk(lambda light_id: self.put_light_state(light_id, payloads[light_id]), light_ids)
+
+    def set_grouped_light_state(self, grouped_light_id: str, rgb: tuple[int, int, int], on_state: bool = True,
+                                brightness: int | None = None) -> LightStateResult:
+        """ Set all the lights of a room/zone with a single command """
+        req_data = self.light_state(rgb, on_state, brightness)
+        return self.put_light_state(grouped_light_id, json.dumps(req_data), resource='grouped_light')
+
+    def set_room_light_states(self, room_id: str, rgb: tuple[int, int, int] | dict[str, tuple[int, int, int]],
+                              brightness: int | None = None) -> list[LightStateResult] | None:
+        """
+        Set the lights of a room. One colour for the whole room is a single grouped_light command,
+        different colours per light fall back to one command per light.
+        :param rgb: One colour for all lights, or a dict of light id -> colour
+        """
+        if self.command_queue is not None:
+            futures = self.command_queue.set_room_light_states(room_id, rgb, brightness)
+            return None if futures is None else [future.result() for future in futures]
+
+        room = self.get_room(room_id)
+        if room is None:
+            print(f'Something went wrong trying to get information for room {room_id} '
                   f'while executing set_room_light_states!')
             return
 
-        for service in res.json()['data'][0]['services']:
-            if service['rtype'] == 'light':
-                self.set_light_state(service['rid'], rgb, True, brightness)
-                sleep(0.2)
+        results = []
+        for (grouped_light_id, light_ids, colour) in self.room_commands(room, rgb):
+            if grouped_light_id is not None:
+                results.append(self.set_grouped_light_state(grouped_light_id, colour, True, brightness))
+            else:
+                results += self.set_lights_state(light_ids, colour, True, brightness)
+        return results
+
+    def recall_scene(self, scene_id: str, action: str = 'active', brightness: int | None = None) -> bool:
+        """
+        Recall a scene, which sets all of its lights with a single command
+        :param action: 'active', 'dynamic_palette' or 'static'
+        """
+        req_data = {'recall': {'action': action}}
+        if brightness is not None:
+            req_data['recall']['dimming'] = {'brightness': brightness}
+
+        (res, failed) = self.clip_request('PUT', f'/resource/scene/{scene_id}', json.dumps(req_data))
+        if failed:
+            print(f'CLIP Req to recall_scene failed with status {res.status_code}. Is the given rid correct?')
+        return not failed
+
+    def snapshot(self, light_ids: list[str] | None = None, room_id: str | None = None, cached: bool = False):
+        """
+        Capture the on/brightness/colour state of lights with a single request, to restore it with apply_snapshot
+        :param light_ids: Lights to include (None: all lights, or all lights of room_id)
+        :param room_id: Take the lights of this room
+        :return: A snapshot.Snapshot, None if the lights couldn't be fetched
+        """
+        import snapshot
+
+        if light_ids is None and room_id is not None:
+            room = self.get_room(room_id)
+            if room is None:
+                print(f'Unable to find room {room_id} to take a snapshot of!')
+                return None
+            light_ids = self.room_light_ids(room)
+        return snapshot.capture(self, light_ids, cached=cached)
+
+    def apply_snapshot(self, state, cached: bool | None = None) -> list[LightStateResult]:
+        """
+        Restore a snapshot, sending only the lights and fields that differ (nothing if none do)
+        :param state: A snapshot.Snapshot (see snapshot())
+        :param cached: Compare against the cache instead of the live states (None: while the event stream runs)
+        """
+        import snapshot
+
+        results = snapshot.apply(self, state, cached=cached)
+        failed = [result for result in results if not result.ok]
+        if len(failed) > 0:
+            print(f'Restoring the snapshot failed for {len(failed)} of {len(results)} commands.')
+        return results
 
     def rename_light_or_room(self, id: str, new_name: str, room: bool = False):
         print('This doesn\'t seem to work with the Hue API.')
@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limiter still works, just not across processes
+    fcntl = None
+
+# bucket name -> (tokens per second, burst size)
+# The bridge handles about 10 light commands and 1 group command per second
+DEFAULT_BUDGETS = {
+    'light': (10.0, 10.0),
+    'group': (1.0, 2.0),
+}
+GROUP_RESOURCES = ('grouped_light', 'room', 'zone', 'scene', 'bridge_home')
+SHARED_STATE_SIZE = 512
+
+
+def bucket_for_request(method: str, path: str) -> str:
+    """ Pick the budget a CLIP request counts against. Reads and single light commands share the light budget. """
+    if method != 'GET':
+        resource = path.split('/')[2] if path.startswith('/resource/') else ''
+        if resource in GROUP_RESOURCES:
+            return 'group'
+    return 'light'
+
+
+class RateLimiter:
+    """
+    Token bucket scheduler for CLIP requests. Every request reserves a token from its bucket
+    and sleeps until that token is due, so callers are spaced out exactly as much as the budget
+    requires. With a lock_file the bucket state is shared between processes.
+    """
+
+    def __init__(self, budgets: dict[str, tuple[float, float]] | None = None, lock_file: str | None = None):
+        """
+        :param budgets: Maps a bucket name to (tokens per second, burst size)
+        :param lock_file: File to share the bucket state through (None: only shared within this process)
+        """
+        self.budgets = dict(DEFAULT_BUDGETS if budgets is None else budgets)
+        self.lock_file = lock_file if fcntl is not None else None
+        self._lock = threading.Lock()
+        self._state = {name: [burst, time.time()] for (name, (_, burst)) in self.budgets.items()}
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.counters = {name: {'requests': 0, 'waited': 0, 'wait_time': 0.0} for name in self.budgets}
+
+    def _take_token(self, state: dict, bucket: str, now: float) -> float:
+        (rate, burst) = self.budgets[bucket]
+        (tokens, updated) = state.get(bucket, [burst, now])
+        tokens = min(burst, tokens + (now - updated) * rate) - 1
+        state[bucket] = [tokens, now]
+
+        # A negative balance is a reservation for a token that is only refilled in the future
+        return max(0.0, -tokens / rate)
+
+    def _take_shared_token(self, bucket: str, now: float) -> float:
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                state = json.loads(os.pread(fd, SHARED_STATE_SIZE, 0) or b'{}')
+            except ValueError:
+                state = {}
+
+            wait = self._take_token(state, bucket, now)
+            # Overwrite in place with a fixed-size record instead of truncating the file on every request
+            os.pwrite(fd, json.dumps(state).ljust(SHARED_STATE_SIZE).encode(), 0)
+        finally:
+            os.close(fd)  # Also releases the flock
+        return wait
+
+    def reserve(self, bucket: str) -> float:
+        """
+        Take a token from the bucket without waiting for it
+        :return: Seconds the caller has to wait before sending its request
+        """
+        if bucket not in self.budgets:
+            bucket = 'light'
+
+        with self._lock:
+            now = time.time()
+            if self.lock_file is not None:
+                wait = self._take_shared_token(bucket, now)
+            else:
+                wait = self._take_token(self._state, bucket, now)
+
+            counters = self.counters[bucket]
+            counters['requests'] += 1
+            if wait > 0:
+                counters['waited'] += 1
+                counters['wait_time'] += wait
+        return wait
+
+    def try_acquire(self, bucket: str) -> bool:
+        """ Take a token only if one is available right now, without reserving a future one """
+        if bucket not in self.budgets:
+            bucket = 'light'
+
+        with self._lock:
+            (rate, burst) = self.budgets[bucket]
+            now = time.time()
+            (tokens, updated) = self._state.get(bucket, [burst, now])
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            available = tokens >= 1
+            self._state[bucket] = [tokens - 1 if available else tokens, now]
+            self.counters[bucket]['requests'] += 1
+            return available
+
+    def _enter_queue(self):
+        with self._lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+    def _leave_queue(self):
+        with self._lock:
+            self.queue_depth -= 1
+
+    def acquire(self, bucket: str) -> float:
+        """ Block until a request against the bucket may be sent. Returns the time waited. """
+        wait = self.reserve(bucket)
+        if wait > 0:
+            self._enter_queue()
+            try:
+                time.sleep(wait)
+            finally:
+                self._leave_queue()
+        return wait
+
+    async def acquire_async(self, bucket: str) -> float:
+        """ Same as acquire, but yields to the event loop while waiting """
+        import asyncio
+
+        wait = self.reserve(bucket)
+        if wait > 0:
+            self._enter_queue()
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._leave_queue()
+        return wait
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'buckets': {name: dict(counters) for (name, counters) in self.counters.items()},
+            }
@@ -0,0 +1,121 @@
+import atexit
+import datetime
+import json
+import os
+import queue
+import threading
+
+
+class RequestTrace:
+    """
+    Append-only request log. Records are newline-delimited JSON, written in batches by a background thread,
+    so tracing a request costs little more than putting a dict on a queue. The file is rotated by size.
+    """
+
+    def __init__(self, file_path: str,
+                 max_bytes: int = 5 * 1024 * 1024,
+                 backup_count: int = 3,
+                 body_capture_limit: int | None = 1024):
+        """
+        :param file_path: The .ndjson file to append to
+        :param max_bytes: Rotate the file once it would grow beyond this size (0: never rotate)
+        :param backup_count: How many rotated files (file.1, file.2, ...) to keep
+        :param body_capture_limit: Bytes of the request/response bodies to keep (0: none, None: everything)
+        """
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.body_capture_limit = body_capture_limit
+        self.dropped = 0
+
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='hue-request-trace', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _capture(self, body) -> str | None:
+        if body is None or self.body_capture_limit == 0:
+            return None
+        if isinstance(body, str):
+            body = body.encode()
+        if self.body_capture_limit is not None:
+            body = body[:self.body_capture_limit]
+        return body.decode(errors='replace')
+
+    def record(self, method: str, url: str, status_code: int, duration: float,
+               request_body: bytes | str | None = None, response_body: bytes | None = None):
+        """ Queue one request for writing. Never blocks on disk I/O. """
+        if self._closed:
+            self.dropped += 1
+            return
+
+        if isinstance(request_body, str):
+            request_body = request_body.encode()
+
+        self._queue.put({
+            'ts': datetime.datetime.utcnow().isoformat(timespec='microseconds') + 'Z',
+            'method': method,
+            'url': url,
+            'status': status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'request_bytes': len(request_body or b''),
+            'response_bytes': len(response_body or b''),
+            'request_body': self._capture(request_body),
+            'response_body': self._capture(response_body),
+        })
+
+    def close(self, timeout: float | None = 5.0):
+        """ Write everything that is still queued and stop the writer thread """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.file_path}.{i}'):
+                os.replace(f'{self.file_path}.{i}', f'{self.file_path}.{i + 1}')
+        if self.backup_count > 0:
+            os.replace(self.file_path, f'{self.file_path}.1')
+        else:
+            os.remove(self.file_path)
+
+    def _write(self, lines: list[str]):
+        size = os.path.getsize(self.file_path) if os.path.exists(self.file_path) else 0
+        file = open(self.file_path, 'ab')
+        try:
+            for line in lines:
+                data = line.encode()
+                if self.max_bytes and size > 0 and size + len(data) > self.max_bytes:
+                    file.close()
+                    self._rotate()
+                    file = open(self.file_path, 'ab')
+                    size = 0
+
+                file.write(data)
+                size += len(data)
+        finally:
+            file.close()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            records = [self._queue.get()]
+            # Drain whatever queued up meanwhile and write it in one go
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in records:
+                stop = True
+                records = [record for record in records if record is not None]
+
+            if records:
+                try:
+                    self._write([json.dumps(record) + '\n' for record in records])
+                except OSError:
+                    self.dropped += len(records)
@@ -0,0 +1,286 @@
+
+from locks import RWLock
+from room_index import RoomIndex
+
+_NOT_LOADED = object()
+
+# CLIP v2 resource type -> key in cache.json
+CACHE_KEYS = {
+    'device': 'device',
+    'light': 'lights',
+    'room': 'rooms',
+    'scene': 'scenes',
+}
+
+
+def merge_resource(target: dict, changes: dict):
+    """ Recursively apply the (partial) resource of an update event to the cached resource """
+    for (key, value) in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_resource(target[key], value)
+        else:
+            target[key] = value
+
+
+def merged_resource(target: dict, changes: dict) -> dict:
+    """ Like merge_resource, but into a copy: target and its nested dicts are left as they are """
+    merged = dict(target)
+    for (key, value) in changes.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merged_resource(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class ResourceCache:
+    """
+    Resident view of the cache file. Each collection is read from disk the first time it is used and
+    indexed by id and by case-folded name. Rooms and lights also feed the room membership index.
+    Everything is dropped and read again lazily after the file's mtime (or size) changed.
+    Lookups share a readers-writer lock, loading, reloading and applying events take it exclusively.
+    Events never change a resource or collection that was handed out: changed resources and lists are replaced
+    by updated copies (copy-on-write), so callers can iterate what they got without holding the lock.
+    """
+    INDEXED_KEYS = ('device', 'lights', 'rooms', 'scenes')
+
+    def __init__(self, storage):
+        """
+        :param storage: A cache_storage backend (JsonCacheStorage or SectionedCacheStorage)
+        """
+        self.storage = storage
+        self._lock = RWLock()
+        self._signature = _NOT_LOADED
+        self._data = {}
+        self._by_id = {}
+        self._by_name = {}
+        self._room_index = RoomIndex()
+        # (event type, key, resource) of the events applied since the last flush. They are replayed onto the
+        # collections whenever these are read again, and onto the file's current content when flushing.
+        self._pending = []
+
+    @property
+    def file_path(self) -> str:
+        return self.storage.file_path
+
+    def _resources(self, key: str) -> list:
+        resources = self._data.get(key) or []
+        # The device info is stored as a single resource
+        if isinstance(resources, dict):
+            resources = [resources]
+        return resources
+
+    def _index(self, key: str):
+        resources = self._resources(key)
+
+        by_name = {}
+        for resource in resources:
+            name = resource.get('metadata', {}).get('name')
+            if name is not None:
+                by_name.setdefault(name.casefold(), resource)
+
+        self._by_id[key] = {resource['id']: resource for resource in resources if 'id' in resource}
+        self._by_name[key] = by_name
+        if key == 'rooms':
+            self._room_index.update_rooms(resources)
+        elif key == 'lights':
+            self._room_index.update_lights(resources)
+
+    @property
+    def _dirty(self) -> bool:
+        return len(self._pending) > 0
+
+    def _check(self):
+        signature = self.storage.signature()
+        if signature == self._signature:
+            return
+
+        with self._lock.write():
+            if signature == self._signature:
+                return
+
+            self._data = {}
+            self._by_id = {}
+            self._by_name = {}
+            self._room_index = RoomIndex()
+            self._signature = signature
+
+    def _section(self, key: str):
+        self._check()
+        with self._lock.read():
+            if key in self._data or self._signature is None:
+                return self._data.get(key)
+
+        with self._lock.write():
+            if key not in self._data and self._signature is not None:
+                self._data[key] = self.storage.read_section(key)
+                if key in self.INDEXED_KEYS:
+                    self._index(key)
+                    # Unflushed events are newer than what another process (or a refresh) wrote
+                    self._replay(key)
+            return self._data.get(key)
+
+    def _replay(self, key: str):
+        """ Apply the unflushed events of a freshly read collection to it """
+        if self._data.get(key) is None:
+            return
+        copies = {}
+        replayed = False
+        for (event_type, event_key, resource) in self._pending:
+            if event_key == key:
+                replayed = self._apply_event(event_type, key, resource, copies) or replayed
+        if replayed:
+            self._index(key)
+
+    def _lookup(self, key: str, by: str, value: str):
+        self._check()
+        # Load the section if it isn't yet. The file may change again between loading and looking up.
+        for _ in range(3):
+            with self._lock.read():
+                index = (self._by_id if by == 'id' else self._by_name).get(key)
+                if index is not None or self._signature is None:
+                    return None if index is None else index.get(value)
+            self._section(key)
+        return None
+
+    def invalidate(self):
+        """ Force the file to be read again on the next access (unflushed events are replayed onto it) """
+        with self._lock.write():
+            self._signature = _NOT_LOADED
+
+    def last_refreshed(self, key: str | None = None) -> float | None:
+        """
+        Unix time of the last refresh of a collection, from its stamp (rewriting the file for other reasons, like
+        flushing events or migrating it, isn't a refresh). Caches written before the collections had their own
+        stamps fall back to the file's last_updated entry.
+        :param key: The collection, None for the least recently refreshed of the cached ones
+        :return: None if there is no cache
+        """
+        last_updated = self._section('last_updated')
+        if self._signature is None and not self._dirty:
+            return None
+
+        keys = [key] if key is not None else [key for key in CACHE_KEYS.values() if self._section(key) is not None]
+        refreshed = [self.storage.refreshed_at(key) for key in keys] or [None]
+        return min(stamp if stamp is not None else last_updated if last_updated is not None else -1
+                   for stamp in refreshed)
+
+    def get(self, key: str):
+        """ The raw cached collection, or None if there is no cache """
+        return self._section(key)
+
+    def by_id(self, key: str, rid: str):
+        return self._lookup(key, 'id', rid)
+
+    def by_name(self, key: str, name: str):
+        return self._lookup(key, 'name', name.casefold())
+
+    def room_index(self) -> RoomIndex:
+        """ The membership index of the cached rooms and lights (loads both collections if necessary) """
+        self._section('rooms')
+        self._section('lights')
+        return self._room_index
+
+    # region Incremental updates from the event stream
+    def apply_events(self, events: list[dict]) -> bool:
+        """
+        Apply CLIP v2 eventstream events (add/update/delete) to the cached resources.
+        Changes are kept in memory until flush() is called.
+        :return: True if any cached resource changed
+        """
+        self._check()
+
+        with self._lock.write():
+            touched = set()
+            # key -> the collection's list, copied for this batch, and the positions of its resources in it
+            copies = {}
+            for event in events:
+                for resource in event.get('data', []):
+                    key = CACHE_KEYS.get(resource.get('type'))
+                    if key is None or 'id' not in resource:
+                        continue
+
+                    # Collections that aren't cached are fetched whole when they are first used
+                    if self._section(key) is None:
+                        continue
+                    if self._apply_event(event.get('type'), key, resource, copies):
+                        touched.add(key)
+                        self._pending.append((event.get('type'), key, resource))
+
+            for key in touched:
+                self._index(key)
+
+            return len(touched) > 0
+
+    def _writable(self, key: str, copies: dict) -> tuple[list, dict]:
+        """ A copy of the collection's list (made once per batch) and the positions of its resources by id """
+        if key not in copies:
+            resources = list(self._data[key])
+            self._data[key] = resources
+            copies[key] = (resources, {r.get('id'): i for (i, r) in enumerate(resources)})
+        return copies[key]
+
+    def _apply_event(self, event_type: str, key: str, resource: dict, copies: dict) -> bool:
+        if key not in self._by_id:
+            self._index(key)
+        cached = self._by_id[key].get(resource['id'])
+        single_resource = isinstance(self._data.get(key), dict)
+
+        if event_type == 'update' and cached is not None:
+            merged = merged_resource(cached, resource)
+            if single_resource:
+                self._data[key] = merged
+            else:
+                (resources, positions) = self._writable(key, copies)
+                resources[positions[resource['id']]] = merged
+            # Later events of the batch must see this version, the other indexes are rebuilt after the batch
+            self._by_id[key][resource['id']] = merged
+            return True
+
+        if event_type == 'add' and cached is None:
+            if single_resource:
+                # Only the bridge's own device is cached, other devices are not tracked
+                return False
+            (resources, positions) = self._writable(key, copies)
+            positions[resource['id']] = len(resources)
+            resources.append(resource)
+            self._index(key)
+            return True
+
+        if event_type == 'delete' and cached is not None:
+            if single_resource:
+                self._data[key] = {}
+            else:
+                copies.pop(key, None)
+                self._data[key] = [r for r in self._data[key] if r.get('id') != resource['id']]
+            self._index(key)
+            return True
+
+        return False
+
+    def flush(self):
+        """
+        Atomically write the in-memory changes back to the cache file. The events are replayed onto what is in the
+        file now, so collections another process refreshed since they were read here are not overwritten.
+        """
+        with self._lock.write(), self.storage.lock:
+            if not self._dirty:
+                return
+
+            on_disk = self.storage.read_all()
+            if on_disk is None:
+                # The cache was wiped, the events have nothing to apply to
+                self._pending = []
+                return
+
+            (self._data, self._by_id, self._by_name) = (on_disk, {}, {})
+            self._room_index = RoomIndex()
+            for key in self.INDEXED_KEYS:
+                self._index(key)
+                self._replay(key)
+            self.storage.write_all(self._data)
+
+            self._signature = self.storage.signature()
+            self._pending = []
+
+    # endregion
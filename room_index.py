@@ -0,0 +1,87 @@
+class RoomIndex:
+    """
+    Membership of rooms, devices, lights and grouped_lights, in both directions. The room side comes from the
+    cached rooms (their device children and light/grouped_light services), the light side from the owner of each
+    cached light. Each side is rebuilt on its own when its collection changes, queries combine the two.
+    """
+
+    def __init__(self):
+        # Room side
+        self.room_devices = {}
+        self.room_light_services = {}
+        self.room_grouped_light = {}
+        self.device_room = {}
+        self.light_service_room = {}
+        self.grouped_light_room = {}
+        # Light side
+        self.device_lights = {}
+        self.light_device = {}
+
+    def update_rooms(self, rooms: list[dict]):
+        (room_devices, room_light_services, room_grouped_light) = ({}, {}, {})
+        (device_room, light_service_room, grouped_light_room) = ({}, {}, {})
+
+        for room in rooms:
+            room_id = room.get('id')
+            if room_id is None:
+                continue
+
+            devices = [child['rid'] for child in room.get('children', []) if child['rtype'] == 'device']
+            lights = [service['rid'] for service in room.get('services', []) if service['rtype'] == 'light']
+            grouped_light_id = next((service['rid'] for service in room.get('services', [])
+                                     if service['rtype'] == 'grouped_light'), None)
+
+            room_devices[room_id] = devices
+            room_light_services[room_id] = lights
+            for device_id in devices:
+                device_room.setdefault(device_id, room_id)
+            for light_id in lights:
+                light_service_room.setdefault(light_id, room_id)
+            if grouped_light_id is not None:
+                room_grouped_light[room_id] = grouped_light_id
+                grouped_light_room[grouped_light_id] = room_id
+
+        (self.room_devices, self.room_light_services, self.room_grouped_light) = (
+            room_devices, room_light_services, room_grouped_light)
+        (self.device_room, self.light_service_room, self.grouped_light_room) = (
+            device_room, light_service_room, grouped_light_room)
+
+    def update_lights(self, lights: list[dict]):
+        (device_lights, light_device) = ({}, {})
+        for light in lights:
+            device_id = light.get('owner', {}).get('rid')
+            if 'id' not in light or device_id is None:
+                continue
+            device_lights.setdefault(device_id, []).append(light['id'])
+            light_device[light['id']] = device_id
+
+        (self.device_lights, self.light_device) = (device_lights, light_device)
+
+    # region Queries
+    def room_light_ids(self, room_id: str) -> list[str] | None:
+        """ The room's own light services, then the lights of its devices. None if the room is unknown """
+        services = self.room_light_services.get(room_id)
+        if services is None:
+            return None
+
+        light_ids = list(services)
+        for device_id in self.room_devices.get(room_id, []):
+            light_ids += [light_id for light_id in self.device_lights.get(device_id, []) if light_id not in services]
+        return light_ids
+
+    def light_room_id(self, light_id: str) -> str | None:
+        room_id = self.light_service_room.get(light_id)
+        if room_id is None:
+            room_id = self.device_room.get(self.light_device.get(light_id))
+        return room_id
+
+    def grouped_light_id(self, room_id: str) -> str | None:
+        return self.room_grouped_light.get(room_id)
+
+    def grouped_light_room_id(self, grouped_light_id: str) -> str | None:
+        return self.grouped_light_room.get(grouped_light_id)
+
+    def device_room_id(self, device_id: str) -> str | None:
+        return self.device_room.get(device_id)
+
+    # endregion
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import json
+import time
+from typing import NamedTuple, TYPE_CHECKING
+
+from colors import same_xy
+
+if TYPE_CHECKING:
+    from pyhue import Hue, LightStateResult
+
+BRIGHTNESS_TOLERANCE = 0.5
+
+
+class LightSnapshot(NamedTuple):
+    """ The restorable state of one light. mirek is set for lights in colour temperature mode, x/y otherwise """
+    on: bool | None
+    brightness: float | None
+    x: float | None
+    y: float | None
+    mirek: int | None
+
+
+def light_snapshot(light: dict) -> LightSnapshot:
+    temperature = light.get('color_temperature') or {}
+    mirek = temperature.get('mirek') if temperature.get('mirek_valid') else None
+    xy = (light.get('color') or {}).get('xy') if mirek is None else None
+    return LightSnapshot(
+        (light.get('on') or {}).get('on'),
+        (light.get('dimming') or {}).get('brightness'),
+        xy['x'] if xy is not None else None,
+        xy['y'] if xy is not None else None,
+        mirek,
+    )
+
+
+class Snapshot:
+    """ States of a set of lights, stored as one tuple per light """
+
+    def __init__(self, lights: dict[str, LightSnapshot], taken: float | None = None):
+        self.lights = lights
+        self.taken = time.time() if taken is None else taken
+
+    def to_json(self) -> str:
+        return json.dumps({'taken': self.taken, 'lights': {rid: list(state) for (rid, state) in self.lights.items()}},
+                          separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data: str) -> Snapshot:
+        parsed = json.loads(data)
+        return cls({rid: LightSnapshot(*state) for (rid, state) in parsed['lights'].items()}, parsed.get('taken'))
+
+    def __len__(self):
+        return len(self.lights)
+
+
+def capture(hue: Hue, light_ids: list[str] | None = None, cached: bool = False) -> Snapshot | None:
+    """
+    Snapshot lights from a single GET /resource/light
+    :param light_ids: Lights to include (None: all lights)
+    :param cached: Take the states from the cache instead (only current while the event stream runs)
+    :return: None if the lights couldn't be fetched
+    """
+    lights = hue.get_lights(cached=cached)
+    if lights is None:
+        return None
+
+    wanted = set(light_ids) if light_ids is not None else None
+    return Snapshot({light['id']: light_snapshot(light) for light in lights if wanted is None or light['id'] in wanted})
+
+
+def diff_state(target: LightSnapshot, current: LightSnapshot | None) -> dict:
+    """ The (partial) light state that takes a light from current to target, empty if nothing differs """
+    changes = {}
+    if target.on is not None and (current is None or current.on != target.on):
+        changes['on'] = {'on': target.on}
+    # A light that stays off doesn't need its colour and brightness fixed until it is turned on
+    if target.on is False:
+        return changes
+
+    if target.brightness is not None and (current is None or current.brightness is None or
+                                          abs(current.brightness - target.brightness) > BRIGHTNESS_TOLERANCE):
+        changes['dimming'] = {'brightness': target.brightness}
+
+    if target.mirek is not None:
+        if current is None or current.mirek != target.mirek:
+            changes['color_temperature'] = {'mirek': target.mirek}
+    elif target.x is not None and (current is None or current.x is None or
+                                   not same_xy((current.x, current.y), (target.x, target.y))):
+        changes['color'] = {'xy': {'x': target.x, 'y': target.y}}
+    return changes
+
+
+def diff(snapshot: Snapshot, current: Snapshot) -> dict[str, dict]:
+    """ light id -> changes, only for the lights that differ """
+    changes = {}
+    for (light_id, target) in snapshot.lights.items():
+        light_changes = diff_state(target, current.lights.get(light_id))
+        if len(light_changes) > 0:
+            changes[light_id] = light_changes
+    return changes
+
+
+def apply(hue: Hue, snapshot: Snapshot, cached: bool | None = None) -> list[LightStateResult]:
+    """
+    Bring the lights back to the snapshot, writing only the lights and fields that differ. A room whose lights
+    all need the same change gets a single grouped_light command, everything else is sent in bulk.
+    :param cached: Diff against the cache instead of fetching the current states (None: only while the event
+                   stream keeps the cache live)
+    :return: One result per command sent (empty if nothing differed)
+    """
+    if cached is None:
+        cached = hue.event_stream is not None
+    current = capture(hue, list(snapshot.lights), cached=cached)
+    changes = diff(snapshot, current if current is not None else Snapshot({}))
+    if len(changes) == 0:
+        return []
+
+    payloads = {light_id: json.dumps(light_changes, sort_keys=True) for (light_id, light_changes) in changes.items()}
+    writes = []
+
+    index = hue.cache.room_index()
+    for room_id in {index.light_room_id(light_id) for light_id in payloads} - {None}:
+        grouped_light_id = index.grouped_light_id(room_id)
+        light_ids = index.room_light_ids(room_id) or []
+        if grouped_light_id is None or len(light_ids) < 2:
+            continue
+        room_payloads = {payloads.get(light_id) for light_id in light_ids}
+        if len(room_payloads) == 1 and None not in room_payloads:
+            writes.append(('grouped_light', grouped_light_id, room_payloads.pop()))
+            for light_id in light_ids:
+                del payloads[light_id]
+
+    writes += [('light', light_id, payload) for (light_id, payload) in payloads.items()]
+    return hue.run_bulk(lambda write: hue.put_light_state(write[1], write[2], resource=write[0]), writes)
@@ -0,0 +1,7 @@
+import sys
+from os import path
+
+# The modules live at the repository root, the fake bridge in benchmarks/
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, path.join(ROOT, 'benchmarks'))
@@ -0,0 +1,167 @@
+import asyncio
+import contextlib
+import io
+import json
+
+import pytest
+
+from async_hue import AsyncHue
+from fake_bridge import FakeBridge, client_for, generate_home
+
+LIGHTS = 12
+LIGHTS_PER_ROOM = 4
+
+
+@pytest.fixture
+def bridge():
+    with FakeBridge(generate_home(lights=LIGHTS, lights_per_room=LIGHTS_PER_ROOM)) as bridge:
+        yield bridge
+
+
+@pytest.fixture
+def hue(bridge, tmp_path):
+    hue = client_for(bridge, data_dir=str(tmp_path))
+    yield hue
+    hue.close()
+
+
+def run(hue, fn):
+    """ Run fn(async_hue) on a fresh event loop and AsyncHue """
+    async def main():
+        async with AsyncHue(hue) as async_hue:
+            return await fn(async_hue)
+    return asyncio.run(main())
+
+
+def bridge_light(bridge, light_id: str) -> dict:
+    (status, data) = bridge.get('light', light_id)
+    assert status == 200
+    return json.loads(data)[0]
+
+
+def bridge_xy(bridge, light_id: str) -> tuple[float, float]:
+    xy = bridge_light(bridge, light_id)['color']['xy']
+    return xy['x'], xy['y']
+
+
+def expected_xy(hue, light_id: str, rgb: tuple[int, int, int]) -> tuple[float, float]:
+    xy = hue.light_state(rgb, True, None, hue.light_gamut(light_id))['color']['xy']
+    return xy['x'], xy['y']
+
+
+def room_of(bridge, index: int = 0) -> tuple[str, list[str]]:
+    room_id = bridge.resources['room'][index]['id']
+    return room_id, bridge.room_light_ids(room_id)
+
+
+# region GET
+def test_live_gets_return_the_bridge_resources(hue, bridge):
+    async def get_all(async_hue):
+        return await asyncio.gather(async_hue.get_lights(cached=False), async_hue.get_rooms(cached=False),
+                                    async_hue.get_scenes(cached=False), async_hue.get_device_info(cached=False))
+
+    (lights, rooms, scenes, devices) = run(hue, get_all)
+
+    for (resources, rtype) in ((lights, 'light'), (rooms, 'room'), (scenes, 'scene'), (devices, 'device')):
+        assert [r['id'] for r in resources] == [r['id'] for r in bridge.resources[rtype]]
+
+
+def test_cached_gets_do_not_reach_the_bridge(hue, bridge):
+    with contextlib.redirect_stdout(io.StringIO()):
+        hue.refresh_cache(scheduled_refresh=True)
+    before = bridge.requests
+
+    lights = run(hue, lambda async_hue: async_hue.get_lights())
+    room = run(hue, lambda async_hue: async_hue.get_room(bridge.resources['room'][1]['id']))
+
+    assert len(lights) == LIGHTS
+    assert room['metadata']['name'] == 'Room 1'
+    assert bridge.requests == before
+
+
+def test_get_room_of_unknown_id_is_none(hue):
+    assert run(hue, lambda async_hue: async_hue.get_room('does-not-exist', cached=False)) is None
+
+
+# endregion
+
+# region SET
+def test_set_light_state(hue, bridge):
+    light_id = bridge.resources['light'][0]['id']
+
+    result = run(hue, lambda async_hue: async_hue.set_light_state(light_id, (255, 0, 0), brightness=40))
+
+    assert result.ok and result.status_code == 200 and result.light_id == light_id
+    light = bridge_light(bridge, light_id)
+    assert light['on']['on'] is True
+    assert light['dimming']['brightness'] == pytest.approx(40)
+    assert bridge_xy(bridge, light_id) == pytest.approx(expected_xy(hue, light_id, (255, 0, 0)))
+    assert bridge_xy(bridge, light_id)[0] > 0.6  # Red
+
+
+def test_set_light_state_of_unknown_light_fails(hue):
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run(hue, lambda async_hue: async_hue.set_light_state('does-not-exist', (255, 0, 0)))
+    assert not result.ok and result.status_code == 404
+
+
+def test_set_lights_state(hue, bridge):
+    light_ids = [light['id'] for light in bridge.resources['light']]
+
+    results = run(hue, lambda async_hue: async_hue.set_lights_state(light_ids, (0, 0, 255), max_concurrency=3))
+
+    assert [result.light_id for result in results] == light_ids
+    assert all(result.ok for result in results)
+    for light_id in light_ids:
+        assert bridge_light(bridge, light_id)['on']['on'] is True
+        assert bridge_xy(bridge, light_id) == pytest.approx(expected_xy(hue, light_id, (0, 0, 255)))
+
+
+def test_set_room_light_states_with_one_colour_is_one_grouped_command(hue, bridge):
+    (room_id, light_ids) = room_of(bridge, 1)
+    other_lights = {light_id: bridge_light(bridge, light_id) for light_id in room_of(bridge, 2)[1]}
+    before = bridge.requests
+
+    results = run(hue, lambda async_hue: async_hue.set_room_light_states(room_id, (0, 255, 0)))
+
+    grouped_light_id = bridge.resources['room'][1]['services'][0]['rid']
+    assert [(result.light_id, result.ok) for result in results] == [(grouped_light_id, True)]
+    # GET of the room (nothing is cached) and the grouped_light PUT
+    assert bridge.requests - before == 2
+    for light_id in light_ids:
+        assert bridge_light(bridge, light_id)['on']['on'] is True
+        assert bridge_xy(bridge, light_id) == pytest.approx(expected_xy(hue, light_id, (0, 255, 0)))
+    # The lights of other rooms are left alone
+    assert {light_id: bridge_light(bridge, light_id) for light_id in other_lights} == other_lights
+
+
+def test_set_room_light_states_with_a_colour_per_light(hue, bridge):
+    (room_id, light_ids) = room_of(bridge)
+    colours = {light_id: [(255, 0, 0), (0, 0, 255)][i % 2] for (i, light_id) in enumerate(light_ids)}
+
+    results = run(hue, lambda async_hue: async_hue.set_room_light_states(room_id, colours))
+
+    assert sorted(result.light_id for result in results) == sorted(light_ids)
+    assert all(result.ok for result in results)
+    for (light_id, rgb) in colours.items():
+        assert bridge_xy(bridge, light_id) == pytest.approx(expected_xy(hue, light_id, rgb))
+
+
+def test_set_room_light_states_with_one_colour_for_some_lights_leaves_the_others_alone(hue, bridge):
+    (room_id, light_ids) = room_of(bridge)
+    others = {light_id: bridge_light(bridge, light_id) for light_id in light_ids[2:]}
+
+    results = run(hue, lambda async_hue: async_hue.set_room_light_states(room_id, dict.fromkeys(light_ids[:2],
+                                                                                                 (255, 0, 0))))
+
+    assert sorted(result.light_id for result in results) == sorted(light_ids[:2])
+    for light_id in light_ids[:2]:
+        assert bridge_xy(bridge, light_id) == pytest.approx(expected_xy(hue, light_id, (255, 0, 0)))
+    assert {light_id: bridge_light(bridge, light_id) for light_id in others} == others
+
+
+def test_set_room_light_states_of_unknown_room(hue):
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert run(hue, lambda async_hue: async_hue.set_room_light_states('does-not-exist', (1, 2, 3))) is None
+
+# endregion
@@ -0,0 +1,54 @@
+import contextlib
+import io
+
+import pytest
+
+from fake_bridge import FakeBridge, client_for, generate_home
+
+
+@pytest.fixture
+def bridge():
+    with FakeBridge(generate_home(lights=8, lights_per_room=4)) as bridge:
+        yield bridge
+
+
+@pytest.fixture
+def hue(bridge, tmp_path):
+    hue = client_for(bridge, data_dir=str(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        hue.refresh_cache(scheduled_refresh=True)
+    yield hue
+    hue.close()
+
+
+def test_queued_updates_of_a_light_are_merged_into_one_write(hue, bridge):
+    queue = hue.enable_command_queue(window=60)
+    light_id = bridge.resources['light'][0]['id']
+    before = bridge.requests
+
+    futures = [hue.queue_light_state(light_id, (255, 0, 0)),
+               hue.queue_light_state(light_id, (0, 0, 255), brightness=20)]
+    assert not any(future.done() for future in futures)
+    queue.flush()
+
+    assert all(future.result().ok for future in futures)
+    assert bridge.requests - before == 1
+    assert queue.counters['merged'] == 1
+
+
+def test_queue_light_state_without_a_queue_returns_a_future(hue, bridge):
+    light_id = bridge.resources['light'][0]['id']
+    assert hue.queue_light_state(light_id, (255, 0, 0)).result(5).ok
+
+
+def test_a_failing_flush_fails_the_futures(hue, bridge, monkeypatch):
+    queue = hue.enable_command_queue(window=0.01)
+
+    def broken():
+        raise RuntimeError('broken')
+
+    monkeypatch.setattr(queue, '_groups', broken)
+    future = hue.queue_light_state(bridge.resources['light'][0]['id'], (255, 0, 0))
+
+    with pytest.raises(RuntimeError, match='broken'):
+        future.result(5)
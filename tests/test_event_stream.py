@@ -0,0 +1,159 @@
+import contextlib
+import io
+import time
+
+import pytest
+
+from event_stream import _shutdown_socket, parse_sse_lines
+from fake_bridge import FakeBridge, client_for, generate_home
+
+LIGHTS = 8
+
+
+@pytest.fixture
+def bridge():
+    with FakeBridge(generate_home(lights=LIGHTS)) as bridge:
+        yield bridge
+
+
+@pytest.fixture
+def hue(bridge, tmp_path):
+    hue = client_for(bridge, data_dir=str(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        hue.refresh_cache(scheduled_refresh=True)
+    yield hue
+    hue.close()
+
+
+@pytest.fixture
+def stream(hue):
+    stream = hue.start_event_stream(flush_interval=0.05)
+    assert stream.connected.wait(5)
+    hue.wait_for_revalidation(5)  # The resync after connecting
+    return stream
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def light_event(event_type: str, light_id: str, **changes) -> list[dict]:
+    return [{'type': event_type, 'data': [{'id': light_id, 'type': 'light', **changes}]}]
+
+
+def flushed_light(hue, light_id: str) -> dict | None:
+    return {light['id']: light for light in hue.cache.storage.read_section('lights')}.get(light_id)
+
+
+# region SSE
+def test_parse_sse_lines():
+    lines = [': hi', '', 'id: 1', 'data: [1,', 'data:2]', '', 'data: [3]', '', 'id: 4', '']
+    assert list(parse_sse_lines(lines)) == [('1', '[1,\n2]'), ('1', '[3]')]
+
+
+# endregion
+
+# region Events
+def test_update_is_applied_to_the_cache(hue, bridge, stream):
+    light_id = bridge.resources['light'][0]['id']
+    on = not hue.cache.by_id('lights', light_id)['on']['on']
+
+    bridge.publish(light_event('update', light_id, on={'on': on}))
+
+    assert wait_for(lambda: hue.cache.by_id('lights', light_id)['on']['on'] == on)
+    # The rest of the light is kept
+    assert hue.cache.by_id('lights', light_id)['metadata'] == bridge.resources['light'][0]['metadata']
+
+
+def test_add_and_delete(hue, bridge, stream):
+    new_light = dict(bridge.resources['light'][0], id='new-light')
+
+    bridge.publish([{'type': 'add', 'data': [new_light]}])
+    assert wait_for(lambda: hue.cache.by_id('lights', 'new-light') is not None)
+    assert len(hue.get_lights()) == LIGHTS + 1
+
+    bridge.publish(light_event('delete', 'new-light'))
+    assert wait_for(lambda: hue.cache.by_id('lights', 'new-light') is None)
+    assert len(hue.get_lights()) == LIGHTS
+
+
+def test_events_are_flushed_together(hue, bridge, stream):
+    light_ids = [light['id'] for light in bridge.resources['light']]
+    writes = []
+    write_all = hue.cache.storage.write_all
+    hue.cache.storage.write_all = lambda data: (writes.append(data), write_all(data))
+
+    for light_id in light_ids:
+        bridge.publish(light_event('update', light_id, dimming={'brightness': 12.5}))
+
+    assert wait_for(lambda: all(flushed_light(hue, light_id)['dimming']['brightness'] == 12.5
+                                for light_id in light_ids))
+    assert 1 <= len(writes) < len(light_ids)
+
+
+def test_stop_flushes_pending_changes_right_away(hue, bridge, tmp_path):
+    stream = hue.start_event_stream(flush_interval=60)
+    assert stream.connected.wait(5)
+    hue.wait_for_revalidation(5)
+    light_id = bridge.resources['light'][0]['id']
+
+    bridge.publish(light_event('update', light_id, on={'on': True}, dimming={'brightness': 3.0}))
+    assert wait_for(lambda: hue.cache.by_id('lights', light_id)['dimming']['brightness'] == 3.0)
+
+    start = time.perf_counter()
+    hue.stop_event_stream()
+    assert time.perf_counter() - start < 1.0
+    assert flushed_light(hue, light_id)['dimming']['brightness'] == 3.0
+    assert hue.event_stream is None
+
+
+def test_events_for_collections_that_are_not_cached_are_ignored(hue, bridge, stream):
+    hue.cache.storage.remove()
+    hue.cache.invalidate()
+    light_id = bridge.resources['light'][0]['id']
+
+    bridge.publish(light_event('update', light_id, on={'on': True}))
+    assert wait_for(lambda: stream.events_received > 0)
+    hue.stop_event_stream()
+
+    assert hue.cache.get('lights') is None
+
+
+# endregion
+
+# region Reconnect
+def test_reconnect_resyncs_what_was_missed(hue, bridge, stream):
+    light_id = bridge.resources['light'][0]['id']
+    brightness = hue.cache.by_id('lights', light_id)['dimming']['brightness'] / 2 + 1
+    # Changed without an event, as if it was sent while the stream was disconnected
+    with bridge._lock:
+        bridge._update('light', light_id, {'dimming': {'brightness': brightness}})
+
+    _shutdown_socket(stream._response)
+
+    assert wait_for(lambda: stream.reconnects == 1 and stream.connected.is_set())
+    assert wait_for(lambda: hue.cache.by_id('lights', light_id)['dimming']['brightness'] == brightness)
+
+    # Events are applied on the new connection
+    bridge.publish(light_event('update', light_id, on={'on': False}))
+    assert wait_for(lambda: hue.cache.by_id('lights', light_id)['on']['on'] is False)
+
+
+def test_unflushed_events_survive_a_refresh(hue, bridge, stream):
+    stream.flush_interval = 60
+    light_id = bridge.resources['light'][0]['id']
+    brightness = hue.cache.by_id('lights', light_id)['dimming']['brightness'] / 2 + 1
+
+    bridge.publish(light_event('update', light_id, dimming={'brightness': brightness}))
+    assert wait_for(lambda: hue.cache.by_id('lights', light_id)['dimming']['brightness'] == brightness)
+    with contextlib.redirect_stdout(io.StringIO()):
+        hue.refresh_cache(scheduled_refresh=False, refresh_scenes=True)
+
+    assert hue.cache.by_id('lights', light_id)['dimming']['brightness'] == brightness
+
+# endregion
@@ -0,0 +1,64 @@
+import contextlib
+import io
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from bench_threads import refresh_process, worker
+from fake_bridge import FakeBridge, client_for, generate_home
+
+THREADS = 16
+SECONDS = 1.0
+
+
+@pytest.fixture
+def bridge():
+    with FakeBridge(generate_home(lights=50)) as bridge:
+        yield bridge
+
+
+def test_threads_sharing_one_client(bridge, tmp_path):
+    hue = client_for(bridge, data_dir=str(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()):
+        hue.refresh_cache(scheduled_refresh=True)
+    lights = hue.get_lights()
+    names = [light['metadata']['name'] for light in lights]
+    light_ids = [light['id'] for light in lights]
+
+    results = []
+    errors = []
+    deadline = time.perf_counter() + SECONDS
+    threads = [threading.Thread(target=worker, args=(hue, names, light_ids, seed, deadline, results, errors))
+               for seed in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    hue.close()
+
+    assert errors == []
+    assert len(results) == THREADS
+    assert all(sum(done[key] for done in results) > 0 for key in ('lookup', 'set', 'bulk'))
+    assert len(hue.cache.get('lights')) == len(light_ids)
+
+
+@pytest.mark.parametrize('refreshes', [1, 5])
+def test_processes_refreshing_different_collections_of_one_file(bridge, tmp_path, refreshes):
+    keys = ['device', 'lights', 'rooms', 'scenes']
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(len(keys))
+    processes = [context.Process(target=refresh_process,
+                                 args=(bridge.clip_url, str(tmp_path), key, barrier, refreshes))
+                 for key in keys]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+
+    assert [process.exitcode for process in processes] == [0] * len(keys)
+    hue = client_for(bridge, data_dir=str(tmp_path))
+    data = hue.cache.storage.read_all() or {}
+    hue.close()
+    assert [key for key in keys if not data.get(key)] == []
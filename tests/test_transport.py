@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+import pytest
+
+from transport import CircuitBreaker, HueCircuitOpenError, HueConnectionError, Transport
+
+
+class Response:
+    def __init__(self, status_code: int = 200, headers: dict | None = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class Unreachable(Exception):
+    pass
+
+
+class Timeout(Unreachable):
+    pass
+
+
+def transport(**kwargs) -> Transport:
+    breaker = CircuitBreaker(failure_threshold=kwargs.pop('failure_threshold', 2), reset_timeout=0.05)
+    return Transport(backoff=0.0, circuit_breaker=breaker, **kwargs)
+
+
+def call(t: Transport, send, method: str = 'GET'):
+    return t.call(method, send, (Unreachable,), (Timeout,))
+
+
+def unreachable(timeout):
+    raise Unreachable('no route to host')
+
+
+def open_circuit(t: Transport):
+    for _ in range(t.circuit_breaker.failure_threshold):
+        with pytest.raises(HueConnectionError):
+            call(t, unreachable)
+    assert t.circuit_breaker.state == 'open'
+
+
+# region Retries
+def test_retries_busy_bridge_until_it_answers():
+    responses = [Response(503), Response(429, {'Retry-After': '0'}), Response(200)]
+    retries = []
+
+    response = transport().call('PUT', lambda timeout: responses.pop(0), (Unreachable,), (Timeout,), retries.append)
+
+    assert response.status_code == 200
+    assert retries == ['503', '429']
+
+
+def test_returns_the_last_busy_response_when_out_of_retries():
+    assert call(transport(retries=1), lambda timeout: Response(503)).status_code == 503
+
+
+def test_does_not_repeat_a_post_that_may_have_reached_the_bridge():
+    attempts = []
+
+    def send(timeout):
+        attempts.append(timeout)
+        raise Timeout('read timed out')
+
+    with pytest.raises(HueConnectionError):
+        call(transport(failure_threshold=10), send, method='POST')
+    assert len(attempts) == 1
+
+
+def test_timeouts_are_cut_to_the_deadline():
+    (connect, read) = Transport(deadline=1.0).timeout(time.monotonic() - 0.5)
+    assert connect <= 0.5 and read <= 0.5
+
+
+def test_with_deadline_keeps_the_circuit_breaker():
+    t = transport()
+    short = t.with_deadline(0.5)
+    (connect, read) = short.timeout(time.monotonic())
+    assert connect <= 0.5 and read <= 0.5
+    assert t.deadline == 15.0 and short.circuit_breaker is t.circuit_breaker
+
+
+# endregion
+
+# region Circuit breaker
+def test_open_circuit_fails_fast_then_lets_a_probe_through():
+    t = transport(retries=0)
+    open_circuit(t)
+    with pytest.raises(HueCircuitOpenError):
+        call(t, lambda timeout: Response())
+
+    time.sleep(0.06)
+    assert t.circuit_breaker.state == 'half_open'
+    assert call(t, lambda timeout: Response()).status_code == 200
+    assert t.circuit_breaker.state == 'closed'
+
+
+def test_failed_probe_opens_the_circuit_again():
+    t = transport(retries=0)
+    open_circuit(t)
+    time.sleep(0.06)
+    with pytest.raises(HueConnectionError):
+        call(t, unreachable)
+    assert t.circuit_breaker.state == 'open'
+
+
+@pytest.mark.parametrize('error', [KeyboardInterrupt, RuntimeError])
+def test_probe_that_raises_something_else_does_not_block_the_circuit(error):
+    t = transport(retries=0)
+    open_circuit(t)
+    time.sleep(0.06)
+
+    def send(timeout):
+        raise error()
+
+    with pytest.raises(error):
+        call(t, send)
+
+    time.sleep(0.06)
+    assert call(t, lambda timeout: Response()).status_code == 200
+
+
+def test_cancelled_async_probe_does_not_block_the_circuit():
+    t = transport(retries=0)
+    open_circuit(t)
+    time.sleep(0.06)
+
+    async def hang(timeout):
+        await asyncio.sleep(10)
+
+    async def ok(timeout):
+        return Response()
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(t.call_async('GET', hang, (Unreachable,), (Timeout,)), 0.01)
+        await asyncio.sleep(0.06)
+        return await t.call_async('GET', ok, (Unreachable,), (Timeout,))
+
+    assert asyncio.run(main()).status_code == 200
+
+# endregion
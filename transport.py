@@ -0,0 +1,256 @@
+import copy
+import email.utils
+import random
+import threading
+import time
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+# 429: over the bridge's command budget, 503: the bridge is busy. Both mean the command was not executed.
+RETRY_STATUSES = (429, 503)
+
+
+# region Exceptions
+class HueError(Exception):
+    """ Base class of everything the Hue clients raise """
+
+
+class HueRequestError(HueError, ValueError):
+    """ The request was invalid before it was sent (e.g. a PUT without a body) """
+
+
+class HueConnectionError(HueError):
+    """ The bridge could not be reached """
+
+
+class HueTimeoutError(HueConnectionError):
+    """ The bridge did not answer in time """
+
+
+class HueCircuitOpenError(HueConnectionError):
+    """ The bridge failed repeatedly, requests fail fast until the circuit breaker lets one through again """
+
+
+class HueLinkError(HueError):
+    """ Linking with the bridge failed, most likely because the link button wasn't pressed """
+
+
+class HueDaemonError(HueError):
+    """
+    The daemon took a command but didn't answer (it may still run it, so it isn't run again here),
+    or running it raised an error
+    """
+
+
+class HueCommandError(HueError):
+    """ A CLI command failed, its output says why """
+
+
+# endregion
+
+
+def retry_after(headers) -> float | None:
+    """ The Retry-After header in seconds (it can be a number of seconds or an HTTP date) """
+    value = headers.get('Retry-After') if headers is not None else None
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures to reach the bridge. After failure_threshold of them the circuit opens and
+    requests fail immediately for reset_timeout seconds, then a single probe request is let through:
+    if it succeeds the circuit closes again, otherwise it stays open for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def before_request(self):
+        """ :raise HueCircuitOpenError: While the circuit is open """
+        with self._lock:
+            if self.opened_at is None:
+                return
+
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise HueCircuitOpenError(f'The bridge is unreachable, not trying again for {max(0.0, remaining):.1f}s')
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class Transport:
+    """
+    Timeouts, retries and the circuit breaker for CLIP requests. Failed attempts are retried with full-jitter
+    exponential backoff, or after the Retry-After the bridge asked for, as long as the request's deadline allows.
+    The deadline bounds how long a single request can take including all retries.
+    """
+
+    def __init__(self,
+                 connect_timeout: float = 3.0,
+                 read_timeout: float = 10.0,
+                 retries: int = 3,
+                 backoff: float = 0.1,
+                 max_backoff: float = 2.0,
+                 deadline: float = 15.0,
+                 circuit_breaker: CircuitBreaker | None = None):
+        """
+        :param retries: Attempts after the first one (0: never retry)
+        :param backoff: Upper bound of the first retry's random delay, doubled for every further retry
+        :param max_backoff: Cap of the exponential backoff (a Retry-After from the bridge may be longer)
+        :param deadline: Seconds after which no further attempt is started
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+
+    def with_deadline(self, deadline: float) -> 'Transport':
+        """ The same transport (and circuit breaker) with another deadline """
+        transport = copy.copy(self)
+        transport.deadline = deadline
+        return transport
+
+    def timeout(self, started: float) -> tuple[float, float]:
+        """ (connect, read) timeouts of the next attempt, shortened to what is left of the deadline """
+        remaining = max(0.001, self.deadline - (time.monotonic() - started))
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    def _delay(self, attempt: int, started: float, response=None) -> float | None:
+        """ Seconds to wait before the next attempt, or None if there is no retry left """
+        if attempt >= self.retries:
+            return None
+
+        delay = retry_after(response.headers) if response is not None else None
+        if delay is None:
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+        if time.monotonic() - started + delay >= self.deadline:
+            return None
+        return delay
+
+    def _next(self, method: str, attempt: int, started: float, response, error: Exception | None,
+              timeout_errors: tuple, on_retry) -> float | None:
+        """
+        Decide what happens after an attempt
+        :return: Seconds to wait before retrying, or None if the response should be returned
+        :raise HueConnectionError: If the bridge couldn't be reached and there is no retry left
+        """
+        if error is None:
+            # Even a 429 or 503 shows that the bridge is reachable
+            self.circuit_breaker.record_success()
+            if response.status_code not in RETRY_STATUSES:
+                return None
+            reason = str(response.status_code)
+            delay = self._delay(attempt, started, response)
+        else:
+            self.circuit_breaker.record_failure()
+            reason = 'timeout' if isinstance(error, timeout_errors) else 'connection'
+            # The bridge might have executed a request that timed out, only repeat those that are safe to repeat
+            delay = self._delay(attempt, started) if method in IDEMPOTENT_METHODS else None
+            if delay is None:
+                if isinstance(error, timeout_errors):
+                    raise HueTimeoutError(f'{method} request timed out: {error}') from error
+                raise HueConnectionError(f'{method} request failed: {error}') from error
+
+        if delay is not None and on_retry is not None:
+            on_retry(reason)
+        return delay
+
+    def call(self, method: str, send, errors: tuple, timeout_errors: tuple, on_retry=None):
+        """
+        Run send(timeout) until it returns a response that shouldn't be retried
+        :param send: Sends one attempt with the given (connect, read) timeouts and returns the response
+        :param errors: Exceptions send raises when the bridge couldn't be reached
+        :param timeout_errors: The subset of errors that are timeouts
+        :param on_retry: Called with the reason ('429', '503', 'timeout', 'connection') before every retry
+        """
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            self.circuit_breaker.before_request()
+            (response, error) = (None, None)
+            try:
+                response = send(self.timeout(started))
+            except errors as e:
+                error = e
+            except BaseException:
+                # Cancelled, interrupted or an error outside errors: a half-open probe must not stay in flight
+                self.circuit_breaker.record_failure()
+                raise
+
+            delay = self._next(method, attempt, started, response, error, timeout_errors, on_retry)
+            if delay is None:
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, method: str, send, errors: tuple, timeout_errors: tuple, on_retry=None):
+        """ Same as call, but send is a coroutine function and waiting yields to the event loop """
+        import asyncio
+
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            self.circuit_breaker.before_request()
+            (response, error) = (None, None)
+            try:
+                response = await send(self.timeout(started))
+            except errors as e:
+                error = e
+            except BaseException:
+                # Cancelled, interrupted or an error outside errors: a half-open probe must not stay in flight
+                self.circuit_breaker.record_failure()
+                raise
+
+            delay = self._next(method, attempt, started, response, error, timeout_errors, on_retry)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def request_failed(response) -> bool:
+    """ True unless the bridge answered 200 with a JSON body without errors """
+    if response.status_code != 200:
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    return not isinstance(body, dict) or len(body.get('errors') or []) > 0